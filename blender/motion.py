@@ -1,5 +1,6 @@
 import os
 import re
+import struct
 import subprocess
 from pathlib import Path
 
@@ -10,7 +11,19 @@ BONE = "forearm.R"
 FLOAT_RE = re.compile(r"\d+(?:\.\d*(?:e[-+]\d+)?)?")
 PIPE_PATH = "/tmp/imu-relay.pipe"
 
+# "text" or "binary". This must match the sub --pipe-format option.
+PIPE_FORMAT = "text"
+
+# The binary pipe record: device index, timestamp, and quaternion. See
+# imu_tools/pipe.py.
+PIPE_RECORD = struct.Struct("<HI4f")
+PIPE_ANNOUNCE_FLAG = 0x8000
+# Read up to the default Linux pipe capacity in one call
+PIPE_READ_SIZE = 1 << 16
+
 fp = None
+pipe_fd = None
+pipe_pending = b""
 active = False
 
 print("objects =", bpy.data.objects.keys())
@@ -18,8 +31,35 @@ ob = bpy.data.objects["free3dmodel_skeleton"]
 print("bones =", ob.pose.bones.keys())
 
 
+def read_latest_quaternion():
+    """Read everything that is waiting in the binary pipe, and return the
+    quaternion from the last complete record, or None."""
+    global pipe_pending
+    try:
+        data = os.read(pipe_fd, PIPE_READ_SIZE)
+    except BlockingIOError:
+        return None
+    data = pipe_pending + data
+    end = len(data) - len(data) % PIPE_RECORD.size
+    pipe_pending = data[end:]
+    for offset in range(end - PIPE_RECORD.size, -1, -PIPE_RECORD.size):
+        device, _timestamp, *q_angle = PIPE_RECORD.unpack_from(data, offset)
+        if not device & PIPE_ANNOUNCE_FLAG:
+            return q_angle
+    return None
+
+
 def update_angle():
-    if not active or not fp:
+    if not active:
+        return 0.1
+    if PIPE_FORMAT == "binary":
+        if pipe_fd is None:
+            return 0.1
+        q_angle = read_latest_quaternion()
+        if q_angle:
+            ob.pose.bones[BONE].rotation_quaternion = mathutils.Vector(q_angle)
+        return 0.05
+    if not fp:
         return 0.1
     line = None
     while True:
@@ -53,11 +93,15 @@ class ModalOperator(bpy.types.Operator):
         return {"FINISHED"}
 
     def modal(self, _context, event):
-        global active, fp
+        global active, fp, pipe_fd
         if event.type in {"LEFTMOUSE", "ESC"}:
             active = False
-            fp.close()
-            fp = None
+            if fp:
+                fp.close()
+                fp = None
+            if pipe_fd is not None:
+                os.close(pipe_fd)
+                pipe_fd = None
             return {"FINISHED"}
         if event.type in {"RIGHTMOUSE", "ESC"}:
             active = False
@@ -65,10 +109,13 @@ class ModalOperator(bpy.types.Operator):
         return {"RUNNING_MODAL"}
 
     def invoke(self, _context, _event):
-        global active, fp
+        global active, fp, pipe_fd
         active = True
         if not Path(PIPE_PATH).exists():
             subprocess.run(["mkfifo", PIPE_PATH], check=True)
+        if PIPE_FORMAT == "binary":
+            pipe_fd = os.open(PIPE_PATH, os.O_RDONLY | os.O_NONBLOCK)
+            return {"RUNNING_MODAL"}
         fp = open(
             PIPE_PATH, "r", opener=lambda p, _f: os.open(p, os.O_RDONLY | os.O_NONBLOCK)
         )
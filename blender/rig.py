@@ -0,0 +1,235 @@
+"""Drive several bones of an armature from several IMUs.
+
+Run `poetry run sub --pipe --pipe-format binary`, and launch Blender with the
+`--python blender/rig.py` option.
+
+The mapping file (MAPPING_PATH, or the IMU_RIG_MAPPING environment variable)
+names the armature, and maps device ids to bones. See rig-mapping.example.json.
+
+A background thread reads the pipe, and keeps the two newest samples of each
+device. The timer only applies the newest pose of each bone: it slerps from the
+previous sample to the newest one over one sample interval, so the bones move
+smoothly at the display rate, whatever the sample rate.
+
+If BAKE is set, every sample is also buffered, and when the take is finished
+(with the left mouse button) the buffered samples are written to the armature's
+action as keyframes, in bulk. Escape or the right mouse button discards the take.
+"""
+
+import json
+import os
+import select
+import struct
+import subprocess
+import threading
+import time
+from array import array
+from pathlib import Path
+
+import bpy
+import mathutils
+import numpy as np
+
+PIPE_PATH = "/tmp/imu-relay.pipe"
+MAPPING_PATH = os.environ.get("IMU_RIG_MAPPING", "//imu-rig.json")
+
+# The binary pipe record: device index, timestamp, and quaternion. See
+# imu_tools/pipe.py.
+PIPE_RECORD = struct.Struct("<HI4f")
+PIPE_ANNOUNCE_FLAG = 0x8000
+PIPE_READ_SIZE = 1 << 16
+
+# The value of the "LINEAR" item of the Keyframe.interpolation enum
+LINEAR_INTERPOLATION = 1
+
+# Seconds between timer updates
+UPDATE_INTERVAL = 1 / 60
+
+# Record the take into the action. The keyframes start at the current frame,
+# and are spaced by the payload timestamps.
+BAKE = False
+
+
+def load_mapping(path=MAPPING_PATH):
+    """Return (armature object, {device id: pose bone})."""
+    with open(bpy.path.abspath(path)) as fp:
+        mapping = json.load(fp)
+    ob = bpy.data.objects[mapping["armature"]]
+    bones = {}
+    for device_id, bone_name in mapping["bones"].items():
+        bone = ob.pose.bones.get(bone_name)
+        if bone is None:
+            print("Skipping {}: no bone named {}".format(device_id, bone_name))
+            continue
+        bone.rotation_mode = "QUATERNION"
+        bones[device_id] = bone
+    return ob, bones
+
+
+class PipeReader(threading.Thread):
+    """Reads quaternion records from the pipe, and keeps the two newest
+    (arrival time, quaternion) samples of each device in samples.
+
+    If bake is true, every sample is also appended to take, which maps each
+    device id to a pair of arrays: the payload timestamps, and the flattened
+    quaternions."""
+
+    def __init__(self, path=PIPE_PATH, bake=False):
+        super().__init__(daemon=True)
+        self.path = path
+        # device id -> (previous sample, newest sample). Each item is replaced,
+        # never mutated, so that the timer can read it without a lock.
+        self.samples = {}
+        self.take = {} if bake else None
+        self.stopping = False
+
+    def run(self):
+        device_ids = {}
+        pending = b""
+        fd = os.open(self.path, os.O_RDONLY | os.O_NONBLOCK)
+        try:
+            while not self.stopping:
+                if not select.select([fd], [], [], 0.1)[0]:
+                    continue
+                data = os.read(fd, PIPE_READ_SIZE)
+                if not data:
+                    time.sleep(0.1)  # no writer yet, or it closed the pipe
+                    continue
+                arrival = time.monotonic()
+                data = pending + data
+                end = len(data) - len(data) % PIPE_RECORD.size
+                pending = data[end:]
+                newest = {}
+                for offset in range(0, end, PIPE_RECORD.size):
+                    index = struct.unpack_from("<H", data, offset)[0]
+                    if index & PIPE_ANNOUNCE_FLAG:
+                        name = data[offset + 2 : offset + PIPE_RECORD.size]
+                        name = name.rstrip(b"\0").decode()
+                        device_ids[index & ~PIPE_ANNOUNCE_FLAG] = name
+                        continue
+                    device_id = device_ids.get(index)
+                    if device_id is None:
+                        continue
+                    _index, timestamp, *q = PIPE_RECORD.unpack_from(data, offset)
+                    newest[device_id] = q
+                    if self.take is not None:
+                        if device_id not in self.take:
+                            self.take[device_id] = (array("I"), array("f"))
+                        timestamps, quaternions = self.take[device_id]
+                        timestamps.append(timestamp)
+                        quaternions.extend(q)
+                for device_id, q in newest.items():
+                    previous = self.samples.get(device_id, (None, None))[1]
+                    self.samples[device_id] = (previous, (arrival, q))
+        finally:
+            os.close(fd)
+
+
+def interpolate(previous, newest, now):
+    """Slerp from the previous sample to the newest, over the interval between
+    them."""
+    q = mathutils.Quaternion(newest[1])
+    if previous is None:
+        return q
+    interval = newest[0] - previous[0]
+    if interval <= 0:
+        return q
+    fraction = min(1.0, (now - newest[0]) / interval)
+    return mathutils.Quaternion(previous[1]).slerp(q, fraction)
+
+
+def bake_take(take, scene):
+    """Write a take to the armature's action, as one keyframe per sample, with
+    linear interpolation."""
+    if ob.animation_data is None:
+        ob.animation_data_create()
+    if ob.animation_data.action is None:
+        ob.animation_data.action = bpy.data.actions.new(ob.name + "Action")
+    action = ob.animation_data.action
+    frames_per_ms = scene.render.fps / scene.render.fps_base / 1000
+    for device_id, (timestamps, quaternions) in take.items():
+        bone = bones.get(device_id)
+        if bone is None or not timestamps:
+            continue
+        # The timestamps are uint32 milliseconds, and may wrap.
+        timestamps = np.frombuffer(timestamps, dtype=np.uint32)
+        elapsed = (timestamps - timestamps[0]).astype(np.float32)
+        frames = scene.frame_current + elapsed * frames_per_ms
+        q = np.frombuffer(quaternions, dtype=np.float32).reshape(-1, 4)
+        # q and -q are the same rotation. Keep consecutive keyframes in the
+        # same hemisphere, so that the curves interpolate the short way around.
+        signs = np.sign(np.einsum("ij,ij->i", q[1:], q[:-1]))
+        signs[signs == 0] = 1
+        q = q * np.concatenate([[1], np.cumprod(signs)])[:, np.newaxis]
+        data_path = 'pose.bones["{}"].rotation_quaternion'.format(bone.name)
+        for axis in range(4):
+            fcurve = action.fcurves.find(data_path, index=axis)
+            if fcurve is None:
+                fcurve = action.fcurves.new(
+                    data_path, index=axis, action_group=bone.name
+                )
+            points = fcurve.keyframe_points
+            existing = np.zeros(2 * len(points), dtype=np.float32)
+            points.foreach_get("co", existing)
+            co = np.empty((len(frames), 2), dtype=np.float32)
+            co[:, 0] = frames
+            co[:, 1] = q[:, axis]
+            points.add(len(frames))
+            points.foreach_set("co", np.concatenate([existing, co.ravel()]))
+            points.foreach_set(
+                "interpolation", np.full(len(points), LINEAR_INTERPOLATION, np.int32)
+            )
+            fcurve.update()
+        print("Baked {} samples to {}".format(len(frames), bone.name))
+
+
+reader = None
+ob, bones = load_mapping()
+print("bones =", {device_id: bone.name for device_id, bone in bones.items()})
+
+
+def update_pose():
+    if not reader:
+        return 0.1
+    now = time.monotonic()
+    for device_id, (previous, newest) in list(reader.samples.items()):
+        bone = bones.get(device_id)
+        if bone is not None:
+            bone.rotation_quaternion = interpolate(previous, newest, now)
+    return UPDATE_INTERVAL
+
+
+bpy.app.timers.register(update_pose)
+
+
+class RigModalOperator(bpy.types.Operator):
+    bl_idname = "object.imu_rig_modal_operator"
+    bl_label = "IMU Rig Modal Operator"
+
+    def execute(self, _context):
+        return {"FINISHED"}
+
+    def modal(self, context, event):
+        global reader
+        if event.type in {"LEFTMOUSE", "RIGHTMOUSE", "ESC"}:
+            if reader:
+                reader.stopping = True
+                reader.join()
+                if reader.take and event.type == "LEFTMOUSE":
+                    bake_take(reader.take, context.scene)
+                reader = None
+            return {"FINISHED"} if event.type == "LEFTMOUSE" else {"CANCELLED"}
+        return {"RUNNING_MODAL"}
+
+    def invoke(self, context, _event):
+        global reader
+        if not Path(PIPE_PATH).exists():
+            subprocess.run(["mkfifo", PIPE_PATH], check=True)
+        reader = PipeReader(bake=BAKE)
+        reader.start()
+        context.window_manager.modal_handler_add(self)
+        return {"RUNNING_MODAL"}
+
+
+bpy.utils.register_class(RigModalOperator)
+bpy.ops.object.imu_rig_modal_operator("INVOKE_DEFAULT")
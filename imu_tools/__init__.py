@@ -1,2 +1,7 @@
+from .aggregate import main as aggregate
+from .bench import main as bench
+from .broker import main as broker
+from .control import main as control
+from .fusion import main as fuse
 from .sub import main as sub
 from .pub import main as pub
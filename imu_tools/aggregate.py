@@ -0,0 +1,177 @@
+"""Windowed aggregation of sensor samples, republished at a reduced rate.
+
+`aggregate` subscribes to the raw samples, and every window publishes one
+message per device to imu-agg/<window>/<device_id>. The message has the shape
+of a sample, so that existing clients can subscribe to it instead: each field
+is the mean over the window, and the quaternion is the average orientation.
+It also has the count and the last timestamp of the window's samples, and the
+min, max, and last value of each field.
+"""
+
+import json
+import sys
+import time
+from queue import Queue
+
+import click
+import numpy as np
+import paho.mqtt.client as mqtt
+from loguru import logger
+
+from .batch import split_message
+from .config import mqtt_options
+from .recording import device_id_from_topic
+from .sensor_encoding import decode_payload
+from .sub import drain_queue
+
+logger.remove()
+logger.add(sys.stdout, format="<dim>{time:mm:ss.SS}:</> {message}", level="INFO")
+
+AGGREGATE_FIELDS = (
+    "accelerometer",
+    "calibration",
+    "euler",
+    "gyroscope",
+    "linear_acceleration",
+    "magnetometer",
+    "temperature",
+)
+
+
+def average_quaternion(quaternions):
+    """Return the average of an N×4 array of unit quaternions.
+
+    This is the eigenvector of the largest eigenvalue of sum(q qᵀ) (Markley et
+    al., 2007), which, unlike the component-wise mean, doesn't depend on the
+    signs of the quaternions.
+    """
+    q = np.asarray(quaternions, dtype=float)
+    _values, vectors = np.linalg.eigh(q.T @ q)
+    average = vectors[:, -1]
+    # Choose the sign that is nearest the last sample, for continuity
+    return average if average @ q[-1] >= 0 else -average
+
+
+def window_label(window):
+    """0.1 -> "100ms"; 2 -> "2s" """
+    return f"{window * 1000:g}ms" if window < 1 else f"{window:g}s"
+
+
+def aggregate_samples(samples):
+    """Return the aggregate of a non-empty list of sample dicts."""
+    result = {"count": len(samples)}
+    timestamps = [s["timestamp"] for s in samples if "timestamp" in s]
+    if timestamps:
+        result["timestamp"] = timestamps[-1]
+    stats = {"min": {}, "max": {}, "last": {}}
+    for name in AGGREGATE_FIELDS:
+        values = [s[name] for s in samples if s.get(name) is not None]
+        if not values:
+            continue
+        values = np.array(values, dtype=float)
+        result[name] = values.mean(axis=0).tolist()
+        stats["min"][name] = values.min(axis=0).tolist()
+        stats["max"][name] = values.max(axis=0).tolist()
+        stats["last"][name] = values[-1].tolist()
+    quaternions = [s["quaternion"] for s in samples if s.get("quaternion")]
+    if quaternions:
+        result["quaternion"] = average_quaternion(quaternions).tolist()
+        stats["last"]["quaternion"] = list(quaternions[-1])
+    result.update(stats)
+    return result
+
+
+class WindowAggregator:
+    """Buffers each device's samples, for one window."""
+
+    def __init__(self, window):
+        self.window = window
+        self.topic_prefix = "imu-agg/" + window_label(window)
+        self.samples = {}
+        self.next_flush = time.monotonic() + window
+
+    def append(self, device_id, data):
+        self.samples.setdefault(device_id, []).append(data)
+
+    def flush(self):
+        """Return a list of (topic, aggregate) for the devices that have sent
+        samples in this window, and start the next window."""
+        results = [
+            (f"{self.topic_prefix}/{device_id}", aggregate_samples(samples))
+            for device_id, samples in self.samples.items()
+        ]
+        self.samples = {}
+        self.next_flush = max(self.next_flush + self.window, time.monotonic())
+        return results
+
+
+def on_message(_client, message_queue, msg):
+    for item in split_message(msg):
+        message_queue.put(item)
+
+
+@click.command()
+@mqtt_options
+@click.option(
+    "--window",
+    "windows",
+    type=float,
+    multiple=True,
+    default=[0.1],
+    show_default=True,
+    metavar="SECONDS",
+    help="The aggregation window. This can be repeated, to publish several "
+    "window sizes.",
+)
+@click.option(
+    "--device-id", metavar="DEVICE_ID", help="Only aggregate device DEVICE_ID"
+)
+@click.option("--batch-size", default=1000, metavar="COUNT")
+@click.option("--report-period", default=5.0, metavar="SECONDS")
+def main(*, user, host, port, password, windows, device_id, batch_size, report_period):
+    """Republish windowed aggregates of the sensor samples, at a reduced rate."""
+    aggregators = [WindowAggregator(window) for window in windows]
+    message_queue = Queue()
+
+    topic = f"imu/{device_id}" if device_id else "imu/+"
+    client = mqtt.Client(userdata=message_queue)
+    client.on_connect = lambda client, *_args: client.subscribe(topic)
+    client.on_message = on_message
+    if user:
+        client.username_pw_set(user, password=password)
+    client.connect(host, port)
+    client.loop_start()
+
+    report_time = time.monotonic() + report_period
+    received_count = published_count = 0
+    try:
+        while True:
+            timeout = min(a.next_flush for a in aggregators) - time.monotonic()
+            for msg in drain_queue(message_queue, batch_size, max(timeout, 0)):
+                data = decode_payload(msg.payload)
+                if not isinstance(data, dict):
+                    continue
+                received_count += 1
+                for aggregator in aggregators:
+                    aggregator.append(device_id_from_topic(msg.topic), data)
+            now = time.monotonic()
+            for aggregator in aggregators:
+                if now >= aggregator.next_flush:
+                    for agg_topic, aggregate in aggregator.flush():
+                        client.publish(agg_topic, json.dumps(aggregate))
+                        published_count += 1
+            if now >= report_time:
+                elapsed = now - report_time + report_period
+                logger.info(
+                    "{:0.1f} msgs/sec in; {:0.1f} msgs/sec out",
+                    received_count / elapsed,
+                    published_count / elapsed,
+                )
+                report_time = now + report_period
+                received_count = published_count = 0
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()  # pylint: disable=missing-kwoa
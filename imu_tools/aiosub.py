@@ -0,0 +1,187 @@
+"""Subscribe to several MQTT brokers from one asyncio event loop.
+
+Each paho client's socket is serviced by the event loop (the pattern in paho's
+loop_asyncio example), so messages are delivered to the handler on the loop's
+thread, without a network thread or a queue.
+"""
+
+import asyncio
+import threading
+from dataclasses import dataclass
+from typing import List, Optional
+
+import paho.mqtt.client as mqtt
+from loguru import logger
+
+MIN_RECONNECT_DELAY = 1
+MAX_RECONNECT_DELAY = 60
+
+
+@dataclass
+class BrokerSpec:
+    host: str
+    port: int = 1883
+    user: Optional[str] = None
+    password: Optional[str] = None
+    topics: List[str] = None
+
+    @classmethod
+    def parse(cls, url, default_topic="#"):
+        """Parse mqtt://[user[:password]@]host[:port][/topic[,topic…]].
+
+        The topics are MQTT topic filters, and may contain + and #.
+        """
+        if "://" in url:
+            url = url.split("://", 1)[1]
+        netloc, _, topics = url.partition("/")
+        user = password = None
+        if "@" in netloc:
+            credentials, netloc = netloc.rsplit("@", 1)
+            user, _, password = credentials.partition(":")
+        host, _, port = netloc.partition(":")
+        return cls(
+            host=host,
+            port=int(port) if port else 1883,
+            user=user or None,
+            password=password or None,
+            topics=topics.split(",") if topics else [default_topic],
+        )
+
+    def __str__(self):
+        user = self.user + "@" if self.user else ""
+        return "mqtt://{}{}:{}/{}".format(
+            user, self.host, self.port, ",".join(self.topics)
+        )
+
+
+class BrokerConnection:
+    """A paho client whose socket is serviced by an asyncio event loop, and that
+    reconnects with exponential backoff.
+
+    paho's connect is a blocking TCP connect and handshake, so it runs in an
+    executor thread. The socket callbacks that it calls from that thread are
+    forwarded to the loop's thread.
+    """
+
+    def __init__(self, spec, handle_message, loop):
+        self.spec = spec
+        self.loop = loop
+        self.loop_thread_id = threading.get_ident()
+        self.reconnect_delay = MIN_RECONNECT_DELAY
+        self.connect_task = None
+        self.misc_task = None
+        client = self.client = mqtt.Client()
+        client.on_connect = self.on_connect
+        client.on_disconnect = self.on_disconnect
+        client.on_message = lambda _client, _userdata, msg: handle_message(msg)
+        client.on_socket_open = self.on_socket_open
+        client.on_socket_close = self.on_socket_close
+        client.on_socket_register_write = self.on_socket_register_write
+        client.on_socket_unregister_write = self.on_socket_unregister_write
+        if spec.user:
+            client.username_pw_set(spec.user, password=spec.password)
+
+    def on_connect(self, client, _userdata, _flags, rc):
+        logger.info("Connected(broker={}, rc={})", self.spec, rc)
+        if rc == 0:
+            self.reconnect_delay = MIN_RECONNECT_DELAY
+            client.subscribe([(topic, 0) for topic in self.spec.topics])
+
+    def on_disconnect(self, _client, _userdata, rc):
+        if rc != 0:
+            logger.info(
+                "Disconnected(broker={}, rc={}); reconnecting in {}s",
+                self.spec,
+                rc,
+                self.reconnect_delay,
+            )
+            self._call_in_loop(self.start_connecting, self.reconnect_delay)
+
+    def _call_in_loop(self, func, *args):
+        if threading.get_ident() == self.loop_thread_id:
+            func(*args)
+        else:
+            self.loop.call_soon_threadsafe(func, *args)
+
+    def on_socket_open(self, client, _userdata, sock):
+        self._call_in_loop(self._start_reading, client, sock)
+
+    def _start_reading(self, client, sock):
+        self.loop.add_reader(sock, client.loop_read)
+        self.misc_task = self.loop.create_task(self.loop_misc())
+
+    def on_socket_close(self, _client, _userdata, sock):
+        self._call_in_loop(self._stop_reading, sock)
+
+    def _stop_reading(self, sock):
+        self.loop.remove_reader(sock)
+        if self.misc_task:
+            self.misc_task.cancel()
+            self.misc_task = None
+
+    def on_socket_register_write(self, client, _userdata, sock):
+        self._call_in_loop(self.loop.add_writer, sock, client.loop_write)
+
+    def on_socket_unregister_write(self, _client, _userdata, sock):
+        self._call_in_loop(self.loop.remove_writer, sock)
+
+    async def loop_misc(self):
+        """Send keepalive pings, and detect timeouts."""
+        while self.client.loop_misc() == mqtt.MQTT_ERR_SUCCESS:
+            await asyncio.sleep(1)
+
+    def start_connecting(self, delay=0):
+        """Start a connect task, unless one is already running."""
+        if self.connect_task is None or self.connect_task.done():
+            self.connect_task = self.loop.create_task(self.connect(delay))
+
+    async def connect(self, delay=0):
+        """Connect after delay seconds, and retry with exponential backoff.
+
+        The delay is reset when the broker accepts the connection (on_connect),
+        so a broker that accepts the TCP connection and then refuses or drops
+        the MQTT connection is also retried with backoff."""
+        while True:
+            if delay:
+                await asyncio.sleep(delay)
+                self.reconnect_delay = min(2 * delay, MAX_RECONNECT_DELAY)
+            try:
+                await self.loop.run_in_executor(
+                    None, self.client.connect, self.spec.host, self.spec.port
+                )
+                return
+            except OSError as err:
+                logger.info(
+                    "{} connecting to {}; retrying in {}s",
+                    err,
+                    self.spec,
+                    self.reconnect_delay,
+                )
+            delay = self.reconnect_delay
+
+    def disconnect(self):
+        if self.connect_task:
+            self.connect_task.cancel()
+        self.client.disconnect()
+
+
+async def subscribe_brokers(specs, handle_message, *, tick=None, tick_period=1.0):
+    """Subscribe to the brokers in specs, and call handle_message(msg) with each
+    message from any of them. This runs until it is cancelled.
+
+    If tick is supplied, it is called every tick_period seconds.
+    """
+    loop = asyncio.get_running_loop()
+    connections = [BrokerConnection(spec, handle_message, loop) for spec in specs]
+    # Connect in the background, so that one unavailable broker doesn't delay
+    # the others
+    for connection in connections:
+        connection.start_connecting()
+    try:
+        while True:
+            await asyncio.sleep(tick_period)
+            if tick:
+                tick()
+    finally:
+        for connection in connections:
+            connection.disconnect()
@@ -0,0 +1,82 @@
+"""Batch frames, which carry several sample payloads in one MQTT message.
+
+A batch frame is BATCH_TAG, a uint8 payload count, and then each payload,
+preceded by its length as a little-endian uint16. The payloads are in any of
+the formats that sensor_encoding.decode_payload decodes, and are in order: for
+example, a jsonb schema frame precedes the data frames that use it.
+
+pyboard/main.py sends these when its BATCH_SIZE or BATCH_MS is set.
+"""
+
+import itertools
+import struct
+from collections import namedtuple
+
+BATCH_TAG = 0x42  # "B"
+MAX_BATCH_SIZE = 255
+
+_HEADER = struct.Struct("<BB")
+_LENGTH = struct.Struct("<H")
+
+# A sample message split from a batch. This has the attributes of an MQTT
+# message that the subscribers use.
+BatchItem = namedtuple("BatchItem", ["topic", "payload", "timestamp"])
+
+
+def is_batch_payload(payload):
+    return bool(payload) and payload[0] == BATCH_TAG
+
+
+def encode_batch(payloads):
+    """Frame a list of at most MAX_BATCH_SIZE str or bytes payloads."""
+    chunks = [_HEADER.pack(BATCH_TAG, len(payloads))]
+    for payload in payloads:
+        if isinstance(payload, str):
+            payload = payload.encode()
+        chunks.append(_LENGTH.pack(len(payload)))
+        chunks.append(payload)
+    return b"".join(chunks)
+
+
+def split_batch(payload):
+    """Return the list of payloads in a batch frame."""
+    tag, count = _HEADER.unpack_from(payload)
+    if tag != BATCH_TAG:
+        raise ValueError("Not a batch frame")
+    payloads = []
+    offset = _HEADER.size
+    view = memoryview(payload)
+    for _ in range(count):
+        (length,) = _LENGTH.unpack_from(payload, offset)
+        offset += _LENGTH.size
+        if offset + length > len(payload):
+            raise ValueError("Truncated batch frame")
+        payloads.append(bytes(view[offset : offset + length]))
+        offset += length
+    return payloads
+
+
+def split_message(msg):
+    """Return a list of the sample messages in an MQTT message: its batch
+    items, if it is a batch, or else the message itself.
+
+    Each item has the message's topic and receive timestamp. A malformed batch
+    is returned as is.
+    """
+    if not is_batch_payload(msg.payload):
+        return [msg]
+    try:
+        payloads = split_batch(msg.payload)
+    except (ValueError, struct.error):
+        return [msg]
+    return [BatchItem(msg.topic, payload, msg.timestamp) for payload in payloads]
+
+
+def iter_batches(payloads, batch_size):
+    """Group an iterable of payloads into batch frames of batch_size payloads."""
+    payloads = iter(payloads)
+    while True:
+        batch = list(itertools.islice(payloads, batch_size))
+        if not batch:
+            return
+        yield encode_batch(batch)
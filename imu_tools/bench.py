@@ -0,0 +1,304 @@
+import itertools
+import json
+import queue
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+import click
+import numpy as np
+import paho.mqtt.client as mqtt
+from loguru import logger
+
+from .broker import start_broker_thread
+from .fusion import Fusion
+from .jsonb import Decoder as JsonbDecoder
+from .jsonb import Encoder as JsonbEncoder
+from .pub import (
+    gen_register_samples,
+    gen_sample_blocks,
+    gen_samples,
+    iter_json_payloads,
+)
+from .quantized import decode_quantized_frame, encode_quantized
+from .schedule import iter_deadlines
+from .sensor_encoding import decode_payload, decode_sensor_data, encode_sensor_data
+
+logger.remove()
+logger.add(sys.stdout, format="<dim>{time:mm:ss.SS}:</> {message}", level="INFO")
+
+
+def time_iter(iterable, count):
+    """Return the number of seconds it takes to consume count items."""
+    start_time = time.perf_counter()
+    for _ in itertools.islice(iterable, count):
+        pass
+    return time.perf_counter() - start_time
+
+
+@click.group()
+def main():
+    """Measure the performance of the imu_tools code paths."""
+
+
+@main.command()
+@click.option("--count", metavar="COUNT", default=100000, help="Frames per trial")
+@click.option(
+    "--block-size", metavar="SIZE", default=1024, help="Frames per NumPy block"
+)
+def samples(count, block_size):
+    """Compare the per-sample and block sample generators."""
+    trials = [
+        ("gen_samples + json.dumps", map(json.dumps, gen_samples())),
+        (
+            f"gen_sample_blocks({block_size})",
+            iter_json_payloads(gen_sample_blocks(block_size=block_size)),
+        ),
+    ]
+    baseline = None
+    for name, payloads in trials:
+        elapsed = time_iter(payloads, count)
+        baseline = baseline or elapsed
+        logger.info(
+            "{}: {:,.0f} frames/sec ({:.1f}x)",
+            name,
+            count / elapsed,
+            baseline / elapsed,
+        )
+
+
+@main.command()
+@click.option("--count", metavar="COUNT", default=20000, help="Frames per trial")
+def codecs(count):
+    """Compare the size and speed of the payload encodings."""
+    sample_data = list(itertools.islice(gen_samples(), count))
+    # The q16 registers don't have the range of gen_samples' values
+    register_data = list(itertools.islice(gen_register_samples(), count))
+    jsonb_encoder = JsonbEncoder(sample_data[0])
+    jsonb_decoder = JsonbDecoder()
+    jsonb_decoder.decode(jsonb_encoder.schema_frame())
+    trials = [
+        ("json", json.dumps, json.loads, sample_data),
+        ("binary", encode_sensor_data, decode_sensor_data, sample_data),
+        ("jsonb", jsonb_encoder.dumps, jsonb_decoder.decode, sample_data),
+        ("q16", encode_quantized, decode_quantized_frame, register_data),
+    ]
+    for name, encode, decode, samples in trials:
+        start_time = time.perf_counter()
+        payloads = list(map(encode, samples))
+        encode_time = time.perf_counter() - start_time
+        start_time = time.perf_counter()
+        for payload in payloads:
+            decode(payload)
+        decode_time = time.perf_counter() - start_time
+        logger.info(
+            "{}: {:.0f} bytes/frame; encode {:.2f} µs/frame; decode {:.2f} µs/frame",
+            name,
+            sum(map(len, payloads)) / count,
+            1e6 * encode_time / count,
+            1e6 * decode_time / count,
+        )
+
+
+@main.command()
+@click.option(
+    "--devices",
+    "device_counts",
+    default="1,10,100,500",
+    metavar="COUNTS",
+    help="Comma-separated device counts",
+)
+@click.option("--rounds", metavar="COUNT", default=200, help="Samples per device")
+def fusion(device_counts, rounds):
+    """Measure the vectorized Madgwick filter, across device counts."""
+    rng = np.random.default_rng(0)
+    for device_count in map(int, device_counts.split(",")):
+        fuser = Fusion()
+        samples = [
+            (
+                f"device-{i}",
+                {
+                    "timestamp": 0,
+                    "accelerometer": (0, 0, 9.8),
+                    "gyroscope": tuple(rng.normal(size=3)),
+                    "magnetometer": (30, 0, -40),
+                },
+                0.0,
+            )
+            for i in range(device_count)
+        ]
+        fuser.update(samples)
+        start_time = time.perf_counter()
+        for n in range(1, rounds + 1):
+            for _device_id, data, _received in samples:
+                data["timestamp"] = 5 * n
+            fuser.update(samples)
+        elapsed = time.perf_counter() - start_time
+        logger.info(
+            "{} devices: {:,.0f} samples/sec; {:,.0f} Hz per device",
+            device_count,
+            device_count * rounds / elapsed,
+            rounds / elapsed,
+        )
+
+
+def start_broker_subprocess():
+    """Run the broker stand-in in a subprocess. Returns (process, port)."""
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    process = subprocess.Popen(
+        [
+            sys.executable,
+            "-c",
+            "from imu_tools.broker import main; main()",
+            "--port",
+            str(port),
+        ],
+        stdout=subprocess.DEVNULL,
+    )
+    for _ in range(100):
+        try:
+            socket.create_connection(("127.0.0.1", port)).close()
+            return process, port
+        except ConnectionRefusedError:
+            time.sleep(0.05)
+    process.kill()
+    raise RuntimeError("The broker subprocess didn't start")
+
+
+def run_e2e_trial(port, *, rate, device_count, duration, drain_time=1.0):
+    """Publish from device_count devices at rate messages/second each, for
+    duration seconds, and receive them through a subscriber with sub's queue and
+    decode path. Returns a dict of the results."""
+    message_queue = queue.Queue()
+    subscribed = threading.Event()
+    subscriber = mqtt.Client()
+    subscriber.on_connect = lambda client, *_args: client.subscribe("imu/#")
+    subscriber.on_subscribe = lambda *_args: subscribed.set()
+    subscriber.on_message = lambda _client, _userdata, msg: message_queue.put(msg)
+    subscriber.connect("127.0.0.1", port)
+    subscriber.loop_start()
+    subscribed.wait(5)
+
+    latencies = []
+
+    def consume():
+        while True:
+            msg = message_queue.get()
+            if msg is None:
+                return
+            data = decode_payload(msg.payload)
+            latencies.append(time.perf_counter() - data["bench_sent"])
+
+    consumer = threading.Thread(target=consume)
+    consumer.start()
+
+    publishers = []
+    for i in range(device_count):
+        client = mqtt.Client()
+        client.connect("127.0.0.1", port)
+        publishers.append(("imu/bench-{:03d}".format(i), client, gen_samples()))
+    sent = 0
+    start_time = time.perf_counter()
+    for _ in iter_deadlines(itertools.count(), rate):
+        if time.perf_counter() - start_time >= duration:
+            break
+        for topic, client, samples in publishers:
+            sample = next(samples)
+            sample["bench_sent"] = time.perf_counter()
+            client.publish(topic, json.dumps(sample))
+            sent += 1
+    elapsed = time.perf_counter() - start_time
+
+    drain_deadline = time.perf_counter() + drain_time
+    while len(latencies) < sent and time.perf_counter() < drain_deadline:
+        time.sleep(0.01)
+    message_queue.put(None)
+    consumer.join()
+    subscriber.loop_stop()
+    subscriber.disconnect()
+    for _topic, client, _samples in publishers:
+        client.disconnect()
+
+    latencies = np.array(latencies) * 1000
+    received = len(latencies)
+    return {
+        "rate": rate,
+        "devices": device_count,
+        "sent": sent,
+        "received": received,
+        "loss": 1 - received / sent if sent else 0,
+        "throughput": received / elapsed,
+        "p50": np.percentile(latencies, 50) if received else float("nan"),
+        "p99": np.percentile(latencies, 99) if received else float("nan"),
+        "max": latencies.max() if received else float("nan"),
+    }
+
+
+@main.command()
+@click.option(
+    "--rates",
+    default="50,200,500",
+    show_default=True,
+    help="The per-device publish rates to measure",
+)
+@click.option(
+    "--devices",
+    default="1,4,16",
+    show_default=True,
+    help="The device counts to measure",
+)
+@click.option(
+    "--duration", default=3.0, show_default=True, metavar="SECONDS", help="Per trial"
+)
+@click.option(
+    "--subprocess",
+    "use_subprocess",
+    is_flag=True,
+    help="Run the broker stand-in in a subprocess, instead of a thread",
+)
+def e2e(rates, devices, duration, use_subprocess):
+    """Measure pub → broker → sub latency, throughput, and loss.
+
+    This runs a local MQTT broker stand-in, so it needs no network or external
+    broker.
+    """
+    process = None
+    if use_subprocess:
+        process, port = start_broker_subprocess()
+    else:
+        _broker, port = start_broker_thread()
+    try:
+        logger.info(
+            "{:>6} {:>7} {:>8} {:>8} {:>6} {:>10} {:>8} {:>8} {:>8}",
+            "rate",
+            "devices",
+            "sent",
+            "received",
+            "loss",
+            "msgs/sec",
+            "p50 ms",
+            "p99 ms",
+            "max ms",
+        )
+        for rate in map(int, rates.split(",")):
+            for device_count in map(int, devices.split(",")):
+                result = run_e2e_trial(
+                    port, rate=rate, device_count=device_count, duration=duration
+                )
+                logger.info(
+                    "{rate:>6} {devices:>7} {sent:>8} {received:>8} {loss:>6.1%} "
+                    "{throughput:>10,.0f} {p50:>8.2f} {p99:>8.2f} {max:>8.2f}",
+                    **result,
+                )
+    finally:
+        if process:
+            process.terminate()
+            process.wait()
+
+
+if __name__ == "__main__":
+    main()
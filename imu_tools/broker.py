@@ -0,0 +1,196 @@
+"""A minimal MQTT 3.1.1 broker, as a local stand-in for benchmarks.
+
+It supports what pub and sub use: CONNECT, SUBSCRIBE and UNSUBSCRIBE with + and
+# wildcards, PUBLISH at QoS 0 (QoS 1 publishes are acknowledged, and delivered
+at QoS 0), PINGREQ, and DISCONNECT. There is no authentication, no retained
+messages, and no persistent sessions.
+"""
+
+import asyncio
+import struct
+import sys
+import threading
+
+import click
+from loguru import logger
+
+CONNECT = 1
+CONNACK = 2
+PUBLISH = 3
+PUBACK = 4
+SUBSCRIBE = 8
+SUBACK = 9
+UNSUBSCRIBE = 10
+UNSUBACK = 11
+PINGREQ = 12
+PINGRESP = 13
+DISCONNECT = 14
+
+
+def topic_matches(topic_filter, topic):
+    filter_levels = topic_filter.split("/")
+    topic_levels = topic.split("/")
+    for i, level in enumerate(filter_levels):
+        if level == "#":
+            return True
+        if i >= len(topic_levels):
+            return False
+        if level not in ("+", topic_levels[i]):
+            return False
+    return len(filter_levels) == len(topic_levels)
+
+
+def _encode_length(length):
+    encoded = bytearray()
+    while True:
+        byte, length = length % 128, length // 128
+        encoded.append(byte | (0x80 if length else 0))
+        if not length:
+            return bytes(encoded)
+
+
+def _packet(packet_type, flags, body):
+    return bytes([packet_type << 4 | flags]) + _encode_length(len(body)) + body
+
+
+def _string(data, offset):
+    (length,) = struct.unpack_from("!H", data, offset)
+    offset += 2
+    return data[offset : offset + length].decode(), offset + length
+
+
+class Broker:
+    def __init__(self):
+        # writer -> set of topic filters
+        self.subscriptions = {}
+        self.message_count = 0
+
+    async def handle_client(self, reader, writer):
+        try:
+            while True:
+                header = await reader.readexactly(1)
+                length, multiplier = 0, 1
+                while True:
+                    (byte,) = await reader.readexactly(1)
+                    length += (byte & 0x7F) * multiplier
+                    multiplier *= 128
+                    if not byte & 0x80:
+                        break
+                body = await reader.readexactly(length)
+                if not self.handle_packet(header[0], body, writer):
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self.subscriptions.pop(writer, None)
+            writer.close()
+
+    def handle_packet(self, header, body, writer):
+        """Handle a packet. Returns False if the connection should be closed."""
+        packet_type, flags = header >> 4, header & 0x0F
+        if packet_type == CONNECT:
+            self.subscriptions[writer] = set()
+            writer.write(_packet(CONNACK, 0, b"\x00\x00"))
+        elif packet_type == PUBLISH:
+            topic, offset = _string(body, 0)
+            qos = (flags >> 1) & 0x03
+            if qos:
+                writer.write(_packet(PUBACK, 0, body[offset : offset + 2]))
+                offset += 2
+            self.publish(topic, body[offset:])
+        elif packet_type in (SUBSCRIBE, UNSUBSCRIBE):
+            packet_id, offset = body[:2], 2
+            topic_filters = []
+            while offset < len(body):
+                topic_filter, offset = _string(body, offset)
+                if packet_type == SUBSCRIBE:
+                    offset += 1  # requested QoS
+                topic_filters.append(topic_filter)
+            subscriptions = self.subscriptions.setdefault(writer, set())
+            if packet_type == SUBSCRIBE:
+                subscriptions.update(topic_filters)
+                writer.write(
+                    _packet(SUBACK, 0, packet_id + b"\x00" * len(topic_filters))
+                )
+            else:
+                subscriptions.difference_update(topic_filters)
+                writer.write(_packet(UNSUBACK, 0, packet_id))
+        elif packet_type == PINGREQ:
+            writer.write(_packet(PINGRESP, 0, b""))
+        elif packet_type == DISCONNECT:
+            return False
+        return True
+
+    def publish(self, topic, payload):
+        self.message_count += 1
+        packet = None
+        for writer, topic_filters in self.subscriptions.items():
+            if any(topic_matches(f, topic) for f in topic_filters):
+                if packet is None:
+                    encoded_topic = topic.encode()
+                    packet = _packet(
+                        PUBLISH,
+                        0,
+                        struct.pack("!H", len(encoded_topic)) + encoded_topic + payload,
+                    )
+                writer.write(packet)
+
+    async def serve(self, host="127.0.0.1", port=1883, started=None):
+        server = await asyncio.start_server(self.handle_client, host, port)
+        if started:
+            started(server.sockets[0].getsockname()[1])
+        async with server:
+            await server.serve_forever()
+
+
+def start_broker_thread(host="127.0.0.1", port=0):
+    """Run a Broker on a daemon thread. Returns (broker, port).
+
+    If port is 0, an unused port is chosen. If the broker can't listen on the
+    port, its exception (e.g. an OSError) is raised here.
+    """
+    broker = Broker()
+    ready = threading.Event()
+    bound_port = []
+    errors = []
+
+    def started(actual_port):
+        bound_port.append(actual_port)
+        ready.set()
+
+    def run():
+        try:
+            asyncio.run(broker.serve(host, port, started))
+        except Exception as err:  # pylint: disable=broad-except
+            if ready.is_set():
+                raise
+            errors.append(err)
+            ready.set()
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    ready.wait()
+    if errors:
+        raise errors[0]
+    return broker, bound_port[0]
+
+
+@click.command()
+@click.option("-h", "--host", default="127.0.0.1", help="The interface to listen on")
+@click.option("-p", "--port", default=1883, help="The port to listen on")
+def main(host, port):
+    """Run a minimal local MQTT broker."""
+    logger.remove()
+    logger.add(sys.stdout, format="<dim>{time:mm:ss.SS}:</> {message}", level="INFO")
+    try:
+        asyncio.run(
+            Broker().serve(
+                host, port, lambda port: logger.info("Listening on {}:{}", host, port)
+            )
+        )
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""Capture files of raw MQTT messages, and time-accurate replay of them.
+
+A capture file is MAGIC followed by records. Each record is a little-endian
+header (receive time in Epoch seconds as a float64, topic length as a uint16,
+payload length as a uint32), the UTF-8 topic, and the payload.
+"""
+
+import struct
+import time
+
+MAGIC = b"IMUCAP\x00\x01"
+
+_RECORD_HEADER = struct.Struct("<dHI")
+
+
+class CaptureWriter:
+    """Appends messages to a capture file. Writes are buffered."""
+
+    def __init__(self, path, buffer_size=1 << 16):
+        self.fp = open(path, "ab", buffering=buffer_size)
+        if self.fp.tell() == 0:
+            self.fp.write(MAGIC)
+
+    def append(self, topic, payload, received=None):
+        topic = topic.encode()
+        self.fp.write(
+            _RECORD_HEADER.pack(
+                time.time() if received is None else received, len(topic), len(payload)
+            )
+        )
+        self.fp.write(topic)
+        self.fp.write(payload)
+
+    def close(self):
+        self.fp.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_args):
+        self.close()
+
+
+def iter_capture(path, buffer_size=1 << 16):
+    """Yield the (topic, received, payload) records of a capture file.
+
+    The file is read as a stream, so it can be larger than memory.
+    """
+    with open(path, "rb", buffering=buffer_size) as fp:
+        if fp.read(len(MAGIC)) != MAGIC:
+            raise ValueError("{} is not a capture file".format(path))
+        while True:
+            header = fp.read(_RECORD_HEADER.size)
+            if len(header) < _RECORD_HEADER.size:
+                return
+            received, topic_size, payload_size = _RECORD_HEADER.unpack(header)
+            topic = fp.read(topic_size)
+            payload = fp.read(payload_size)
+            if len(payload) < payload_size:
+                return  # a partially written record
+            yield topic.decode(), received, payload
+
+
+def iter_replay(records, speed=1.0, stats=None):
+    """Yield the (topic, received, payload) records at their original pace,
+    multiplied by speed. If speed is 0, yield them as fast as possible.
+
+    Each record is due at an absolute time on the monotonic clock, so delays in
+    the consumer don't accumulate. If stats is a dict, its "max_lag" is set to
+    the longest time (in seconds) that a record was yielded after it was due.
+    """
+    start_time = first_received = None
+    max_lag = 0.0
+    for record in records:
+        if speed:
+            received = record[1]
+            now = time.monotonic()
+            if start_time is None:
+                start_time, first_received = now, received
+            due_time = start_time + (received - first_received) / speed
+            if due_time > now:
+                time.sleep(due_time - now)
+            else:
+                max_lag = max(max_lag, now - due_time)
+            if stats is not None:
+                stats["max_lag"] = max_lag
+        yield record
@@ -0,0 +1,94 @@
+import queue
+import threading
+import time
+from collections import Counter, OrderedDict, deque
+
+from .jsonb import is_schema_payload
+
+
+def is_schema_message(msg):
+    return is_schema_payload(msg.payload)
+
+
+class ConflatingQueue:
+    """A thread-safe queue that keeps only the newest depth messages per key.
+
+    When a key's buffer is full, putting a message drops that key's oldest
+    message. get takes messages round-robin from the keys with waiting
+    messages, so that a busy device doesn't starve the others.
+
+    Messages for which keep(msg) is true are never dropped, and get returns them
+    before the other messages. By default these are jsonb schema frames, which
+    the data frames that follow them can't be decoded without.
+
+    This implements the subset of queue.Queue that sub uses.
+    """
+
+    def __init__(self, depth=1, key=lambda msg: msg.topic, keep=is_schema_message):
+        self.depth = depth
+        self.key = key
+        self.keep = keep
+        # key -> deque of messages, in round-robin order
+        self._pending = OrderedDict()
+        self._kept = deque()
+        self._size = 0
+        self._not_empty = threading.Condition()
+        self.dropped = Counter()
+        self.total_dropped = 0
+
+    def put(self, msg):
+        if self.keep(msg):
+            with self._not_empty:
+                self._kept.append(msg)
+                self._size += 1
+                self._not_empty.notify()
+            return
+        key = self.key(msg)
+        with self._not_empty:
+            messages = self._pending.get(key)
+            if messages is None:
+                messages = self._pending[key] = deque(maxlen=self.depth)
+            if len(messages) == self.depth:
+                self.dropped[key] += 1
+                self.total_dropped += 1
+            else:
+                self._size += 1
+            messages.append(msg)
+            self._not_empty.notify()
+
+    def get(self, block=True, timeout=None):
+        with self._not_empty:
+            if block:
+                deadline = None if timeout is None else time.monotonic() + timeout
+                while not self._size:
+                    remaining = (
+                        None if deadline is None else deadline - time.monotonic()
+                    )
+                    if remaining is not None and remaining <= 0:
+                        raise queue.Empty
+                    self._not_empty.wait(remaining)
+            elif not self._size:
+                raise queue.Empty
+            if self._kept:
+                self._size -= 1
+                return self._kept.popleft()
+            key, messages = next(iter(self._pending.items()))
+            msg = messages.popleft()
+            if messages:
+                self._pending.move_to_end(key)
+            else:
+                del self._pending[key]
+            self._size -= 1
+            return msg
+
+    def get_nowait(self):
+        return self.get(block=False)
+
+    def qsize(self):
+        return self._size
+
+    def take_drop_counts(self):
+        """Return a Counter of the messages dropped per key since the last call."""
+        with self._not_empty:
+            dropped, self.dropped = self.dropped, Counter()
+            return dropped
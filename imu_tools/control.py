@@ -1,5 +1,21 @@
 #!/usr/bin/env python3
+"""Send control commands to the devices, and report their replies.
+
+A command is a JSON object {"command": name, "id": id, ...}, published to
+imu/control/<device_id>, or to imu/control/* for every device. Each device
+replies on imu/control-reply/<device_id> with the command's id, its device_id,
+and either "ok": true and the command's results, or "ok": false and an "error".
+See pyboard/main.py for the commands.
+"""
+
+import itertools
+import json
+import os
+import statistics
 import sys
+import threading
+import time
+from queue import Empty, Queue
 
 import click
 import paho.mqtt.client as mqtt
@@ -10,27 +26,229 @@ from .config import mqtt_options
 logger.remove()
 logger.add(sys.stdout, format="<dim>{time:mm:ss.SS}:</> {message}", level="INFO")
 
+CONTROL_TOPIC = "imu/control/{}"
+REPLY_TOPIC = "imu/control-reply/{}"
+ALL_DEVICES = "*"
 
-def on_publish(_client, userdata, mid):
-    logger.info("Published(id={}) to {}", mid, userdata)
+PAYLOAD_FORMATS = ("json", "jsonb", "q16")
 
 
-@click.command()
-@mqtt_options
-@click.argument("message", nargs=1, required=False)
-def main(*, user, host, port, password, message):
-    client = mqtt.Client(userdata=host)
-    client.on_publish = on_publish
-    client.on_log = True
+class ControlClient:
+    """Publishes commands, and collects the replies to them."""
+
+    def __init__(self, client, device_id=ALL_DEVICES, timeout=2.0):
+        self.client = client
+        self.device_id = device_id
+        self.timeout = timeout
+        self.replies = Queue()
+        # Distinguish these command ids from those of other control clients
+        self._ids = (f"{os.getpid():x}-{i}" for i in itertools.count())
+        self._subscribed = threading.Event()
+        client.on_connect = self._on_connect
+        client.on_subscribe = lambda *_args: self._subscribed.set()
+        client.on_message = self._on_message
+
+    def _on_connect(self, client, *_args):
+        reply_device = "+" if self.device_id == ALL_DEVICES else self.device_id
+        client.subscribe(REPLY_TOPIC.format(reply_device))
+
+    def _on_message(self, _client, _userdata, msg):
+        try:
+            reply = json.loads(msg.payload)
+        except ValueError:
+            return
+        if isinstance(reply, dict):
+            self.replies.put((msg.timestamp, reply))
+
+    def wait_until_subscribed(self):
+        if not self._subscribed.wait(self.timeout):
+            raise click.ClickException("Timed out subscribing to the reply topic")
+
+    def send(self, command, expected=None, **params):
+        """Publish a command, and return a dict of device_id -> (reply, round
+        trip time in seconds).
+
+        This waits for the timeout, or until each device in expected, or the
+        targeted device, has replied.
+        """
+        if expected is None and self.device_id != ALL_DEVICES:
+            expected = {self.device_id}
+        command_id = next(self._ids)
+        payload = json.dumps({"command": command, "id": command_id, **params})
+        sent = time.monotonic()
+        self.client.publish(CONTROL_TOPIC.format(self.device_id), payload)
+        deadline = sent + self.timeout
+        results = {}
+        while not (expected and expected <= results.keys()):
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                received, reply = self.replies.get(timeout=timeout)
+            except Empty:
+                break
+            # Replies to earlier commands that arrived after their timeout
+            if reply.get("id") != command_id:
+                continue
+            results[reply.get("device_id")] = (reply, received - sent)
+        return results
+
+    def report_missing(self, results, expected=None):
+        if expected is None:
+            expected = set() if self.device_id == ALL_DEVICES else {self.device_id}
+        for device_id in sorted(expected - results.keys()):
+            logger.warning("{}: no reply", device_id)
+        if not results and self.device_id == ALL_DEVICES:
+            logger.warning("No devices replied")
+
 
+def log_reply(device_id, reply, rtt, key=None):
+    if not reply.get("ok"):
+        logger.error("{}: {}", device_id, reply.get("error"))
+        return
+    value = reply.get(key) if key else None
+    details = " " + json.dumps(value, sort_keys=True) if value is not None else ""
+    logger.info("{}: ok ({:0.1f} ms){}", device_id, rtt * 1000, details)
+
+
+def parse_fields(spec, allow_off=False):
+    """ "quaternion,accelerometer=50" -> {"quaternion": 0, "accelerometer": 50.0}
+
+    If allow_off is set, "temperature=off" -> {"temperature": None}."""
+    fields = {}
+    for item in filter(None, (s.strip() for s in spec.split(","))):
+        name, _, rate = item.partition("=")
+        if allow_off and rate.strip() == "off":
+            fields[name.strip()] = None
+            continue
+        try:
+            fields[name.strip()] = float(rate) if rate else 0
+        except ValueError:
+            raise click.BadParameter(f"invalid rate for {name}: {rate}")
+    return fields
+
+
+@click.group()
+@mqtt_options
+@click.option(
+    "--device-id",
+    default=ALL_DEVICES,
+    show_default=True,
+    metavar="DEVICE_ID",
+    help="The device to control, or * for every device",
+)
+@click.option(
+    "--timeout",
+    default=2.0,
+    show_default=True,
+    metavar="SECONDS",
+    help="How long to wait for replies",
+)
+@click.pass_context
+def main(ctx, *, user, host, port, password, device_id, timeout):
+    """Send control commands to the devices, and report their replies."""
+    client = mqtt.Client()
     if user:
         client.username_pw_set(user, password=password)
+    ctx.obj = ControlClient(client, device_id, timeout)
     client.connect(host, port)
+    client.loop_start()
+    ctx.call_on_close(client.loop_stop)
+    ctx.obj.wait_until_subscribed()
+
+
+@main.command()
+@click.option("--count", default=3, show_default=True, help="Pings per device")
+@click.pass_obj
+def ping(control, count):
+    """Report each device's round-trip latency."""
+    rtts = {}
+    expected = None
+    for _ in range(count):
+        results = control.send("ping", expected=expected)
+        control.report_missing(results, expected)
+        for device_id, (_reply, rtt) in results.items():
+            rtts.setdefault(device_id, []).append(rtt)
+        # After the first round, stop waiting once the devices that replied to it
+        # have replied
+        expected = expected or set(results)
+    for device_id, values in sorted(rtts.items()):
+        ms = [rtt * 1000 for rtt in values]
+        logger.info(
+            "{}: {}/{} replies; rtt min={:0.1f} mean={:0.1f} max={:0.1f} ms",
+            device_id,
+            len(ms),
+            count,
+            min(ms),
+            statistics.mean(ms),
+            max(ms),
+        )
+
+
+@main.command("set")
+@click.option(
+    "--sample-rate",
+    type=float,
+    metavar="HZ",
+    help="Samples per second, or 0 to sample as fast as possible",
+)
+@click.option(
+    "--fields",
+    metavar="FIELD[=HZ],...",
+    help="The fields to read, e.g. quaternion,accelerometer=50. A field without "
+    "a rate is read in every sample.",
+)
+@click.option(
+    "--field-rates",
+    metavar="FIELD=HZ|off,...",
+    help="Change the rates of only these fields, e.g. accelerometer=50,"
+    "temperature=off. A rate of 0 reads the field in every sample, and off stops "
+    "reading it.",
+)
+@click.option("--batch-size", type=int, metavar="COUNT", help="Samples per message")
+@click.option("--batch-ms", type=int, metavar="MS", help="Milliseconds per message")
+@click.option(
+    "--format",
+    "payload_format",
+    type=click.Choice(PAYLOAD_FORMATS),
+    help="The sample payload format",
+)
+@click.pass_obj
+def set_command(
+    control, sample_rate, fields, field_rates, batch_size, batch_ms, payload_format
+):
+    """Change the devices' settings."""
+    settings = {
+        "sample_rate": sample_rate,
+        "fields": parse_fields(fields) if fields is not None else None,
+        "field_rates": (
+            parse_fields(field_rates, allow_off=True)
+            if field_rates is not None
+            else None
+        ),
+        "batch_size": batch_size,
+        "batch_ms": batch_ms,
+        "payload_format": payload_format,
+    }
+    settings = {k: v for k, v in settings.items() if v is not None}
+    if not settings:
+        raise click.UsageError("Specify at least one setting")
+    results = control.send("set", **settings)
+    control.report_missing(results)
+    for device_id, (reply, rtt) in sorted(results.items()):
+        log_reply(device_id, reply, rtt, "settings")
+
 
-    device_id = "*"
-    topic = f"imu/control/{device_id}"
-    info = client.publish(topic, payload=message or "ping")
-    info.wait_for_publish()
+@main.command()
+@click.pass_obj
+def stats(control):
+    """Report the devices' counters and settings."""
+    results = control.send("stats")
+    control.report_missing(results)
+    for device_id, (reply, rtt) in sorted(results.items()):
+        log_reply(device_id, reply, rtt, "stats")
+        if reply.get("ok"):
+            logger.info("{}: settings {}", device_id, json.dumps(reply["settings"]))
 
 
 if __name__ == "__main__":
@@ -0,0 +1,193 @@
+import itertools
+import multiprocessing
+import queue
+import random
+import sys
+import time
+from collections import Counter
+
+import paho.mqtt.client as mqtt
+from loguru import logger
+
+from .schedule import JitterHistogram, iter_deadlines
+
+
+def fleet_device_ids(device_id, count):
+    return ["{}-{:03d}".format(device_id, i) for i in range(count)]
+
+
+def publish_devices(
+    device_ids,
+    *,
+    mqtt_options,
+    make_payloads,
+    rate,
+    catch_up,
+    jitter,
+    report_period,
+    stats_queue,
+    stop,
+):
+    """Publish rate messages/second to imu/<id> for each device id.
+
+    This runs in a worker process. Every report_period seconds, it puts a
+    (Counter of messages sent per device id, None) tuple on stats_queue. On
+    exit, it puts the final counts and, if jitter is set, a JitterHistogram.
+    """
+    random.seed()  # forked workers would otherwise share the parent's sequence
+    clients = {}
+    for device_id in device_ids:
+        client = mqtt.Client(client_id="pub-" + device_id)
+        if mqtt_options["user"]:
+            client.username_pw_set(mqtt_options["user"], mqtt_options["password"])
+        client.connect(mqtt_options["host"], mqtt_options["port"])
+        clients["imu/" + device_id] = (device_id, client, make_payloads())
+
+    sent = Counter()
+    histogram = JitterHistogram() if jitter else None
+    report_time = time.time() + report_period
+    try:
+        for _ in iter_deadlines(
+            itertools.count(), rate, policy=catch_up, histogram=histogram
+        ):
+            if stop.is_set():
+                break
+            for topic, (device_id, client, payloads) in clients.items():
+                info = client.publish(topic, payload=next(payloads))
+                if info.rc == mqtt.MQTT_ERR_SUCCESS:
+                    sent[device_id] += 1
+                # Flush what publish() couldn't write, read incoming packets,
+                # and send keepalives
+                client.loop(timeout=0)
+            if time.time() >= report_time:
+                report_time += report_period
+                stats_queue.put((sent, None))
+                sent = Counter()
+    except KeyboardInterrupt:
+        pass
+    stats_queue.put((sent, histogram))
+    for _device_id, client, _payloads in clients.values():
+        client.disconnect()
+
+
+def report_fleet_rates(counts, elapsed, *, device_ids, rate, label):
+    """Log the fleet's publish rate, against the aggregate target rate, and each
+    device's publish rate."""
+    total = sum(counts.values())
+    device_target = rate / len(device_ids)
+    shortfall = max(0, 1 - total / elapsed / rate)
+    logger.info(
+        "{}: {} devices, {:,.0f} msgs/sec of {:,.0f} target ({:.1%} shortfall)",
+        label,
+        len(device_ids),
+        total / elapsed,
+        rate,
+        shortfall,
+    )
+    for device_id in device_ids:
+        device_rate = counts[device_id] / elapsed
+        logger.info(
+            "  imu/{}: {:0.1f} msgs/sec{}",
+            device_id,
+            device_rate,
+            " (short)" if device_rate < 0.95 * device_target else "",
+        )
+
+
+def run_fleet(
+    device_ids,
+    *,
+    mqtt_options,
+    make_payloads,
+    rate,
+    catch_up="burst",
+    jitter=False,
+    processes=None,
+    report_period=5.0,
+    duration=None,
+):
+    """Simulate a fleet of devices that together publish rate messages/second.
+
+    Each device publishes rate / len(device_ids) messages/second. The devices
+    are divided among worker processes. make_payloads is called
+    once per device, in the worker process, and returns an iterator of payloads.
+    It must be picklable.
+
+    catch_up is an iter_deadlines policy. If jitter is set, the workers' send
+    interval histogram is printed on exit.
+    """
+    processes = min(processes or multiprocessing.cpu_count(), len(device_ids))
+    stats_queue = multiprocessing.Queue()
+    stop = multiprocessing.Event()
+    workers = [
+        multiprocessing.Process(
+            target=publish_devices,
+            args=(device_ids[i::processes],),
+            kwargs=dict(
+                mqtt_options=mqtt_options,
+                make_payloads=make_payloads,
+                rate=rate / len(device_ids),
+                catch_up=catch_up,
+                jitter=jitter,
+                report_period=report_period,
+                stats_queue=stats_queue,
+                stop=stop,
+            ),
+        )
+        for i in range(processes)
+    ]
+    for worker in workers:
+        worker.start()
+    logger.info(
+        "Publishing {} devices from {} processes", len(device_ids), len(workers)
+    )
+
+    start_time = window_start_time = time.time()
+    total_counts, window_counts = Counter(), Counter()
+    histogram = JitterHistogram()
+    try:
+        while any(worker.is_alive() for worker in workers):
+            if duration and time.time() - start_time >= duration:
+                break
+            try:
+                counts, _histogram = stats_queue.get(timeout=report_period)
+            except queue.Empty:
+                counts = Counter()
+            total_counts.update(counts)
+            window_counts.update(counts)
+            now = time.time()
+            if now - window_start_time >= report_period:
+                report_fleet_rates(
+                    window_counts,
+                    now - window_start_time,
+                    device_ids=device_ids,
+                    rate=rate,
+                    label="Last {:0.0f}s".format(now - window_start_time),
+                )
+                window_start_time, window_counts = now, Counter()
+    except KeyboardInterrupt:
+        pass
+    stop.set()
+    # collect the final counts from the stopping workers
+    while any(worker.is_alive() for worker in workers) or not stats_queue.empty():
+        try:
+            counts, worker_histogram = stats_queue.get(timeout=0.1)
+        except queue.Empty:
+            continue
+        total_counts.update(counts)
+        if worker_histogram:
+            histogram.merge(worker_histogram)
+    for worker in workers:
+        worker.join()
+    report_fleet_rates(
+        total_counts,
+        time.time() - start_time,
+        device_ids=device_ids,
+        rate=rate,
+        label="Total",
+    )
+    if jitter:
+        for line in histogram.format():
+            logger.info("{}", line)
+    if any(worker.exitcode for worker in workers):
+        sys.exit(1)
@@ -0,0 +1,330 @@
+"""Host-side sensor fusion of raw accelerometer, gyroscope and magnetometer
+samples, with a Madgwick filter that is vectorized across devices.
+
+`fuse` subscribes to the raw samples, and republishes each device's fused
+orientation to <topic prefix>/<device_id>.
+"""
+
+import json
+import sys
+import time
+from queue import Queue
+
+import click
+import numpy as np
+import paho.mqtt.client as mqtt
+from loguru import logger
+
+from .batch import split_message
+from .config import mqtt_options
+from .recording import device_id_from_topic
+from .sensor_encoding import decode_payload
+from .sub import drain_queue
+
+logger.remove()
+logger.add(sys.stdout, format="<dim>{time:mm:ss.SS}:</> {message}", level="INFO")
+
+# Time steps longer than this (in seconds), for example after a device
+# reconnects, are clamped, so that one stale gyroscope reading can't spin the
+# estimate.
+MAX_DT = 0.1
+
+
+def _normalize(v):
+    norm = np.linalg.norm(v, axis=-1, keepdims=True)
+    return np.divide(v, norm, out=np.zeros_like(v), where=norm > 0)
+
+
+def madgwick_update(q, gyro, accel, mag, dt, beta):
+    """Return the quaternions q (an N×4 array of w, x, y, z) updated by one
+    sample from each of N devices.
+
+    gyro is in radians/second. accel and mag can be in any units. A row of mag
+    that is all zero (or NaN) uses the accelerometer-and-gyroscope update; a row
+    of accel that is all zero only integrates the gyroscope. dt is an array of
+    time steps, in seconds.
+    """
+    q0, q1, q2, q3 = q.T
+    gx, gy, gz = gyro.T
+    q_dot = 0.5 * np.column_stack(
+        (
+            -q1 * gx - q2 * gy - q3 * gz,
+            q0 * gx + q2 * gz - q3 * gy,
+            q0 * gy - q1 * gz + q3 * gx,
+            q0 * gz + q1 * gy - q2 * gx,
+        )
+    )
+
+    has_accel = np.any(accel != 0, axis=1)
+    mag = np.nan_to_num(mag)
+    has_mag = np.any(mag != 0, axis=1)
+    ax, ay, az = _normalize(accel).T
+    mx, my, mz = _normalize(mag).T
+    q0q0, q1q1, q2q2, q3q3 = q0 * q0, q1 * q1, q2 * q2, q3 * q3
+
+    # Accelerometer and gyroscope
+    imu_step = np.column_stack(
+        (
+            4 * q0 * q2q2 + 2 * q2 * ax + 4 * q0 * q1q1 - 2 * q1 * ay,
+            4 * q1 * q3q3
+            - 2 * q3 * ax
+            + 4 * q0q0 * q1
+            - 2 * q0 * ay
+            - 4 * q1
+            + 8 * q1 * q1q1
+            + 8 * q1 * q2q2
+            + 4 * q1 * az,
+            4 * q0q0 * q2
+            + 2 * q0 * ax
+            + 4 * q2 * q3q3
+            - 2 * q3 * ay
+            - 4 * q2
+            + 8 * q2 * q1q1
+            + 8 * q2 * q2q2
+            + 4 * q2 * az,
+            4 * q1q1 * q3 - 2 * q1 * ax + 4 * q2q2 * q3 - 2 * q2 * ay,
+        )
+    )
+
+    # Accelerometer, gyroscope, and magnetometer. h is the magnetic field in
+    # the earth frame; b is h rotated into the x-z plane.
+    q0q1, q0q2, q0q3 = q0 * q1, q0 * q2, q0 * q3
+    q1q2, q1q3, q2q3 = q1 * q2, q1 * q3, q2 * q3
+    hx = (
+        mx * q0q0
+        - 2 * q0 * my * q3
+        + 2 * q0 * mz * q2
+        + mx * q1q1
+        + 2 * q1 * my * q2
+        + 2 * q1 * mz * q3
+        - mx * q2q2
+        - mx * q3q3
+    )
+    hy = (
+        2 * q0 * mx * q3
+        + my * q0q0
+        - 2 * q0 * mz * q1
+        + 2 * q1 * mx * q2
+        - my * q1q1
+        + my * q2q2
+        + 2 * q2 * mz * q3
+        - my * q3q3
+    )
+    bx2 = np.sqrt(hx * hx + hy * hy)
+    bz2 = (
+        -2 * q0 * mx * q2
+        + 2 * q0 * my * q1
+        + mz * q0q0
+        + 2 * q1 * mx * q3
+        - mz * q1q1
+        + 2 * q2 * my * q3
+        - mz * q2q2
+        + mz * q3q3
+    )
+    # The objective function: the error in the predicted gravity (fa) and
+    # magnetic field (fm) directions
+    fa_x = 2 * q1q3 - 2 * q0q2 - ax
+    fa_y = 2 * q0q1 + 2 * q2q3 - ay
+    fa_z = 1 - 2 * q1q1 - 2 * q2q2 - az
+    fm_x = bx2 * (0.5 - q2q2 - q3q3) + bz2 * (q1q3 - q0q2) - mx
+    fm_y = bx2 * (q1q2 - q0q3) + bz2 * (q0q1 + q2q3) - my
+    fm_z = bx2 * (q0q2 + q1q3) + bz2 * (0.5 - q1q1 - q2q2) - mz
+    marg_step = np.column_stack(
+        (
+            -2 * q2 * fa_x
+            + 2 * q1 * fa_y
+            - bz2 * q2 * fm_x
+            + (-bx2 * q3 + bz2 * q1) * fm_y
+            + bx2 * q2 * fm_z,
+            2 * q3 * fa_x
+            + 2 * q0 * fa_y
+            - 4 * q1 * fa_z
+            + bz2 * q3 * fm_x
+            + (bx2 * q2 + bz2 * q0) * fm_y
+            + (bx2 * q3 - 2 * bz2 * q1) * fm_z,
+            -2 * q0 * fa_x
+            + 2 * q3 * fa_y
+            - 4 * q2 * fa_z
+            + (-2 * bx2 * q2 - bz2 * q0) * fm_x
+            + (bx2 * q1 + bz2 * q3) * fm_y
+            + (bx2 * q0 - 2 * bz2 * q2) * fm_z,
+            2 * q1 * fa_x
+            + 2 * q2 * fa_y
+            + (-2 * bx2 * q3 + bz2 * q1) * fm_x
+            + (-bx2 * q0 + bz2 * q2) * fm_y
+            + bx2 * q1 * fm_z,
+        )
+    )
+
+    step = _normalize(np.where(has_mag[:, np.newaxis], marg_step, imu_step))
+    q_dot -= beta * step * has_accel[:, np.newaxis]
+    return _normalize(q + q_dot * dt[:, np.newaxis])
+
+
+class Fusion:
+    """Madgwick filters for a set of devices.
+
+    Each device's filter state is a row of quaternions. Devices are added as
+    they are seen.
+    """
+
+    def __init__(self, beta=0.1, gyro_scale=1.0):
+        self.beta = beta
+        self.gyro_scale = gyro_scale
+        self.device_indices = {}
+        self.quaternions = np.zeros((0, 4))
+        self.last_times = np.zeros(0)
+
+    def _device_index(self, device_id):
+        index = self.device_indices.get(device_id)
+        if index is None:
+            index = self.device_indices[device_id] = len(self.device_indices)
+            self.quaternions = np.vstack([self.quaternions, [1.0, 0, 0, 0]])
+            self.last_times = np.append(self.last_times, np.nan)
+        return index
+
+    def update(self, samples):
+        """Update the filters from a list of (device_id, data, received)
+        samples, and return a list of (device_id, timestamp, quaternion).
+
+        Each device's samples are applied in order. Samples from different
+        devices are applied together, in one vectorized update per round.
+        """
+        rounds = []
+        round_numbers = {}
+        for sample in samples:
+            device_id, data, _received = sample
+            if "gyroscope" not in data or "accelerometer" not in data:
+                continue
+            n = round_numbers.get(device_id, 0)
+            round_numbers[device_id] = n + 1
+            if n == len(rounds):
+                rounds.append([])
+            rounds[n].append(sample)
+        results = []
+        for round_samples in rounds:
+            results.extend(self._update_round(round_samples))
+        return results
+
+    def _update_round(self, samples):
+        indices = np.array([self._device_index(s[0]) for s in samples])
+        gyro = np.array([s[1]["gyroscope"] for s in samples], dtype=float)
+        accel = np.array([s[1]["accelerometer"] for s in samples], dtype=float)
+        mag = np.array(
+            [s[1].get("magnetometer") or (0, 0, 0) for s in samples], dtype=float
+        )
+        # Use the device's timestamp (in milliseconds) if it has one, so that
+        # transport jitter doesn't affect the integration.
+        times = np.array(
+            [s[1]["timestamp"] / 1000 if "timestamp" in s[1] else s[2] for s in samples]
+        )
+        dt = np.clip(np.nan_to_num(times - self.last_times[indices]), 0, MAX_DT)
+        self.last_times[indices] = times
+        q = madgwick_update(
+            self.quaternions[indices],
+            gyro * self.gyro_scale,
+            accel,
+            mag,
+            dt,
+            self.beta,
+        )
+        self.quaternions[indices] = q
+        return [
+            (device_id, data.get("timestamp"), quaternion)
+            for (device_id, data, _received), quaternion in zip(samples, q.tolist())
+        ]
+
+
+def on_message(_client, message_queue, msg):
+    for item in split_message(msg):
+        message_queue.put(item)
+
+
+@click.command()
+@mqtt_options
+@click.option(
+    "--beta",
+    default=0.1,
+    show_default=True,
+    help="The filter gain. Larger values correct gyroscope drift faster, but "
+    "follow accelerometer noise more.",
+)
+@click.option(
+    "--gyro-units",
+    type=click.Choice(["rad/s", "deg/s"]),
+    default="rad/s",
+    show_default=True,
+    help="The units of the gyroscope field",
+)
+@click.option(
+    "--topic-prefix",
+    default="imu-fused",
+    show_default=True,
+    help="Publish to PREFIX/<device_id>",
+)
+@click.option("--batch-size", default=1000, metavar="COUNT")
+@click.option("--report-period", default=5.0, metavar="SECONDS")
+def main(
+    *,
+    user,
+    host,
+    port,
+    password,
+    beta,
+    gyro_units,
+    topic_prefix,
+    batch_size,
+    report_period,
+):
+    """Fuse raw sensor samples into orientation quaternions, and republish them."""
+    gyro_scale = np.pi / 180 if gyro_units == "deg/s" else 1.0
+    fusion = Fusion(beta=beta, gyro_scale=gyro_scale)
+    message_queue = Queue()
+
+    client = mqtt.Client(userdata=message_queue)
+    client.on_connect = lambda client, *_args: client.subscribe("imu/+")
+    client.on_message = on_message
+    if user:
+        client.username_pw_set(user, password=password)
+    client.connect(host, port)
+    client.loop_start()
+
+    report_time = time.monotonic() + report_period
+    sample_count = 0
+    fusion_time = 0.0
+    try:
+        while True:
+            samples = []
+            for msg in drain_queue(message_queue, batch_size):
+                data = decode_payload(msg.payload)
+                if isinstance(data, dict):
+                    samples.append(
+                        (device_id_from_topic(msg.topic), data, msg.timestamp)
+                    )
+            start_time = time.perf_counter()
+            results = fusion.update(samples)
+            fusion_time += time.perf_counter() - start_time
+            sample_count += len(results)
+            for device_id, timestamp, quaternion in results:
+                payload = {"quaternion": quaternion}
+                if timestamp is not None:
+                    payload["timestamp"] = timestamp
+                client.publish(f"{topic_prefix}/{device_id}", json.dumps(payload))
+            now = time.monotonic()
+            if now >= report_time:
+                elapsed = now - report_time + report_period
+                logger.info(
+                    "{:0.1f} samples/sec from {} devices; {:0.1f} µs/sample fusing",
+                    sample_count / elapsed,
+                    len(fusion.device_indices),
+                    1e6 * fusion_time / max(sample_count, 1),
+                )
+                report_time = now + report_period
+                sample_count = 0
+                fusion_time = 0.0
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()  # pylint: disable=missing-kwoa
@@ -0,0 +1,145 @@
+"""Host-side codec for the packed frames that pyboard/jsonb.py publishes.
+
+A schema frame is SCHEMA_TAG, a 16-bit schema id, and the JSON of the schema: a
+struct format, and a list of [key, count, kind] fields. A data frame is DATA_TAG,
+the schema id, and the values packed by the schema's struct format.
+"""
+
+import json
+import struct
+
+SCHEMA_TAG = 0x53  # "S"
+DATA_TAG = 0x4A  # "J"
+
+# Field kinds
+_SCALAR = 0
+_SEQUENCE = 1
+_STRING = 2
+
+_HEADER = struct.Struct("!BH")
+
+
+def _checksum(data):
+    """Fletcher-16 checksum."""
+    a = b = 0
+    for c in data:
+        a = (a + c) % 255
+        b = (b + a) % 255
+    return (b << 8) | a
+
+
+def _value_format(value):
+    if isinstance(value, bool):
+        return "?"
+    if isinstance(value, int):
+        return "i" if -(1 << 31) <= value < (1 << 31) else "q"
+    if isinstance(value, float):
+        return "f"
+    raise TypeError("Unencodable value: {} (type={})".format(value, type(value)))
+
+
+class Encoder:
+    """Packs dicts that have the same keys and value types as the sample that it
+    was compiled from. This produces the same frames as pyboard/jsonb.py."""
+
+    def __init__(self, sample):
+        fmt = "!BH"
+        fields = []
+        for key in sorted(sample):
+            value = sample[key]
+            if isinstance(value, str):
+                fmt += "{}s".format(len(value.encode()))
+                fields.append([key, 1, _STRING])
+            elif isinstance(value, (list, tuple)):
+                fmt += "".join(map(_value_format, value))
+                fields.append([key, len(value), _SEQUENCE])
+            else:
+                fmt += _value_format(value)
+                fields.append([key, 1, _SCALAR])
+        self.fields = fields
+        self.schema = json.dumps({"format": fmt, "fields": fields}).encode()
+        self.schema_id = _checksum(self.schema)
+        self.struct = struct.Struct(fmt)
+        self.buffer = bytearray(self.struct.size)
+
+    def schema_frame(self):
+        return _HEADER.pack(SCHEMA_TAG, self.schema_id) + self.schema
+
+    def dumps(self, data):
+        """Pack data into the encoder's buffer, and return a copy."""
+        values = [DATA_TAG, self.schema_id]
+        for key, _n, kind in self.fields:
+            value = data[key]
+            if kind == _SEQUENCE:
+                values.extend(value)
+            elif kind == _STRING:
+                values.append(value.encode())
+            else:
+                values.append(value)
+        self.struct.pack_into(self.buffer, 0, *values)
+        return bytes(self.buffer)
+
+
+class Decoder:
+    """Decodes data frames with the schemas from the schema frames it has seen.
+
+    Schemas are identified by their content checksum, so devices that send the
+    same shape of data share a schema.
+    """
+
+    def __init__(self):
+        # schema id -> (Struct, fields)
+        self.schemas = {}
+
+    def decode(self, payload):
+        """Decode a frame.
+
+        Returns a dict for a data frame, and None for a schema frame. Raises
+        KeyError for a data frame whose schema hasn't been seen, and ValueError
+        if the payload isn't a jsonb frame.
+        """
+        tag, schema_id = _HEADER.unpack_from(payload)
+        if tag == SCHEMA_TAG:
+            schema = json.loads(bytes(payload[_HEADER.size :]).decode())
+            self.schemas[schema_id] = (
+                struct.Struct(schema["format"]),
+                schema["fields"],
+            )
+            return None
+        if tag != DATA_TAG:
+            raise ValueError("Not a jsonb frame")
+        frame_struct, fields = self.schemas[schema_id]
+        values = frame_struct.unpack(payload)
+        data = {}
+        i = 2
+        for key, n, kind in fields:
+            if kind == _SEQUENCE:
+                data[key] = values[i : i + n]
+            elif kind == _STRING:
+                data[key] = values[i].decode()
+            else:
+                data[key] = values[i]
+            i += n
+        return data
+
+
+def is_jsonb_payload(payload):
+    return bool(payload) and payload[0] in (SCHEMA_TAG, DATA_TAG)
+
+
+def is_schema_payload(payload):
+    return bool(payload) and payload[0] == SCHEMA_TAG
+
+
+def iter_jsonb_payloads(samples, schema_interval=200):
+    """Encode samples as jsonb frames. The schema frame precedes the first data
+    frame, and is repeated every schema_interval frames, and whenever the shape
+    of the samples changes."""
+    encoder = None
+    for i, sample in enumerate(samples):
+        if encoder is None or len(sample) != len(encoder.fields):
+            encoder = Encoder(sample)
+            yield encoder.schema_frame()
+        elif i % schema_interval == 0:
+            yield encoder.schema_frame()
+        yield encoder.dumps(sample)
@@ -0,0 +1,72 @@
+"""Writers for the quaternion stream that sub --pipe sends to a named pipe.
+
+The text format is one "quaternion: w, x, y, z" line per sample.
+
+The binary format is a stream of fixed-size RECORD records: a uint16 device
+index, the uint32 payload timestamp, and the quaternion as four float32s, all
+little-endian. The first time a device is seen, it is announced by a record
+whose device index has ANNOUNCE_FLAG set, and whose remaining bytes are the
+device id, UTF-8 encoded and NUL-padded (and truncated to fit).
+blender/motion.py reads this format.
+
+Both writers skip the samples whose quaternion isn't four numbers.
+"""
+
+import struct
+
+RECORD = struct.Struct("<HI4f")
+ANNOUNCE_FLAG = 0x8000
+_ANNOUNCE = struct.Struct("<H{}s".format(RECORD.size - 2))
+
+
+def _is_quaternion(value):
+    return (
+        isinstance(value, (list, tuple))
+        and len(value) == 4
+        and all(isinstance(v, (int, float)) for v in value)
+    )
+
+
+class TextPipeWriter:
+    def __init__(self, fp):
+        self.fp = fp
+
+    def write_samples(self, samples):
+        """Write the quaternions of an iterable of (device_id, data) samples."""
+        lines = [
+            "quaternion: " + ", ".join(map(str, data["quaternion"])) + "\n"
+            for _device_id, data in samples
+            if _is_quaternion(data.get("quaternion"))
+        ]
+        if lines:
+            self.fp.write("".join(lines))
+            self.fp.flush()
+
+    def close(self):
+        self.fp.close()
+
+
+class BinaryPipeWriter:
+    def __init__(self, fp):
+        self.fp = fp
+        self.device_indices = {}
+
+    def write_samples(self, samples):
+        """Write the quaternions of an iterable of (device_id, data) samples."""
+        chunks = []
+        for device_id, data in samples:
+            quaternion = data.get("quaternion")
+            if not _is_quaternion(quaternion):
+                continue
+            index = self.device_indices.get(device_id)
+            if index is None:
+                index = self.device_indices[device_id] = len(self.device_indices)
+                chunks.append(_ANNOUNCE.pack(index | ANNOUNCE_FLAG, device_id.encode()))
+            timestamp = int(data.get("timestamp", 0)) & 0xFFFFFFFF
+            chunks.append(RECORD.pack(index, timestamp, *quaternion))
+        if chunks:
+            self.fp.write(b"".join(chunks))
+            self.fp.flush()
+
+    def close(self):
+        self.fp.close()
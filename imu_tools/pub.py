@@ -1,3 +1,4 @@
+import functools
 import itertools
 import json as json_enc
 import random
@@ -7,10 +8,18 @@ import uuid
 from math import cos, pi, sin
 
 import click
+import numpy as np
 import paho.mqtt.client as mqtt
 from loguru import logger
 
+from .batch import MAX_BATCH_SIZE, iter_batches
+from .capture import iter_capture, iter_replay
 from .config import mqtt_options
+from .fleet import fleet_device_ids, run_fleet
+from .jsonb import iter_jsonb_payloads
+from .quantized import iter_quantized_payloads
+from .schedule import CATCH_UP_POLICIES, JitterHistogram, iter_deadlines
+from .sensor_encoding import encode_sensor_data, iter_binary_payloads
 
 logger.remove()
 logger.add(sys.stdout, format="<dim>{time:mm:ss.SS}:</> {message}", level="INFO")
@@ -36,6 +45,100 @@ def gen_samples(axes=range(3)):
     yield from map(make_sample, itertools.count(random.random()))
 
 
+def gen_register_samples(axes=range(3)):
+    """Generate the samples of gen_samples, with the accelerometer and gyroscope
+    scaled into the BNO055's register ranges (±16 g and ±2000 °/s), for the q16
+    format."""
+    for sample in gen_samples(axes):
+        sample["accelerometer"] = tuple(v / 16 for v in sample["accelerometer"])
+        sample["gyroscope"] = tuple(v / 2 for v in sample["gyroscope"])
+        yield sample
+
+
+def gen_sample_blocks(axes=range(3), block_size=1024):
+    """Generate the waveforms of gen_samples, block_size samples at a time.
+
+    Each block is a dict of NumPy arrays with one row per sample. It has no
+    timestamp; that is added when the sample is serialized.
+    """
+    t0 = random.random()
+    axis_mask = np.array([i in axes for i in range(3)], dtype=float)
+    for start in itertools.count(0, block_size):
+        t = t0 + np.arange(start, start + block_size)
+        s = t / 100
+        frac = (t % 1000) / 1000
+        euler = axis_mask * np.column_stack(
+            (pi / 10 * np.cos(1.2 * s), pi / 10 * np.cos(1.4 * s), s % (2 * pi))
+        )
+        yield {
+            "accelerometer": 2048 * np.cos(np.outer(s, (1, 1.2, 1.6))),
+            "calibration": np.full(block_size, 100),
+            "euler": euler * 180 / pi,
+            "gyroscope": frac[:, np.newaxis] + (40, 41, 42),
+            "magnetometer": frac[:, np.newaxis] + (30, 31, 32),
+            "quaternion": euler2quat_array(euler),
+            "temperature": 27 + frac,
+        }
+
+
+# The JSON for a gen_samples sample, with values rounded to float32 precision.
+# This is several times faster to format than repr(float), which json.dumps uses.
+_JSON_SAMPLE_FORMAT = (
+    '{"timestamp": %d, "accelerometer": [%.7g, %.7g, %.7g], "calibration": %d, '
+    '"euler": [%.7g, %.7g, %.7g], "gyroscope": [%.7g, %.7g, %.7g], '
+    '"magnetometer": [%.7g, %.7g, %.7g], "quaternion": [%.7g, %.7g, %.7g, %.7g], '
+    '"temperature": %.7g}'
+)
+_JSON_SAMPLE_FIELDS = (
+    "accelerometer",
+    "calibration",
+    "euler",
+    "gyroscope",
+    "magnetometer",
+    "quaternion",
+    "temperature",
+)
+
+
+def iter_json_payloads(blocks):
+    """Serialize the blocks from gen_sample_blocks to JSON, one sample at a time.
+
+    The values are formatted a block at a time. Each sample is timestamped as it
+    is consumed.
+    """
+    for block in blocks:
+        columns = np.column_stack([block[k] for k in _JSON_SAMPLE_FIELDS])
+        for row in columns.tolist():
+            yield _JSON_SAMPLE_FORMAT % (int(time.time() * 1000), *row)
+
+
+def iter_sample_payloads(
+    axes=range(3), block_size=0, payload_format="json", batch_size=1
+):
+    """Return an iterator of synthetic payloads.
+
+    payload_format is "json", "binary" for sensor_encoding frames, "jsonb", or
+    "q16" for quantized frames. block_size is ignored for "jsonb" and "q16".
+    If batch_size is greater than 1, the payloads are grouped into batch frames.
+    """
+    if batch_size > 1:
+        return iter_batches(
+            iter_sample_payloads(axes, block_size, payload_format), batch_size
+        )
+    if payload_format == "jsonb":
+        return iter_jsonb_payloads(gen_samples(axes))
+    if payload_format == "q16":
+        return iter_quantized_payloads(gen_register_samples(axes))
+    if block_size:
+        blocks = gen_sample_blocks(axes, block_size)
+        if payload_format == "binary":
+            return iter_binary_payloads(blocks)
+        return iter_json_payloads(blocks)
+    if payload_format == "binary":
+        return map(encode_sensor_data, gen_samples(axes))
+    return map(json_enc.dumps, gen_samples(axes))
+
+
 def euler2quat(yaw, pitch, roll):
     c1, s1 = cos(yaw / 2), sin(yaw / 2)
     c2, s2 = cos(pitch / 2), sin(pitch / 2)
@@ -47,16 +150,44 @@ def euler2quat(yaw, pitch, roll):
     return (x, y, z, w)
 
 
-def iter_throttle(iterable, freq=20):
-    next_time = 0
-    for item in iterable:
-        now = time.time()
-        delay = next_time - now
-        if delay > 0:
-            time.sleep(delay)
-            now = time.time()
-        next_time = now + 1 / freq
-        yield item
+def euler2quat_array(euler):
+    """Vectorized euler2quat. euler is an array of (yaw, pitch, roll) rows."""
+    c1, c2, c3 = np.cos(euler / 2).T
+    s1, s2, s3 = np.sin(euler / 2).T
+    w = c1 * c2 * c3 - s1 * s2 * s3
+    x = s1 * s2 * c3 + c1 * c2 * s3
+    y = s1 * c2 * c3 + c1 * s2 * s3
+    z = c1 * s2 * c3 - s1 * c2 * s3
+    return np.column_stack((x, y, z, w))
+
+
+def replay_capture(client, path, *, speed, report_period=5.0):
+    """Publish the messages in a capture file to their original topics."""
+    stats = {}
+    count = 0
+    start_time = report_time = time.monotonic()
+    for topic, _received, payload in iter_replay(iter_capture(path), speed, stats):
+        client.publish(topic, payload=payload)
+        count += 1
+        now = time.monotonic()
+        if now - report_time >= report_period:
+            report_time = now
+            logger.info(
+                "Replayed {:,} messages; {:,.0f} msgs/sec; max lag {:0.1f} ms",
+                count,
+                count / (now - start_time),
+                stats.get("max_lag", 0) * 1000,
+            )
+        # service keepalives and incoming packets
+        if count % 1000 == 0:
+            client.loop(timeout=0)
+    elapsed = time.monotonic() - start_time
+    logger.info(
+        "Replayed {:,} messages in {:0.1f}s; max lag {:0.1f} ms",
+        count,
+        elapsed,
+        stats.get("max_lag", 0) * 1000,
+    )
 
 
 @click.command()
@@ -77,16 +208,123 @@ def iter_throttle(iterable, freq=20):
     "--rate",
     metavar="RATE",
     default=200,
-    help="Messages per second for use with --continuous",
+    help="Messages per second for use with --continuous. With --fleet, this is "
+    "the total for all the devices.",
 )
 @click.option("--continuous", is_flag=True, help="Keep sending messages at RATE/second")
-def main(*, user, host, port, password, device_id, axis, message, continuous, rate):
+@click.option(
+    "--catch-up",
+    type=click.Choice(CATCH_UP_POLICIES),
+    default="burst",
+    show_default=True,
+    help="How to catch up when sending falls behind RATE",
+)
+@click.option(
+    "--jitter", is_flag=True, help="Print a histogram of send interval jitter on exit"
+)
+@click.option(
+    "--format",
+    "payload_format",
+    type=click.Choice(["json", "binary", "jsonb", "q16"]),
+    default="json",
+    show_default=True,
+    help="Synthetic sample payload format",
+)
+@click.option(
+    "--block-size",
+    metavar="SIZE",
+    default=0,
+    help="Compute synthetic samples SIZE at a time, with NumPy",
+)
+@click.option(
+    "--batch",
+    "batch_size",
+    metavar="COUNT",
+    type=click.IntRange(1, MAX_BATCH_SIZE),
+    default=1,
+    help="Send COUNT synthetic samples per message, in a batch frame",
+)
+@click.option(
+    "--replay",
+    "replay_path",
+    type=click.Path(exists=True, dir_okay=False),
+    metavar="FILE",
+    help="Publish the messages in FILE, which was captured by sub --capture",
+)
+@click.option(
+    "--speed",
+    default=1.0,
+    show_default=True,
+    metavar="MULTIPLIER",
+    help="The --replay speed. 0 replays as fast as possible.",
+)
+@click.option(
+    "--fleet",
+    metavar="COUNT",
+    type=int,
+    help="Simulate COUNT devices, which together send RATE messages/second",
+)
+@click.option(
+    "--processes",
+    metavar="COUNT",
+    type=int,
+    help="Divide the --fleet devices among COUNT processes [default: CPU count]",
+)
+@click.option(
+    "--report-period",
+    default=5.0,
+    metavar="SECONDS",
+    help="Report the --fleet publish rates every SECONDS",
+)
+@click.option(
+    "--duration", type=float, metavar="SECONDS", help="Stop the --fleet after SECONDS"
+)
+def main(
+    *,
+    user,
+    host,
+    port,
+    password,
+    device_id,
+    axis,
+    message,
+    continuous,
+    rate,
+    catch_up,
+    jitter,
+    payload_format,
+    block_size,
+    batch_size,
+    replay_path,
+    speed,
+    fleet,
+    processes,
+    report_period,
+    duration,
+):
     """Send MQTT messages.
 
     In a MESSAGE string, {i} is replaced by the message count, and {time} by the
     Epoch seconds. This is useful in combination with --continuous.
     """
 
+    axes = list(map(int, axis.split(",")))
+    if fleet:
+        run_fleet(
+            fleet_device_ids(device_id, fleet),
+            mqtt_options=dict(host=host, port=port, user=user, password=password),
+            make_payloads=functools.partial(
+                iter_sample_payloads, axes, block_size, payload_format, batch_size
+            ),
+            rate=rate,
+            catch_up=catch_up,
+            jitter=jitter,
+            processes=processes,
+            report_period=report_period,
+            duration=duration,
+        )
+        return
+
     def on_publish(_client, _userdata, message_id):
         mqtt_url = f"tcp://{host}:{port}/{topic}"
         logger.info("Published(id={}) to {}", message_id, mqtt_url)
@@ -104,19 +342,37 @@ def main(*, user, host, port, password, device_id, axis, message, continuous, ra
         print(err, f"connecting to {user}@{host}:{port}")
         sys.exit(1)
 
-    axes = list(map(int, axis.split(",")))
-    samples = (
-        (message.format(i=i, time=time.time()) for i in itertools.count())
-        if message is not None
-        else map(json_enc.dumps, gen_samples(axes))
-    )
+    if replay_path:
+        client.on_publish = None
+        try:
+            replay_capture(client, replay_path, speed=speed)
+        except KeyboardInterrupt:
+            pass
+        client.disconnect()
+        return
+
+    if message is not None:
+        samples = (message.format(i=i, time=time.time()) for i in itertools.count())
+    else:
+        samples = iter_sample_payloads(axes, block_size, payload_format, batch_size)
     if not continuous:
         samples = itertools.islice(samples, 1)
 
-    for payload in iter_throttle(samples, rate):
-        info = client.publish(topic, payload=payload)
+    histogram = JitterHistogram() if jitter else None
+    info = None
+    try:
+        for payload in iter_deadlines(
+            samples, rate, policy=catch_up, histogram=histogram
+        ):
+            info = client.publish(topic, payload=payload)
+    except KeyboardInterrupt:
+        pass
     client.disconnect()
-    info.wait_for_publish()
+    if info:
+        info.wait_for_publish()
+    if histogram:
+        for line in histogram.format():
+            logger.info("{}", line)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,194 @@
+"""Quantized sensor frames, as published by pyboard/quantized.py.
+
+A frame holds the BNO055's raw register values, rather than scaled floats.
+It is a little-endian header (TAG, a flags byte that says which fields are
+present, and a uint32 millisecond timestamp), then the scale table: the
+divisor of each present int16 field, as a uint16, then the fields themselves,
+in the order of FIELDS. A field's value is its int16 values divided by its
+divisor. Calibration is a uint8 and temperature is an int8, both unscaled.
+
+The flags are those of sensor_encoding, plus TEMPERATURE_FLAG.
+"""
+
+import struct
+
+import numpy as np
+
+TAG = 0x51  # "Q"
+
+# The flags of sensor_encoding. (It imports this module, to decode these
+# frames.)
+ACCEL_FLAG = 0x01
+MAG_FLAG = 0x02
+GYRO_FLAG = 0x04
+CALIBRATION_FLAG = 0x08
+EULER_FLAG = 0x10
+QUATERNION_FLAG = 0x20
+LINEAR_ACCEL_FLAG = 0x40
+TEMPERATURE_FLAG = 0x80
+
+# (flag, field name, value count, divisor), in frame order. The divisors are
+# the BNO055's register scales. Fields without a divisor aren't scaled.
+FIELDS = (
+    (QUATERNION_FLAG, "quaternion", 4, 1 << 14),
+    (ACCEL_FLAG, "accelerometer", 3, 100),
+    (GYRO_FLAG, "gyroscope", 3, 900),
+    (MAG_FLAG, "magnetometer", 3, 16),
+    (LINEAR_ACCEL_FLAG, "linear_acceleration", 3, 100),
+    (EULER_FLAG, "euler", 3, 16),
+    (CALIBRATION_FLAG, "calibration", 1, None),
+    (TEMPERATURE_FLAG, "temperature", 1, None),
+)
+
+_HEADER = struct.Struct("<BBI")
+
+# flags -> (frame Struct, [(name, count, divisor)] of the present fields)
+_frame_layouts = {}
+
+# flags -> frame dtype
+_frame_dtypes = {}
+
+
+def _frame_layout(flags):
+    layout = _frame_layouts.get(flags)
+    if layout is None:
+        present = [(n, c, d) for flag, n, c, d in FIELDS if flags & flag]
+        scaled_count = sum(1 for _n, _c, divisor in present if divisor)
+        fmt = _HEADER.format + "H" * scaled_count
+        for name, count, divisor in present:
+            if divisor:
+                fmt += "h" * count
+            else:
+                fmt += "B" if name == "calibration" else "b"
+        layout = _frame_layouts[flags] = (struct.Struct(fmt), present)
+    return layout
+
+
+def frame_dtype(flags):
+    """The NumPy dtype of a frame with the fields selected by flags."""
+    dtype = _frame_dtypes.get(flags)
+    if dtype is None:
+        _frame_struct, present = _frame_layout(flags)
+        scaled_count = sum(1 for _n, _c, divisor in present if divisor)
+        fields = [("tag", "u1"), ("flags", "u1"), ("timestamp", "<u4")]
+        if scaled_count:
+            fields.append(("scales", "<u2", (scaled_count,)))
+        for name, count, divisor in present:
+            if divisor:
+                fields.append((name, "<i2", (count,)))
+            else:
+                fields.append((name, "u1" if name == "calibration" else "i1"))
+        dtype = _frame_dtypes[flags] = np.dtype(fields)
+    return dtype
+
+
+def is_quantized_payload(payload):
+    return bool(payload) and payload[0] == TAG
+
+
+_INT16_MIN = -(1 << 15)
+_INT16_MAX = (1 << 15) - 1
+
+
+def _quantize(name, value, divisor, clip):
+    quantized = round(value * divisor)
+    if _INT16_MIN <= quantized <= _INT16_MAX:
+        return quantized
+    if not clip:
+        raise ValueError(
+            "{} value {} is outside the register range (±{:g})".format(
+                name, value, _INT16_MAX / divisor
+            )
+        )
+    return max(_INT16_MIN, min(_INT16_MAX, quantized))
+
+
+def encode_quantized(data, clip=False):
+    """Encode a dict of scaled sensor values as a frame. This is the host-side
+    counterpart of pyboard/quantized.py, for pub and the benchmarks.
+
+    Values are rounded to the nearest register value. A value outside the
+    register's range raises ValueError, or, if clip is true, is clipped.
+    """
+    flags = sum(flag for flag, name, _count, _divisor in FIELDS if name in data)
+    frame_struct, present = _frame_layout(flags)
+    timestamp = int(data.get("timestamp", 0)) & 0xFFFFFFFF
+    values = [TAG, flags, timestamp]
+    values += [divisor for _name, _count, divisor in present if divisor]
+    for name, _count, divisor in present:
+        value = data[name]
+        if divisor:
+            values += [_quantize(name, v, divisor, clip) for v in value]
+        else:
+            values.append(int(value))
+    return frame_struct.pack(*values)
+
+
+def decode_quantized_frames(payloads):
+    """Decode a list of frames that have the same fields, all at once.
+
+    Returns a dict of arrays, with one row per frame: float64 arrays for the
+    scaled fields, and integer arrays for the timestamp, calibration, and
+    temperature.
+    """
+    flags = payloads[0][1]
+    dtype = frame_dtype(flags)
+    data = b"".join(payloads)
+    if len(data) != dtype.itemsize * len(payloads) or any(
+        payload[1] != flags for payload in payloads
+    ):
+        raise ValueError("Quantized frames have different fields")
+    frames = np.frombuffer(data, dtype=dtype)
+    result = {"timestamp": frames["timestamp"]}
+    scale_index = 0
+    for _flag, name, _count, divisor in FIELDS:
+        if name not in dtype.names:
+            continue
+        if divisor:
+            scales = frames["scales"][:, scale_index : scale_index + 1]
+            result[name] = frames[name] / scales
+            scale_index += 1
+        else:
+            result[name] = frames[name]
+    return result
+
+
+def decode_quantized_frame_dicts(payloads):
+    """Decode a list of frames that have the same fields into a list of sensor
+    data dicts, like decode_quantized_frame's, with decode_quantized_frames."""
+    columns = {
+        name: values.tolist()
+        for name, values in decode_quantized_frames(payloads).items()
+    }
+    names = list(columns)
+    return [dict(zip(names, row)) for row in zip(*columns.values())]
+
+
+def decode_quantized_frame(payload):
+    """Decode one frame into a sensor data dict.
+
+    Use decode_quantized_frames to decode many frames."""
+    if len(payload) < _HEADER.size:
+        raise ValueError("Truncated quantized frame")
+    frame_struct, present = _frame_layout(payload[1])
+    try:
+        values = frame_struct.unpack(payload)
+    except struct.error as err:
+        raise ValueError(str(err)) from err
+    data = {"timestamp": values[2]}
+    scale_index = 3
+    i = scale_index + sum(1 for _n, _c, divisor in present if divisor)
+    for name, count, divisor in present:
+        if divisor:
+            divisor = values[scale_index]
+            data[name] = [v / divisor for v in values[i : i + count]]
+            scale_index += 1
+        else:
+            data[name] = values[i]
+        i += count
+    return data
+
+
+def iter_quantized_payloads(samples):
+    """Encode an iterable of sensor data dicts, such as gen_samples yields."""
+    return map(encode_quantized, samples)
@@ -0,0 +1,203 @@
+"""A compact, chunked binary file format for recorded sensor samples.
+
+A recording is MAGIC followed by chunks. Each chunk is a 4-byte tag, a 32-bit
+little-endian payload length, and the payload:
+
+- DEVICES_TAG: the JSON list of the device ids that are appended to the device
+  table. A record's device field is an index into this table.
+- RECORDS_TAG: an array of fixed-width RECORD_DTYPE records.
+
+Fields that a sample doesn't have, or that have the wrong shape (such as the
+three-element quaternion of pyboard/bno055_fake.py), are recorded as NaN (or 0,
+for the integer fields).
+"""
+
+import json
+import mmap
+import struct
+import time
+from pathlib import Path
+
+import numpy as np
+from loguru import logger
+
+MAGIC = b"IMUREC\x00\x01"
+DEVICES_TAG = b"DEVS"
+RECORDS_TAG = b"RECS"
+
+_CHUNK_HEADER = struct.Struct("<4sI")
+
+RECORD_DTYPE = np.dtype(
+    [
+        ("device", "<u2"),
+        ("received", "<f8"),
+        ("timestamp", "<i8"),
+        ("quaternion", "<f4", 4),
+        ("euler", "<f4", 3),
+        ("accelerometer", "<f4", 3),
+        ("gyroscope", "<f4", 3),
+        ("magnetometer", "<f4", 3),
+        ("linear_acceleration", "<f4", 3),
+        ("calibration", "<u1"),
+        ("temperature", "<f4"),
+    ]
+)
+
+SENSOR_FIELDS = RECORD_DTYPE.names[3:]
+
+
+def device_id_from_topic(topic):
+    """imu/<device_id> -> device_id"""
+    return topic.split("/", 1)[1] if topic.startswith("imu/") else topic
+
+
+# The topics under imu/ that carry commands and replies, rather than samples
+CONTROL_TOPIC_PREFIXES = ("imu/control/", "imu/control-reply/")
+
+
+def is_sample_topic(topic):
+    """Return true unless topic is a control topic, such as
+    imu/control-reply/<device_id>, whose JSON payloads aren't samples."""
+    return not topic.startswith(CONTROL_TOPIC_PREFIXES)
+
+
+def write_sensor_fields(record, data, device_id, warned):
+    """Set the SENSOR_FIELDS of a structured record from the sensor data dict.
+
+    A field that is missing, or that has the wrong shape or type, is set to NaN
+    (or 0). The first time that a device sends an invalid field, a warning is
+    logged, and (device_id, field name) is added to the set warned.
+    """
+    for name in SENSOR_FIELDS:
+        value = data.get(name)
+        if value is not None:
+            try:
+                # Assignment would broadcast a scalar across a vector field
+                if np.shape(value) != record[name].shape:
+                    raise ValueError("wrong shape")
+                record[name] = value
+                continue
+            except (TypeError, ValueError):
+                if (device_id, name) not in warned:
+                    warned.add((device_id, name))
+                    logger.warning(
+                        "{}: ignoring invalid {}: {!r}", device_id, name, value
+                    )
+        record[name] = 0 if name == "calibration" else np.nan
+
+
+class RecordingWriter:
+    """Appends samples to a recording file.
+
+    Records are buffered, and written a chunk of chunk_size records at a time,
+    or when the buffer's first record is flush_interval seconds old, so that at
+    most that much is lost if the process is killed.
+    """
+
+    def __init__(self, path, chunk_size=4096, flush_interval=1.0):
+        path = Path(path)
+        self.device_indices = {}
+        if path.exists() and path.stat().st_size:
+            for index, device_id in enumerate(Recording(path).device_ids):
+                self.device_indices[device_id] = index
+        self.fp = open(path, "ab")
+        if not self.device_indices and self.fp.tell() == 0:
+            self.fp.write(MAGIC)
+            self.fp.flush()
+        self.new_device_ids = []
+        self.buffer = np.zeros(chunk_size, dtype=RECORD_DTYPE)
+        self.count = 0
+        self.flush_interval = flush_interval
+        self.flush_time = None
+        self.warned = set()
+
+    def append(self, device_id, data, received=None):
+        """Append a sensor data dict, as produced by gen_samples or
+        get_sensor_data."""
+        index = self.device_indices.get(device_id)
+        if index is None:
+            index = self.device_indices[device_id] = len(self.device_indices)
+            self.new_device_ids.append(device_id)
+        if not self.count:
+            self.flush_time = time.monotonic() + self.flush_interval
+        record = self.buffer[self.count]
+        record["device"] = index
+        record["received"] = time.time() if received is None else received
+        record["timestamp"] = data.get("timestamp", 0)
+        write_sensor_fields(record, data, device_id, self.warned)
+        self.count += 1
+        if self.count == len(self.buffer) or time.monotonic() >= self.flush_time:
+            self.flush()
+
+    def flush(self):
+        if self.new_device_ids:
+            self._write_chunk(DEVICES_TAG, json.dumps(self.new_device_ids).encode())
+            self.new_device_ids = []
+        if self.count:
+            self._write_chunk(RECORDS_TAG, self.buffer[: self.count].tobytes())
+            self.count = 0
+        self.fp.flush()
+
+    def _write_chunk(self, tag, payload):
+        self.fp.write(_CHUNK_HEADER.pack(tag, len(payload)))
+        self.fp.write(payload)
+
+    def close(self):
+        self.flush()
+        self.fp.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_args):
+        self.close()
+
+
+class Recording:
+    """A memory-mapped recording file.
+
+    The record arrays are views of the file, so scanning them doesn't read the
+    file into memory.
+    """
+
+    def __init__(self, path):
+        with open(path, "rb") as fp:
+            self.mmap = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.mmap[: len(MAGIC)] != MAGIC:
+            raise ValueError("{} is not a recording".format(path))
+        self.device_ids = []
+        self.chunks = []
+        offset = len(MAGIC)
+        while offset + _CHUNK_HEADER.size <= len(self.mmap):
+            tag, size = _CHUNK_HEADER.unpack_from(self.mmap, offset)
+            offset += _CHUNK_HEADER.size
+            if offset + size > len(self.mmap):
+                break  # a partially written chunk
+            if tag == DEVICES_TAG:
+                self.device_ids += json.loads(self.mmap[offset : offset + size])
+            elif tag == RECORDS_TAG:
+                self.chunks.append(
+                    np.frombuffer(
+                        self.mmap,
+                        dtype=RECORD_DTYPE,
+                        count=size // RECORD_DTYPE.itemsize,
+                        offset=offset,
+                    )
+                )
+            offset += size
+
+    def __len__(self):
+        return sum(map(len, self.chunks))
+
+    def records(self):
+        """Return all the records, as one structured array."""
+        if len(self.chunks) == 1:
+            return self.chunks[0]
+        if not self.chunks:
+            return np.zeros(0, dtype=RECORD_DTYPE)
+        return np.concatenate(self.chunks)
+
+    def device_records(self, device_id):
+        """Return the records for device_id."""
+        records = self.records()
+        return records[records["device"] == self.device_ids.index(device_id)]
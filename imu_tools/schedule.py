@@ -0,0 +1,103 @@
+import bisect
+import time
+
+CATCH_UP_POLICIES = ("burst", "skip", "smear")
+
+# When the "smear" policy is behind schedule, it sends at up to this multiple of
+# the scheduled rate until it has caught up.
+SMEAR_RATE = 2
+
+
+class JitterHistogram:
+    """A histogram of the differences between the actual and scheduled intervals
+    between sends."""
+
+    # bucket boundaries, in seconds
+    BOUNDS = (-1e-2, -1e-3, -1e-4, -1e-5, 1e-5, 1e-4, 1e-3, 1e-2, 1e-1)
+
+    def __init__(self):
+        self.counts = [0] * (len(self.BOUNDS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, jitter):
+        self.counts[bisect.bisect(self.BOUNDS, jitter)] += 1
+        self.count += 1
+        self.total += abs(jitter)
+        self.max = max(self.max, abs(jitter))
+
+    def merge(self, other):
+        self.counts = [a + b for a, b in zip(self.counts, other.counts)]
+        self.count += other.count
+        self.total += other.total
+        self.max = max(self.max, other.max)
+
+    def format(self):
+        """Return a list of lines that display the histogram."""
+        if not self.count:
+            return ["no intervals"]
+        labels = ["< {}".format(_format_seconds(self.BOUNDS[0]))]
+        labels += [
+            "{} … {}".format(_format_seconds(lo), _format_seconds(hi))
+            for lo, hi in zip(self.BOUNDS, self.BOUNDS[1:])
+        ]
+        labels += ["≥ {}".format(_format_seconds(self.BOUNDS[-1]))]
+        width = max(map(len, labels))
+        lines = [
+            "{:>{}}: {:7.2%} {}".format(
+                label, width, n / self.count, "#" * round(50 * n / self.count)
+            )
+            for label, n in zip(labels, self.counts)
+        ]
+        lines.append(
+            "{:,} intervals; mean |jitter| {}; max |jitter| {}".format(
+                self.count,
+                _format_seconds(self.total / self.count),
+                _format_seconds(self.max),
+            )
+        )
+        return lines
+
+
+def _format_seconds(seconds):
+    if abs(seconds) >= 1e-3:
+        return "{:g}ms".format(seconds * 1e3)
+    return "{:g}µs".format(seconds * 1e6)
+
+
+def iter_deadlines(iterable, freq, *, policy="burst", histogram=None):
+    """Yield the items of iterable at freq items/second.
+
+    The send times are absolute deadlines on a monotonic clock, so an oversleep
+    or a slow consumer doesn't push back the rest of the schedule. policy says
+    what to do when the consumer falls behind:
+
+    - "burst" sends the missed items immediately, until it has caught up
+    - "skip" abandons the missed deadlines, and resumes with the next one
+    - "smear" sends the missed items at up to SMEAR_RATE times freq
+
+    If histogram is a JitterHistogram, each inter-send interval is recorded in
+    it.
+    """
+    if policy not in CATCH_UP_POLICIES:
+        raise ValueError("Unknown catch-up policy: {}".format(policy))
+    period = 1 / freq
+    deadline = send_time = time.monotonic()
+    last_send_time = None
+    for item in iterable:
+        now = time.monotonic()
+        if policy == "skip" and now - deadline >= period:
+            deadline += (now - deadline) // period * period
+            send_time = deadline
+        if now < send_time:
+            time.sleep(send_time - now)
+            now = time.monotonic()
+        if histogram is not None and last_send_time is not None:
+            histogram.record(now - last_send_time - period)
+        last_send_time = now
+        yield item
+        deadline += period
+        send_time = deadline
+        if policy == "smear":
+            send_time = max(deadline, now + period / SMEAR_RATE)
@@ -0,0 +1,165 @@
+"""A shared-memory table of the latest sample from each device.
+
+sub --shm NAME writes the table; any number of local processes can read it
+with StateTable, without a broker round trip, and without blocking the writer.
+
+The table is a HEADER, followed by fixed-size SLOT_DTYPE slots, one per
+device. Each slot is guarded by a sequence lock: the writer increments the
+slot's seq before and after it updates the slot, so seq is odd during an update.
+A reader retries if seq is odd, or changes while it reads the slot.
+"""
+
+import os
+import struct
+import time
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+
+from .recording import write_sensor_fields
+
+MAGIC = b"IMUSHM01"
+HEADER = struct.Struct("<8sII")  # magic, slot count, slot size
+
+DEVICE_ID_SIZE = 32
+
+SLOT_DTYPE = np.dtype(
+    [
+        ("seq", "<u4"),
+        ("device_id", "S{}".format(DEVICE_ID_SIZE)),
+        ("received", "<f8"),
+        ("timestamp", "<i8"),
+        ("quaternion", "<f4", 4),
+        ("euler", "<f4", 3),
+        ("accelerometer", "<f4", 3),
+        ("gyroscope", "<f4", 3),
+        ("magnetometer", "<f4", 3),
+        ("linear_acceleration", "<f4", 3),
+        ("calibration", "<u1"),
+        ("temperature", "<f4"),
+    ]
+)
+
+_SEQ = struct.Struct("<I")
+
+DEFAULT_SLOTS = 64
+
+
+def _untrack(shm):
+    """Stop this process's resource tracker from unlinking shm at exit."""
+    if os.name == "posix":
+        # The tracker registers POSIX segments by their path, which is the name
+        # with a leading "/"
+        resource_tracker.unregister("/" + shm.name, "shared_memory")
+
+
+def _slots_view(buf, slot_count):
+    return np.ndarray((slot_count,), dtype=SLOT_DTYPE, buffer=buf, offset=HEADER.size)
+
+
+class StateTableWriter:
+    """Creates the table, and writes each device's latest sample to it."""
+
+    def __init__(self, name, slot_count=DEFAULT_SLOTS):
+        size = HEADER.size + slot_count * SLOT_DTYPE.itemsize
+        try:
+            self.shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        except FileExistsError:
+            # A segment left by a writer that didn't exit cleanly. Reuse it, so
+            # that attached readers see the new samples, unless it's too small.
+            self.shm = shared_memory.SharedMemory(name=name)
+            if self.shm.size < size:
+                self.shm.unlink()
+                self.shm.close()
+                self.shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        HEADER.pack_into(self.shm.buf, 0, MAGIC, slot_count, SLOT_DTYPE.itemsize)
+        self.slots = _slots_view(self.shm.buf, slot_count)
+        self.slots[:] = np.zeros(slot_count, dtype=SLOT_DTYPE)
+        self.slot_indices = {}
+        self.warned = set()
+
+    def append(self, device_id, data, received=None):
+        """Replace device_id's slot with the sensor data dict data.
+
+        Devices beyond the table size are ignored, and so are fields with the
+        wrong shape or type."""
+        index = self.slot_indices.get(device_id)
+        if index is None:
+            if len(self.slot_indices) == len(self.slots):
+                return
+            index = self.slot_indices[device_id] = len(self.slot_indices)
+        slot = self.slots[index]
+        seq_offset = HEADER.size + index * SLOT_DTYPE.itemsize
+        seq = int(slot["seq"]) + 1
+        _SEQ.pack_into(self.shm.buf, seq_offset, seq)  # odd: update in progress
+        slot["device_id"] = device_id.encode()[:DEVICE_ID_SIZE]
+        slot["received"] = time.time() if received is None else received
+        slot["timestamp"] = data.get("timestamp", 0)
+        write_sensor_fields(slot, data, device_id, self.warned)
+        _SEQ.pack_into(self.shm.buf, seq_offset, seq + 1)
+
+    def close(self):
+        del self.slots
+        self.shm.close()
+        self.shm.unlink()
+
+
+class StateTable:
+    """Reads the table that a StateTableWriter writes."""
+
+    def __init__(self, name):
+        self.shm = shared_memory.SharedMemory(name=name)
+        # Attaching registers the segment with this process's resource tracker,
+        # which would unlink it when this process exits. The writer owns it.
+        _untrack(self.shm)
+        magic, slot_count, slot_size = HEADER.unpack_from(self.shm.buf)
+        if magic != MAGIC or slot_size != SLOT_DTYPE.itemsize:
+            raise ValueError("{} is not an IMU state table".format(name))
+        self.slots = _slots_view(self.shm.buf, slot_count)
+
+    def _read_slot(self, index, retries=10000):
+        slot = self.slots[index]
+        for _ in range(retries):
+            seq = int(slot["seq"])
+            if seq % 2:
+                time.sleep(0)  # let the writer finish
+                continue
+            copy = slot.copy()
+            if int(slot["seq"]) == seq:
+                return copy if seq else None
+        raise TimeoutError("slot {} is continuously being written".format(index))
+
+    def _iter_slots(self):
+        for index in range(len(self.slots)):
+            slot = self._read_slot(index)
+            if slot is None:
+                return  # slots are allocated in order
+            yield slot["device_id"].decode(), slot
+
+    @staticmethod
+    def _slot_dict(slot):
+        return {name: slot[name].tolist() for name in SLOT_DTYPE.names[2:]}
+
+    def snapshot(self):
+        """Return a dict of device id -> the device's latest sample, as a dict."""
+        return {
+            device_id: self._slot_dict(slot) for device_id, slot in self._iter_slots()
+        }
+
+    def latest(self, device_id):
+        """Return device_id's latest sample as a dict, or None."""
+        for slot_device_id, slot in self._iter_slots():
+            if slot_device_id == device_id:
+                return self._slot_dict(slot)
+        return None
+
+    def quaternions(self):
+        """Return a dict of device id -> latest quaternion."""
+        return {
+            device_id: sample["quaternion"]
+            for device_id, sample in self.snapshot().items()
+        }
+
+    def close(self):
+        del self.slots
+        self.shm.close()
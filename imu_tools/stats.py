@@ -0,0 +1,82 @@
+import numpy as np
+
+# A device timestamp that is more than this many milliseconds later than the
+# fastest one seen so far is taken to be a reset of the device's clock, rather
+# than a transport delay.
+CLOCK_RESET_MS = 10_000
+
+# Timestamps greater than this are Epoch milliseconds, rather than a device's
+# millisecond counter.
+EPOCH_MS_THRESHOLD = 1e12
+
+
+class DeviceStats:
+    """Arrival statistics for one device, over one reporting period.
+
+    The transport delay is estimated from the payload timestamp. If this is in
+    Epoch milliseconds (as from pub), the delay is absolute, and depends on the
+    clocks being synchronized. If it is a device's millisecond counter (as from
+    the firmware), the delay is relative to the fastest sample seen so far.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.intervals = []
+        self.delays = []
+        self.last_arrival = None
+        self.min_offset = None
+
+    def record(self, arrival, received, timestamp=None):
+        """Record a sample that arrived at the monotonic time arrival, which is
+        the Epoch time received, with the payload timestamp, in milliseconds.
+
+        The samples in a batch frame share an arrival time. Only the interval
+        between frames is recorded, since the interval between the samples of
+        a frame is zero."""
+        self.count += 1
+        if self.last_arrival is not None and arrival != self.last_arrival:
+            self.intervals.append(arrival - self.last_arrival)
+        self.last_arrival = arrival
+        if timestamp is None:
+            return
+        received_ms = received * 1000
+        if timestamp > EPOCH_MS_THRESHOLD:
+            self.delays.append(received_ms - timestamp)
+            return
+        offset = received_ms - timestamp
+        if self.min_offset is None or offset - self.min_offset > CLOCK_RESET_MS:
+            self.min_offset = offset
+        self.min_offset = min(self.min_offset, offset)
+        self.delays.append(offset - self.min_offset)
+
+    def summary(self, elapsed):
+        """Return a dict of the statistics, in samples/sec and milliseconds, and
+        start a new period."""
+        count = len(self.intervals)
+        intervals = np.array(self.intervals) * 1000
+        summary = {
+            "rate": self.count / elapsed,
+            "p50": np.percentile(intervals, 50) if count else float("nan"),
+            "p99": np.percentile(intervals, 99) if count else float("nan"),
+            "max_gap": intervals.max() if count else float("nan"),
+            "delay": np.median(self.delays) if self.delays else float("nan"),
+        }
+        self.count = 0
+        self.intervals, self.delays = [], []
+        return summary
+
+
+STATS_TABLE_HEADER = "{:<20} {:>9} {:>9} {:>9} {:>9} {:>9}".format(
+    "device", "samples/s", "p50 ms", "p99 ms", "max gap", "delay ms"
+)
+
+
+def format_stats_row(device_id, summary):
+    return "{:<20} {:>9.1f} {:>9.1f} {:>9.1f} {:>9.1f} {:>9.1f}".format(
+        device_id,
+        summary["rate"],
+        summary["p50"],
+        summary["p99"],
+        summary["max_gap"],
+        summary["delay"],
+    )
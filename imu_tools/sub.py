@@ -1,5 +1,6 @@
-import json
+import asyncio
 import queue
+import signal
 import subprocess
 import sys
 import time
@@ -10,7 +11,16 @@ import click
 import paho.mqtt.client as mqtt
 from loguru import logger
 
+from .aiosub import BrokerSpec, subscribe_brokers
+from .batch import split_message
+from .capture import CaptureWriter
 from .config import mqtt_options
+from .conflate import ConflatingQueue
+from .pipe import BinaryPipeWriter, TextPipeWriter
+from .recording import RecordingWriter, device_id_from_topic, is_sample_topic
+from .sensor_encoding import decode_payload, decode_payloads
+from .shm import StateTableWriter
+from .stats import STATS_TABLE_HEADER, DeviceStats, format_stats_row
 
 logger.remove()
 logger.add(sys.stdout, format="<dim>{time:mm:ss.SS}:</> {message}", level="INFO")
@@ -32,28 +42,76 @@ def on_subscribe(_client, _userdata, mid, granted_qos):
 
 
 def sample_rate_reporter_gen(sample_period=10):
-    sample_start_time, sample_count = time.time(), 0
-    show_frame_rate = True
+    """Report the sample rate, inter-arrival times, largest gap, and transport
+    delay of each device, every sample_period seconds. Control messages are
+    not counted.
+
+    Send this generator each message, and also None periodically, so that a
+    period without messages is reported.
+    """
+    sample_start_time = time.monotonic()
+    device_stats = {}
     while True:
         msg = yield
-        if msg:
-            sample_count += 1
-        now = time.time()
+        if msg and is_sample_topic(msg.topic):
+            device_id = device_id_from_topic(msg.topic)
+            stats = device_stats.get(device_id)
+            if stats is None:
+                stats = device_stats[device_id] = DeviceStats()
+            data = decode_payload(msg.payload)
+            timestamp = data.get("timestamp") if isinstance(data, dict) else None
+            arrival = getattr(msg, "timestamp", None) or time.monotonic()
+            stats.record(arrival, received_time(msg), timestamp)
+        now = time.monotonic()
         elapsed = now - sample_start_time
-        # print(".", elapsed, end="", flush=True)
         if elapsed >= sample_period:
-            if show_frame_rate:
-                # logger.info("{:0.1f} samples/sec", samples / elapsed)
-                logger.info("{:0.1f} samples/sec", sample_count / elapsed)
+            summaries = {
+                device_id: stats.summary(elapsed)
+                for device_id, stats in sorted(device_stats.items())
+            }
+            total_rate = sum(summary["rate"] for summary in summaries.values())
+            logger.info(
+                "{:0.1f} samples/sec from {} devices", total_rate, len(summaries)
+            )
+            if summaries:
+                logger.info(STATS_TABLE_HEADER)
+            for device_id, summary in summaries.items():
+                logger.info(format_stats_row(device_id, summary))
             sample_start_time = now
-            sample_count = 0
+
+
+def received_time(msg):
+    """Return the time that msg was received, in Epoch seconds.
+
+    paho stamps each message with its time.monotonic() receive time, which
+    split_message copies to the batch items. This converts it to the wall clock,
+    so that the time doesn't include the time that the message spent queued.
+    """
+    timestamp = getattr(msg, "timestamp", None)
+    if timestamp is None:
+        return time.time()
+    return time.time() - (time.monotonic() - timestamp)
+
+
+def capture_message(capture, msg):
+    """Append msg to capture, unless it is a control message, which pub --replay
+    would send to the devices again.
+
+    This is called with the message as it was received, before split_message
+    splits a batch frame."""
+    if is_sample_topic(msg.topic):
+        capture.append(msg.topic, msg.payload, received_time(msg))
 
 
 # Called when a PUBLISH message is received from the server.
 def on_message(_client, userdata, msg):
     message_queue = userdata["queue"]
+    capture = userdata.get("capture")
     try:
-        message_queue.put(msg)
+        if capture:
+            capture_message(capture, msg)
+        for item in split_message(msg):
+            message_queue.put(item)
     except StopIteration:
         sys.exit(1)
     except Exception as err:  # pylint: disable=broad-except
@@ -63,38 +121,178 @@ def on_message(_client, userdata, msg):
 def print_message(msg, *, only=None, output=None):
     if not msg:
         return
-    data = msg.payload
-    if data and data[0] == ord("{"):
-        try:
-            data = data.decode()
-        except UnicodeError:
-            pass  # use the undecoded payload
-        try:
-            data = json.loads(data)
-        except json.JSONDecodeError:
-            pass  # use the undecoded payload
-    if output:
-        qs = data["quaternion"]
-        print("quaternion: " + ", ".join(map(str, qs)), file=output, flush=True)
+    data = decode_payload(msg.payload)
+    if data is None:
+        return
+    if output and isinstance(data, dict):
+        output.write_samples([(device_id_from_topic(msg.topic), data)])
     if only:
-        if only not in data:
+        # Payloads that couldn't be decoded, such as jsonb frames that precede
+        # their schema, have no fields
+        if not isinstance(data, dict) or only not in data:
             return
         data = data[only]
     logger.info("Message(topic={}): {}", msg.topic, data)
 
 
-def create_output_pipe():
+def log_dropped_messages(message_queue):
+    """Log the messages that a ConflatingQueue has dropped since the last call."""
+    dropped = message_queue.take_drop_counts()
+    if dropped:
+        logger.info(
+            "Dropped {} stale messages ({} total): {}",
+            sum(dropped.values()),
+            message_queue.total_dropped,
+            ", ".join(f"{topic}={n}" for topic, n in sorted(dropped.items())),
+        )
+
+
+def drain_queue(message_queue, max_count, timeout=1):
+    """Return a list of up to max_count messages from message_queue.
+
+    This waits up to timeout seconds for the first message, and then takes the
+    messages that are already in the queue without waiting."""
+    try:
+        batch = [message_queue.get(timeout=timeout)]
+    except queue.Empty:
+        return []
+    try:
+        while len(batch) < max_count:
+            batch.append(message_queue.get_nowait())
+    except queue.Empty:
+        pass
+    return batch
+
+
+def relay_batches(
+    message_queue,
+    *,
+    only=None,
+    output=None,
+    sinks=(),
+    batch_size=1000,
+    report_period=1.0,
+):
+    """Relay messages from message_queue in batches. Each batch is decoded, and
+    then written to standard output (and to the output pipe writer) with one
+    write. The samples are also appended to each of sinks.
+
+    Every report_period seconds, this logs the message rate, the queue depth, and
+    the processing lag: the longest time that a message waited in the queue.
+    """
+    report_time = time.monotonic() + report_period
+    message_count = batch_count = 0
+    max_lag = 0.0
+    while True:
+        batch = drain_queue(message_queue, batch_size)
+        now = time.monotonic()
+        if batch:
+            max_lag = max(max_lag, now - batch[0].timestamp)
+            message_count += len(batch)
+            batch_count += 1
+            lines, pipe_samples = [], []
+            decoded = decode_payloads([msg.payload for msg in batch])
+            for msg, data in zip(batch, decoded):
+                if data is None:
+                    continue
+                if sinks and isinstance(data, dict) and is_sample_topic(msg.topic):
+                    received = received_time(msg)
+                    for sink in sinks:
+                        sink.append(device_id_from_topic(msg.topic), data, received)
+                if output and isinstance(data, dict):
+                    pipe_samples.append((device_id_from_topic(msg.topic), data))
+                if only:
+                    if not isinstance(data, dict) or only not in data:
+                        continue
+                    data = data[only]
+                lines.append("Message(topic={}): {}\n".format(msg.topic, data))
+            sys.stdout.write("".join(lines))
+            sys.stdout.flush()
+            if pipe_samples:
+                output.write_samples(pipe_samples)
+        if now >= report_time:
+            elapsed = now - report_time + report_period
+            logger.info(
+                "{:0.1f} msgs/sec in {} batches; queue depth {}; max lag {:0.1f} ms",
+                message_count / elapsed,
+                batch_count,
+                message_queue.qsize(),
+                max_lag * 1000,
+            )
+            report_time = now + report_period
+            message_count = batch_count = 0
+            max_lag = 0.0
+            if isinstance(message_queue, ConflatingQueue):
+                log_dropped_messages(message_queue)
+
+
+def record_message(sinks, message):
+    """Append the message's sample to each of sinks: objects with an
+    append(device_id, data) method, such as RecordingWriter.
+
+    Messages on control topics are skipped."""
+    if not is_sample_topic(message.topic):
+        return
+    data = decode_payload(message.payload)
+    if isinstance(data, dict):
+        device_id = device_id_from_topic(message.topic)
+        received = received_time(message)
+        for sink in sinks:
+            sink.append(device_id, data, received)
+
+
+def make_message_handler(*, sample_rate, sample_period, only, output, sinks=()):
+    """Return a function that sends a message to the selected output, and to
+    each of sinks.
+
+    The function should also be called periodically with None, so that the
+    sample rate is reported even when no messages arrive.
+    """
+    reporter = sample_rate_reporter_gen(sample_period)
+    next(reporter)
+
+    def handle_message(message):
+        if sinks and message:
+            record_message(sinks, message)
+        if sample_rate:
+            reporter.send(message)
+        elif message:
+            print_message(message, only=only, output=output)
+
+    return handle_message
+
+
+def raise_keyboard_interrupt(_signum, _frame):
+    raise KeyboardInterrupt
+
+
+def close_outputs(*outputs):
+    for output in outputs:
+        if output:
+            output.close()
+
+
+def create_output_pipe(pipe_format="text"):
     pipe_path = Path(PIPE_PATH)
     if not pipe_path.exists():
         print("Creating named pipe", pipe_path)
         subprocess.run(["mkfifo", pipe_path], check=True)
-    return open(pipe_path, "w")
+    if pipe_format == "binary":
+        return BinaryPipeWriter(open(pipe_path, "wb"))
+    return TextPipeWriter(open(pipe_path, "w"))
 
 
 @click.command()
 @mqtt_options
 @click.option("--only", metavar="FIELD", help="Print only the specified field")
 @click.option("--pipe", is_flag=True, help=f"Pipe quaternions to {PIPE_PATH}")
+@click.option(
+    "--pipe-format",
+    type=click.Choice(["text", "binary"]),
+    default="text",
+    show_default=True,
+    help="The --pipe format. binary sends fixed-size records.",
+)
 @click.option(
     "--device-id", metavar="DEVICE_ID", help=f"Only subscribe to device DEVICE_ID"
 )
@@ -102,18 +300,125 @@ def create_output_pipe():
     "--sample-rate", is_flag=True, help="Print the sample rate instead of the samples"
 )
 @click.option("--sample-period", default=1.0, metavar="SECONDS")
+@click.option(
+    "--throughput",
+    is_flag=True,
+    help="Relay messages in batches, and report the queue depth and lag",
+)
+@click.option(
+    "--batch-size",
+    default=1000,
+    metavar="COUNT",
+    help="The maximum --throughput batch size",
+)
+@click.option(
+    "--broker",
+    "broker_urls",
+    multiple=True,
+    metavar="URL",
+    help="Subscribe to mqtt://[USER[:PASSWORD]@]HOST[:PORT][/TOPIC[,TOPIC…]]. "
+    "This can be repeated, to subscribe to several brokers.",
+)
+@click.option(
+    "--record",
+    "record_path",
+    type=click.Path(dir_okay=False),
+    metavar="FILE",
+    help="Append the samples to the recording FILE",
+)
+@click.option(
+    "--capture",
+    "capture_path",
+    type=click.Path(dir_okay=False),
+    metavar="FILE",
+    help="Append the raw messages to the capture FILE, for pub --replay",
+)
+@click.option(
+    "--shm",
+    "shm_name",
+    metavar="NAME",
+    help="Publish each device's latest sample to the shared memory table NAME, "
+    "for imu_tools.shm.StateTable readers",
+)
+@click.option(
+    "--conflate",
+    type=int,
+    metavar="COUNT",
+    help="Keep only the newest COUNT waiting messages from each device",
+)
 def main(
-    *, user, host, port, password, device_id, only, sample_rate, sample_period, pipe
+    *,
+    user,
+    host,
+    port,
+    password,
+    device_id,
+    only,
+    sample_rate,
+    sample_period,
+    pipe,
+    pipe_format,
+    throughput,
+    batch_size,
+    broker_urls,
+    record_path,
+    capture_path,
+    shm_name,
+    conflate,
 ):
     """Relay MQTT messages to standard output, and optionally to a named pipe."""
-    output_pipe = create_output_pipe() if pipe else None
-    reporter = sample_rate_reporter_gen(sample_period)
-    next(reporter)
-    message_queue = Queue()
-    userdata = dict(hostname=host, queue=message_queue)
+    if broker_urls and (throughput or conflate):
+        # The --broker event loop handles each message as it arrives; there is
+        # no queue to batch or conflate
+        raise click.UsageError(
+            "--broker can't be combined with --throughput or --conflate"
+        )
+    # Close the outputs on SIGTERM (e.g. from timeout or a service manager), as
+    # on Ctrl-C, so that the recording and capture are flushed
+    signal.signal(signal.SIGTERM, raise_keyboard_interrupt)
+    output_pipe = create_output_pipe(pipe_format) if pipe else None
+    sinks = []
+    if record_path:
+        sinks.append(RecordingWriter(record_path))
+    if shm_name:
+        sinks.append(StateTableWriter(shm_name))
+    capture = CaptureWriter(capture_path) if capture_path else None
+    handle_message = make_message_handler(
+        sample_rate=sample_rate,
+        sample_period=sample_period,
+        only=only,
+        output=output_pipe,
+        sinks=sinks,
+    )
+
+    def handle_broker_message(msg):
+        if capture:
+            capture_message(capture, msg)
+        for item in split_message(msg):
+            handle_message(item)
+
+    topic = f"imu/{device_id}" if device_id else "#"
+    if broker_urls:
+        specs = [BrokerSpec.parse(url, default_topic=topic) for url in broker_urls]
+        try:
+            asyncio.run(
+                subscribe_brokers(
+                    specs,
+                    handle_broker_message,
+                    tick=lambda: handle_message(None),
+                )
+            )
+        except KeyboardInterrupt:
+            pass
+        finally:
+            close_outputs(*sinks, capture, output_pipe)
+        return
+
+    message_queue = ConflatingQueue(conflate) if conflate else Queue()
+    userdata = dict(hostname=host, queue=message_queue, capture=capture)
 
     client = mqtt.Client(userdata=userdata)
-    client.on_connect = make_on_connect(f"imu/{device_id}" if device_id else "#")
+    client.on_connect = make_on_connect(topic)
     client.on_message = on_message
     client.on_subscribe = on_subscribe
     client.on_log = True
@@ -122,22 +427,36 @@ def main(
         client.username_pw_set(user, password=password)
     client.connect(host, port)
 
+    drop_report_time = time.monotonic() + sample_period
     try:
         client.loop_start()
+        if throughput and not sample_rate:
+            relay_batches(
+                message_queue,
+                only=only,
+                output=output_pipe,
+                sinks=sinks,
+                batch_size=batch_size,
+                report_period=sample_period,
+            )
         while True:
             try:
                 message = message_queue.get(timeout=1)
             except queue.Empty:
                 message = None
-            if sample_rate:
-                reporter.send(message)
-            elif message:
-                print_message(message, only=only, output=output_pipe)
+            handle_message(message)
+            if conflate and time.monotonic() >= drop_report_time:
+                log_dropped_messages(message_queue)
+                drop_report_time = time.monotonic() + sample_period
             # ensure that no-sample sample rate is reported
             # sleep(sample_period)
             # reporter.send(None)
     except KeyboardInterrupt:
         pass
+    finally:
+        # The capture is written from the network thread
+        client.loop_stop()
+        close_outputs(*sinks, capture, output_pipe)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,67 @@
+import struct
+
+import utime as time
+
+# A batch frame is BATCH_TAG, a uint8 payload count, and each payload preceded by
+# its uint16 length. See imu_tools/batch.py.
+BATCH_TAG = 0x42  # "B"
+MAX_BATCH_SIZE = 255
+
+
+def encode_batch(payloads):
+    frame = bytearray(2 + sum(2 + len(p) for p in payloads))
+    struct.pack_into("<BB", frame, 0, BATCH_TAG, len(payloads))
+    offset = 2
+    for payload in payloads:
+        struct.pack_into("<H", frame, offset, len(payload))
+        offset += 2
+        frame[offset : offset + len(payload)] = payload
+        offset += len(payload)
+    return frame
+
+
+class Batch:
+    """Collects payloads, until there are size of them, or the first is
+    period_ms old. A size or period_ms of 0 doesn't limit the batch."""
+
+    def __init__(self, size=0, period_ms=0):
+        self.size = min(size, MAX_BATCH_SIZE) if size else MAX_BATCH_SIZE
+        self.period_ms = period_ms
+        self.payloads = []
+        self.start_ms = 0
+
+    def add(self, payload):
+        """Add a payload. Returns the batch frame if the batch is complete, else
+        None."""
+        if not self.payloads:
+            self.start_ms = time.ticks_ms()
+        # Copy the payload, since the encoders reuse their buffers
+        self.payloads.append(
+            payload.encode() if isinstance(payload, str) else bytes(payload)
+        )
+        if len(self.payloads) < self.size and (
+            not self.period_ms
+            or time.ticks_diff(time.ticks_ms(), self.start_ms) < self.period_ms
+        ):
+            return None
+        return self.flush()
+
+    def flush_if_due(self):
+        """Return the batch frame if the first payload is period_ms old, else
+        None. This sends a partial batch when no more payloads are added."""
+        if (
+            self.payloads
+            and self.period_ms
+            and time.ticks_diff(time.ticks_ms(), self.start_ms) >= self.period_ms
+        ):
+            return self.flush()
+        return None
+
+    def flush(self):
+        """Return the batch frame of the collected payloads, or None if there
+        are none, and start a new batch."""
+        if not self.payloads:
+            return None
+        frame = encode_batch(self.payloads)
+        self.payloads = []
+        return frame
@@ -26,11 +26,55 @@ _POWER_SUSPEND = const(0x02)
 
 # _MODE_REGISTER = const(0x3d)
 
+# The divisors of the raw register values, as read by read_all(raw=True). These
+# give the values of the scaled accessors.
+RAW_DIVISORS = {
+    "accelerometer": 100,
+    "euler": 16,
+    "gyroscope": 900,
+    "linear_acceleration": 100,
+    "magnetometer": 16,
+    "quaternion": 1 << 14,
+}
+
+# The data registers that read_all reads: 0x08 (ACC_DATA_X_LSB) through 0x35
+# (CALIB_STAT). These are the vectors in register order (accelerometer,
+# magnetometer, gyroscope, euler, quaternion, linear acceleration, gravity), the
+# temperature, and the calibration status.
+_DATA_REGISTER = const(0x08)
+_DATA_STRUCT = "<" + "h" * 22 + "bB"
+_DATA_SIZE = const(0x36 - 0x08)
+
+# (field name, offset into the unpacked _DATA_STRUCT values, count), in register
+# order
+_DATA_FIELDS = (
+    ("accelerometer", 0, 3),
+    ("magnetometer", 3, 3),
+    ("gyroscope", 6, 3),
+    ("euler", 9, 3),
+    ("quaternion", 12, 4),
+    ("linear_acceleration", 16, 3),
+)
+
+# (field name, register, struct format), in register order, for read_fields
+_FIELD_REGISTERS = (
+    ("accelerometer", 0x08, "<hhh"),
+    ("magnetometer", 0x0E, "<hhh"),
+    ("gyroscope", 0x14, "<hhh"),
+    ("euler", 0x1A, "<hhh"),
+    ("quaternion", 0x20, "<hhhh"),
+    ("linear_acceleration", 0x28, "<hhh"),
+    ("temperature", 0x34, "b"),
+    ("calibration", 0x35, "B"),
+)
+FIELD_NAMES = tuple(name for name, _register, _fmt in _FIELD_REGISTERS)
+
 
 class BNO055:
     def __init__(self, i2c, address=0x28, verbose=False):
         self.i2c = i2c
         self.buffer = bytearray(2)
+        self.data_buffer = bytearray(_DATA_SIZE)
         self.address = address
         self._is_verbose = verbose
         self.init()
@@ -94,6 +138,51 @@ class BNO055:
         _registers, register=0x2E, struct="<hhh", value=None, scale=1 / 100
     )
 
+    def read_all(self, raw=False):
+        """Read all the data registers in one I2C transaction, and return a dict
+        of the sensor values, with the keys of sensors.get_sensor_data except
+        timestamp.
+
+        If raw is true, the vectors are the unscaled register values (see
+        RAW_DIVISORS).
+        """
+        self.i2c.readfrom_mem_into(self.address, _DATA_REGISTER, self.data_buffer)
+        values = ustruct.unpack(_DATA_STRUCT, self.data_buffer)
+        data = {"temperature": values[22], "calibration": values[23]}
+        for name, offset, count in _DATA_FIELDS:
+            value = values[offset : offset + count]
+            if not raw:
+                scale = 1 / RAW_DIVISORS[name]
+                value = tuple(v * scale for v in value)
+            data[name] = value
+        return data
+
+    def read_fields(self, names=None, raw=False):
+        """Like read_all, but only read and return the fields in names. This
+        reads the smallest span of registers that holds those fields, in one I2C
+        transaction."""
+        if names is None or len(names) == len(FIELD_NAMES):
+            return self.read_all(raw=raw)
+        fields = [field for field in _FIELD_REGISTERS if field[0] in names]
+        if not fields:
+            return {}
+        start = fields[0][1] - _DATA_REGISTER
+        end = fields[-1][1] - _DATA_REGISTER + ustruct.calcsize(fields[-1][2])
+        buffer = memoryview(self.data_buffer)[start:end]
+        self.i2c.readfrom_mem_into(self.address, start + _DATA_REGISTER, buffer)
+        data = {}
+        for name, register, fmt in fields:
+            value = ustruct.unpack_from(
+                fmt, self.data_buffer, register - _DATA_REGISTER
+            )
+            if len(value) == 1:
+                value = value[0]
+            elif not raw:
+                scale = 1 / RAW_DIVISORS[name]
+                value = tuple(v * scale for v in value)
+            data[name] = value
+        return data
+
     def init(self, mode=NDOF_MODE):
         chip_id = self._chip_id()
         if chip_id != _CHIP_ID:
@@ -1,3 +1,8 @@
+def _raw(values, divisor):
+    """Scale values to int16 register values, clipped to the int16 range"""
+    return tuple(max(-32768, min(32767, int(v * divisor))) for v in values)
+
+
 class BNO055:
     __counter = 1
 
@@ -51,3 +56,58 @@ class BNO055:
         self.__counter += 1
         self.__counter %= 1000
         return (80 + frac, 81 + frac, 82 + frac)
+
+    def calibration(self):
+        return 0xFF
+
+    # The unscaled register values, as from BNO055.read_all(raw=True)
+
+    def raw_accelerometer(self):
+        return _raw(self.accelerometer(), 100)
+
+    def raw_euler(self):
+        return _raw(self.euler(), 16)
+
+    def raw_gyroscope(self):
+        return _raw(self.gyroscope(), 900)
+
+    def raw_linear_acceleration(self):
+        return _raw(self.linear_acceleration(), 100)
+
+    def raw_magnetometer(self):
+        return _raw(self.magnetometer(), 16)
+
+    def raw_quaternion(self):
+        return (1 << 14, 0, 0, 0)
+
+    def raw_temperature(self):
+        return int(self.temperature())
+
+    def read_all(self, raw=False):
+        if raw:
+            return {
+                "accelerometer": self.raw_accelerometer(),
+                "calibration": self.calibration(),
+                "euler": self.raw_euler(),
+                "gyroscope": self.raw_gyroscope(),
+                "linear_acceleration": self.raw_linear_acceleration(),
+                "magnetometer": self.raw_magnetometer(),
+                "quaternion": self.raw_quaternion(),
+                "temperature": self.raw_temperature(),
+            }
+        return {
+            "accelerometer": self.accelerometer(),
+            "calibration": self.calibration(),
+            "euler": self.euler(),
+            "gyroscope": self.gyroscope(),
+            "linear_acceleration": self.linear_acceleration(),
+            "magnetometer": self.magnetometer(),
+            "quaternion": self.quaternion(),
+            "temperature": self.temperature(),
+        }
+
+    def read_fields(self, names=None, raw=False):
+        data = self.read_all(raw=raw)
+        if names is None:
+            return data
+        return {name: value for name, value in data.items() if name in names}
@@ -1,103 +1,117 @@
+import json
 import struct
 
-_NULL_VALUE = 0
-_FALSE_VALUE = 1
-_TRUE_VALUE = 2
-_INT_TYPE = 3
-_FLOAT_TYPE = 4
-_STRING_TYPE = 5
-_LIST_TYPE = 6
-_MAP_TYPE = 7
-
-_CONSTS = {None: _NULL_VALUE, False: _FALSE_VALUE, True: _TRUE_VALUE}
-
-schema_fmt = None
-
-
-def dumps(value):
-    global schema_fmt
-    if not schema_fmt:
-        schema_fmt = "!" + "".join(_iter_encodings(value))
-    return struct.pack(schema_fmt, *_iter_values(value))
-
-
-def _iter_encodings(value):
-    if isinstance(value, str):
-        yield "is"
-    elif isinstance(value, (list, tuple)):
-        yield from (i for v in value for i in _iter_encodings(v))
-    elif isinstance(value, dict):
-        yield from (i for v in value.values() for i in _iter_encodings(v))
-    else:
-        yield "f"
-
-
-def _iter_values(value):
-    if isinstance(value, str):
-        yield len(value)
-        yield value.encode()
-    elif isinstance(value, (list, tuple)):
-        yield from (x for y in value for x in _iter_values(y))
-    elif isinstance(value, dict):
-        yield from (x for y in value.values() for x in _iter_values(y))
-    else:
-        yield value
-
-
-def _format_str(value):
-    if value in (None, False, True):
-        return "B"
-    typ = type(value)
-    if typ == int:
-        return "!Bi"
-    if typ == float:
-        return "!Bf"
-    if typ == str:
-        return "i{}s".format(len(value))
-    if typ in (list, tuple, dict):
-        return "!Bi"
-    raise Exception("Unencodable value: {} (type={})".format(value, typ))
-
-
-def calcsize(value):
-    size = struct.calcsize(_format_str(value))
-    typ = type(value)
-    if typ == str:
-        size += len(value)
-    elif typ in (list, tuple):
-        for item in value:
-            size += calcsize(item)
-    elif typ == dict:
-        for k, v in value.items():
-            size += calcsize(k) + calcsize(v)
-    return size
-
-
-def _pack_into(buf, offset, value):
-    typ = type(value)
-    fmt = _format_str(value)
-    if value in (None, False, True):
-        struct.pack_into(fmt, buf, offset, _CONSTS[value])
-    elif typ == int:
-        struct.pack_into(fmt, buf, offset, _INT_TYPE, value)
-    elif typ == float:
-        struct.pack_into(fmt, buf, offset, _FLOAT_TYPE, value)
-    elif typ == str:
-        struct.pack_into(fmt, buf, offset, len(value), value.encode())
-    elif typ in (list, tuple):
-        struct.pack_into(fmt, buf, offset, _LIST_TYPE, len(value))
-        offset += struct.calcsize(fmt)
-        for item in value:
-            offset = _pack_into(buf, offset, item)
-        return offset
-    elif typ == dict:
-        struct.pack_into(fmt, buf, offset, _MAP_TYPE, len(value))
-        offset += struct.calcsize(fmt)
-        for k, v in value.items():
-            offset = _pack_into(buf, offset, k)
-            offset = _pack_into(buf, offset, v)
-        return offset
-    return offset + calcsize(value)
+# A schema frame is SCHEMA_TAG, a 16-bit schema id, and the JSON of the schema.
+# A data frame is DATA_TAG, the schema id, and the values packed by the schema's
+# struct format.
+SCHEMA_TAG = 0x53  # "S"
+DATA_TAG = 0x4A  # "J"
+
+# Layout value kinds
+_SCALAR = 0
+_SEQUENCE = 1
+_STRING = 2
+
+
+def _checksum(data):
+    """Fletcher-16 checksum."""
+    a = b = 0
+    for c in data:
+        a = (a + c) % 255
+        b = (b + a) % 255
+    return (b << 8) | a
+
+
+def _value_format(value):
+    if isinstance(value, bool):
+        return "?"
+    if isinstance(value, int):
+        return "i" if -(1 << 31) <= value < (1 << 31) else "q"
+    if isinstance(value, float):
+        return "f"
+    raise TypeError("Unencodable value: {} (type={})".format(value, type(value)))
+
+
+class Encoder:
+    """Packs dicts that have the same keys and value types as the sample that it
+    was compiled from. Each frame is packed into the same buffer."""
+
+    def __init__(self, sample):
+        fmt = "!BH"
+        layout = []
+        for key in sorted(sample.keys()):
+            value = sample[key]
+            if isinstance(value, str):
+                fmt += "{}s".format(len(value.encode()))
+                layout.append((key, 1, _STRING))
+            elif isinstance(value, (list, tuple)):
+                fmt += "".join(_value_format(v) for v in value)
+                layout.append((key, len(value), _SEQUENCE))
+            else:
+                fmt += _value_format(value)
+                layout.append((key, 1, _SCALAR))
+        self.fmt = fmt
+        self.layout = layout
+        self.schema = json.dumps(
+            {"format": fmt, "fields": [[key, n, kind] for key, n, kind in layout]}
+        ).encode()
+        self.schema_id = _checksum(self.schema)
+        self.buffer = bytearray(struct.calcsize(fmt))
+        self._values = [DATA_TAG, self.schema_id] + [0] * sum(n for _k, n, _t in layout)
+
+    def schema_frame(self):
+        return struct.pack("!BH", SCHEMA_TAG, self.schema_id) + self.schema
+
+    def dumps(self, data):
+        """Pack data into the encoder's buffer, and return the buffer.
+
+        The buffer is overwritten by the next call."""
+        values = self._values
+        i = 2
+        for key, n, kind in self.layout:
+            value = data[key]
+            if kind == _SEQUENCE:
+                for j in range(n):
+                    values[i + j] = value[j]
+            elif kind == _STRING:
+                values[i] = value.encode()
+            else:
+                values[i] = value
+            i += n
+        struct.pack_into(self.fmt, self.buffer, 0, *values)
+        return self.buffer
+
+
+# Sorted keys -> Encoder. Samples whose fields are read at different rates
+# alternate between a few shapes, so an encoder is kept for each.
+_encoders = {}
+
+
+def dumps(data):
+    """Pack data with an Encoder compiled from the first value with the same
+    keys, or from the first value since the types of those values changed.
+
+    Returns (frame, schema_frame). schema_frame is None unless the encoder was
+    just compiled.
+    """
+    key = tuple(sorted(data.keys()))
+    encoder = _encoders.get(key)
+    schema_frame = None
+    if encoder is None:
+        encoder = _encoders[key] = Encoder(data)
+        schema_frame = encoder.schema_frame()
+    try:
+        frame = encoder.dumps(data)
+    except (KeyError, TypeError, ValueError, OverflowError):
+        encoder = _encoders[key] = Encoder(data)
+        schema_frame = encoder.schema_frame()
+        frame = encoder.dumps(data)
+    return frame, schema_frame
+
+
+def schema_frames():
+    """The schema frames of the current encoders."""
+    return [encoder.schema_frame() for encoder in _encoders.values()]
 
 
 if __name__ == "__main__":
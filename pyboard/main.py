@@ -1,3 +1,4 @@
+import gc
 import json
 import os
 import sys
@@ -5,14 +6,21 @@ import sys
 import machine
 import network
 import sensors
+import uasyncio as asyncio
 import utime as time
-from machine import Pin
+from machine import Timer
 from umqtt.simple import MQTTClient
 
+import batch
+import bno055
 import config
+import jsonb
+import quantized
+import sampling
 import webserver
 
 DEVICE_ID = "".join(map("{:02x}".format, machine.unique_id()))
+DATA_TOPIC = "imu/" + DEVICE_ID
 SENSORS = sensors.get_imu(use_dummy=config.USE_DUMMY_IMU)
 
 print("Device id =", DEVICE_ID)
@@ -60,45 +68,240 @@ def publish_machine_identifier(mqtt_client):
         "machine_freq": machine.freq(),
         "timestamp": time.ticks_ms(),
     }
-    mqtt_client.publish("imu/" + DEVICE_ID, json.dumps(data))
+    mqtt_client.publish(DATA_TOPIC, json.dumps(data))
+
+
+#
+# Control protocol
+#
+# A command is a JSON object {"command": name, "id": id, ...}, published to
+# imu/control/<device_id>, or to imu/control/* for every device. The reply, on
+# REPLY_TOPIC, has the command's id, the device_id, and either "ok": true and the
+# command's results, or "ok": false and an "error". See imu_tools/control.py.
+REPLY_TOPIC = "imu/control-reply/" + DEVICE_ID
 
 
 def on_mqtt_message(_topic, msg):
-    command = msg.decode()
-    print("Received:", command)
+    try:
+        command = json.loads(msg.decode())
+    except ValueError:
+        # A bare command name, such as "ping"
+        command = msg.decode().strip()
+    if not isinstance(command, dict):
+        command = {"command": command}
+    reply = {"id": command.get("id"), "device_id": DEVICE_ID}
+    try:
+        handler = CONTROL_COMMANDS.get(command.get("command"))
+        if handler is None:
+            raise ValueError("Unknown command: {}".format(command.get("command")))
+        reply.update(handler(command))
+        reply["ok"] = True
+    except (AttributeError, KeyError, TypeError, ValueError) as err:
+        print("Control error:", err)
+        reply["ok"] = False
+        reply["error"] = str(err)
+    MQTT_CLIENT.publish(REPLY_TOPIC, json.dumps(reply))
 
 
-def publish_sensor_data(data):
-    """Publish the sensor data to MQTT, and also to the serial port. If no IMU is
-    present, publish the system identification instead.
+def control_ping(_command):
+    return {"pong": True, "timestamp": time.ticks_ms()}
 
-    If config.SEND_SERIAL_SENSOR_DATA is set, send the data on the serial port.
-    """
-    payload = json.dumps(data)
-    if MQTT_CLIENT:
-        MQTT_CLIENT.publish("imu/" + DEVICE_ID, payload)
+
+def control_set(command):
+    """Change the settings in command. They are all validated before any of them
+    are changed."""
+    global PAYLOAD_FORMAT
+    payload_format = command.get("payload_format", PAYLOAD_FORMAT)
+    if payload_format not in PAYLOAD_FORMATS:
+        raise ValueError("Unknown payload format: {}".format(payload_format))
+    sample_rate = float(command.get("sample_rate", SAMPLE_RATE))
+    if sample_rate < 0:
+        raise ValueError("Invalid sample rate: {}".format(sample_rate))
+    batch_size = int(command.get("batch_size", BATCH_SIZE))
+    batch_ms = int(command.get("batch_ms", BATCH_MS))
+    if not 1 <= batch_size <= batch.MAX_BATCH_SIZE or batch_ms < 0:
+        raise ValueError("Invalid batch size or period")
+    # fields replaces the schedule; field_rates changes the rates of the fields
+    # in it, and a rate of None stops reading a field
+    fields = command.get("fields")
+    if isinstance(fields, list):
+        fields = {name: 0 for name in fields}
+    if fields is not None:
+        check_field_rates(fields, "fields must be a list or an object")
+    field_rates = command.get("field_rates")
+    if field_rates is not None:
+        check_field_rates(field_rates, "field_rates must be an object", True)
+    if fields is not None:
+        SCHEDULE.set_rates(fields)
+    if field_rates is not None:
+        for name, rate in field_rates.items():
+            SCHEDULE.set_rate(name, rate)
+    PAYLOAD_FORMAT = payload_format
+    if sample_rate != SAMPLE_RATE:
+        set_sample_rate(sample_rate)
+    if (batch_size, batch_ms) != (BATCH_SIZE, BATCH_MS):
+        set_batch(batch_size, batch_ms)
+    return {"settings": get_settings()}
+
+
+def check_field_rates(rates, type_error, allow_none=False):
+    if not isinstance(rates, dict):
+        raise ValueError(type_error)
+    for name, rate in rates.items():
+        if name not in bno055.FIELD_NAMES:
+            raise ValueError("Unknown field: {}".format(name))
+        if rate is None and allow_none:
+            continue
+        if rate < 0:
+            raise ValueError("Invalid rate for {}: {}".format(name, rate))
 
 
-def send_serial_data(data):
-    print(";".join(k + "=" + str(v) for k, v in zip(["rx", "ry", "rz"], data["euler"])))
+def control_stats(_command):
+    stats = dict(STATS)
+    stats["uptime_ms"] = time.ticks_diff(time.ticks_ms(), START_MS)
+    stats["mem_free"] = gc.mem_free()
+    return {"stats": stats, "settings": get_settings()}
+
+
+CONTROL_COMMANDS = {"ping": control_ping, "set": control_set, "stats": control_stats}
 
 
 #
-# WiFi Connection
+# Settings, which the "set" control command changes while running
 #
+PAYLOAD_FORMATS = ("json", "jsonb", "q16")
+PAYLOAD_FORMAT = getattr(config, "PAYLOAD_FORMAT", "json")
 
+# Samples per second. 0 samples as fast as the IMU can be read. The sampling
+# task is paced by SAMPLE_TIMER, which sets SAMPLE_FLAG every sample period.
+SAMPLE_RATE = 0
+SAMPLE_PERIOD_MS = 0
+SAMPLE_FLAG = asyncio.ThreadSafeFlag()
+SAMPLE_TIMER = Timer(-1 if sys.platform == "esp8266" else 0)
+
+# The fields to read in each sample, and how often. See sampling.FieldSchedule.
+SCHEDULE = sampling.FieldSchedule(getattr(config, "FIELD_RATES", None))
+
+# If BATCH_SIZE or BATCH_MS is set, payloads are collected into batch frames,
+# and a batch is published when it has BATCH_SIZE payloads, or its first is
+# BATCH_MS old.
+BATCH_SIZE = 1
+BATCH_MS = 0
+BATCH = None
+
+
+def get_settings():
+    return {
+        "sample_rate": SAMPLE_RATE,
+        "fields": SCHEDULE.rates,
+        "batch_size": BATCH_SIZE,
+        "batch_ms": BATCH_MS,
+        "payload_format": PAYLOAD_FORMAT,
+    }
+
+
+def set_sample_rate(rate):
+    global SAMPLE_RATE, SAMPLE_PERIOD_MS
+    SAMPLE_RATE = rate
+    SAMPLE_PERIOD_MS = int(1000 / rate) if rate else 0
+    SAMPLE_TIMER.deinit()
+    if SAMPLE_PERIOD_MS:
+        SAMPLE_TIMER.init(
+            period=SAMPLE_PERIOD_MS,
+            mode=Timer.PERIODIC,
+            callback=lambda _timer: SAMPLE_FLAG.set(),
+        )
+    # Wake the sampling task, in case it is waiting for the stopped timer
+    SAMPLE_FLAG.set()
+
+
+def publish_batch(frame):
+    MQTT_CLIENT.publish(DATA_TOPIC, frame)
+    STATS["messages"] += 1
+
+
+def set_batch(size, period_ms):
+    """Set the batch size and period. The current batch is published first."""
+    global BATCH, BATCH_SIZE, BATCH_MS
+    frame = BATCH.flush() if BATCH else None
+    if frame and MQTT_CLIENT:
+        publish_batch(frame)
+    BATCH_SIZE, BATCH_MS = size, period_ms
+    BATCH = batch.Batch(size, period_ms) if size > 1 or period_ms else None
+
+
+# Counters for the "stats" control command. dropped counts the samples that
+# were read while the publishing task was too far behind to queue them.
+STATS = {
+    "samples": 0,
+    "read_errors": 0,
+    "dropped": 0,
+    "messages": 0,
+    "sample_rate": 0,
+}
+START_MS = time.ticks_ms()
+
+set_sample_rate(getattr(config, "SAMPLE_RATE", 0))
+set_batch(getattr(config, "BATCH_SIZE", 1), getattr(config, "BATCH_MS", 0))
+
+# Send the jsonb schema every this many frames
+JSONB_SCHEMA_INTERVAL = 200
+JSONB_FRAME_COUNT = 0
+
+
+def send_payload(topic, payload):
+    if BATCH:
+        payload = BATCH.add(payload)
+        if payload is None:
+            return
+    MQTT_CLIENT.publish(topic, payload)
+    STATS["messages"] += 1
 
-def connect_to_wifi(options):
-    global MQTT_CLIENT
-    station = network.WLAN(network.STA_IF)
-    if station.isconnected():
-        if options.RUN_HTTP_SERVER:
-            webserver.start_http_server(station)
-        if options.SEND_MQTT_SENSOR_DATA:
-            MQTT_CLIENT = mqtt_connect(options.MQTT_CONFIG)
+
+def publish_sensor_data(data, payload_format):
+    """Publish the sensor data to MQTT, and also to the serial port. If no IMU is
+    present, publish the system identification instead.
+
+    If config.SEND_SERIAL_SENSOR_DATA is set, send the data on the serial port.
+
+    payload_format is the PAYLOAD_FORMAT when the data was read. If it is
+    "jsonb", the data is packed by jsonb instead of being sent as JSON. If it is
+    "q16", the data holds raw register values, and is packed by quantized.
+
+    If batching is configured, the payloads are sent in batch frames.
+    """
+    global JSONB_FRAME_COUNT
+    if not MQTT_CLIENT:
+        return
+    topic = DATA_TOPIC
+    if payload_format == "q16":
+        payload = quantized.dumps(data)
+    elif payload_format == "jsonb":
+        payload, schema_frame = jsonb.dumps(data)
+        JSONB_FRAME_COUNT += 1
+        # Repeat the schema, for subscribers that connect later
+        if JSONB_FRAME_COUNT >= JSONB_SCHEMA_INTERVAL:
+            JSONB_FRAME_COUNT = 0
+            for frame in jsonb.schema_frames():
+                send_payload(topic, frame)
+        elif schema_frame:
+            send_payload(topic, schema_frame)
+    else:
+        payload = json.dumps(data)
+    send_payload(topic, payload)
+
+
+def send_serial_data(data, euler_scale=1):
+    euler = data.get("euler")
+    if euler is None:
+        return
+    if euler_scale != 1:
+        euler = [v * euler_scale for v in euler]
+    print(";".join(k + "=" + str(v) for k, v in zip(["rx", "ry", "rz"], euler)))
 
 
-def sample_rate_gen():
+def sample_rate_gen(report=True):
+    """Measure the sample rate, into STATS. If report is true, also print it."""
     sample_start_time, sample_count = time.time(), 0
     sample_period = 10
     while True:
@@ -107,54 +310,113 @@ def sample_rate_gen():
         current_time = time.time()
         if current_time - sample_start_time >= sample_period:
             sample_rate = sample_count / (current_time - sample_start_time)
-            print("{:02d}:{:02d}:{:02d}".format(*time.localtime()[3:6]), end=": ")
-            print("{:0.1f} samples/sec".format(sample_rate))
+            STATS["sample_rate"] = sample_rate
+            if report:
+                print("{:02d}:{:02d}:{:02d}".format(*time.localtime()[3:6]), end=": ")
+                print("{:0.1f} samples/sec".format(sample_rate))
             sample_start_time = current_time
             sample_count = 0
 
 
-def blinker_gen(pin_number=2):
-    led = Pin(pin_number, Pin.OUT)
-    next_blink_ms = 0
-    while True:
-        yield
-        if time.ticks_ms() > next_blink_ms:
-            next_blink_ms = time.ticks_ms() + 1000
-            led.value(led.value())
+#
+# Tasks
+#
+
+# Samples that the sampling task has read, and the publishing task hasn't yet
+# sent. This holds at most MAX_PENDING_SAMPLES; beyond that, new samples are
+# dropped.
+PENDING_SAMPLES = []
+MAX_PENDING_SAMPLES = 50
+PENDING_EVENT = asyncio.Event()
 
+# How often the control task checks for MQTT messages
+CONTROL_POLL_MS = 50
 
-def loop_forever(options, mqtt_client):
-    sample_rate_iter = sample_rate_gen()
-    # blink_iter = blinker_gen()
+
+async def sample_task():
+    """Read a sample every SAMPLE_PERIOD_MS, or as fast as possible if this is 0,
+    and queue it for the publishing task.
+
+    The timer keeps the period steady while the other tasks run. If a sample
+    is late, the timer ticks that it missed are skipped, rather than caught up.
+    """
     while True:
-        # Publish the sensor data each time through the loop.
-        # next(blink_iter)
-        # if config.SEND_SERIAL_SENSOR_DATA and select.select([sys.stdin], [], [], 0)[0]:
-        #     cmd = sys.stdin.readline().strip()
-        #     print("# cmd =", repr(cmd))
-        #     if cmd.startswith(":ping "):
-        #         sequence_id = cmd.split(" ")[1]
-        #         print("!pong " + sequence_id)
-        #     elif cmd == ":ping":
-        #         print("!pong")
-        #     elif cmd == ":device_id?":
-        #         print("!device_id=" + DEVICE_ID)
-        if mqtt_client:
-            mqtt_client.check_msg()
-        sensor_data = sensors.get_sensor_data(SENSORS)
+        if SAMPLE_PERIOD_MS:
+            await SAMPLE_FLAG.wait()
+        else:
+            await asyncio.sleep_ms(0)
+        fields = SCHEDULE.due_fields()
+        if not fields:
+            continue
+        # In the q16 format, the samples are the raw register values, which are
+        # sent without being scaled to floats. The format is queued with the
+        # sample, since a control command can change PAYLOAD_FORMAT before the
+        # sample is published.
+        payload_format = PAYLOAD_FORMAT
+        raw_samples = payload_format == "q16"
+        sensor_data = sensors.get_sensor_data(SENSORS, raw=raw_samples, fields=fields)
         if not sensor_data:
+            STATS["read_errors"] += 1
             continue
-        if options.SEND_MQTT_SENSOR_DATA:
-            publish_sensor_data(sensor_data)
-        if options.SEND_SERIAL_SENSOR_DATA:
-            send_serial_data(sensor_data)
-        else:
+        STATS["samples"] += 1
+        webserver.set_sample(sensor_data, raw_samples)
+        if len(PENDING_SAMPLES) >= MAX_PENDING_SAMPLES:
+            STATS["dropped"] += 1
+            continue
+        PENDING_SAMPLES.append((sensor_data, payload_format))
+        PENDING_EVENT.set()
+
+
+async def publish_task(options):
+    """Send the queued samples to MQTT and the serial port."""
+    # Don't print the sample rate between the serial port data
+    sample_rate_iter = sample_rate_gen(report=not options.SEND_SERIAL_SENSOR_DATA)
+    while True:
+        await PENDING_EVENT.wait()
+        PENDING_EVENT.clear()
+        while PENDING_SAMPLES:
+            sensor_data, payload_format = PENDING_SAMPLES.pop(0)
+            if options.SEND_MQTT_SENSOR_DATA:
+                publish_sensor_data(sensor_data, payload_format)
+            if options.SEND_SERIAL_SENSOR_DATA:
+                raw_samples = payload_format == "q16"
+                euler_scale = 1 / bno055.RAW_DIVISORS["euler"] if raw_samples else 1
+                send_serial_data(sensor_data, euler_scale)
             next(sample_rate_iter)
+            # Let the sampling task run between the (blocking) publishes
+            await asyncio.sleep_ms(0)
+
+
+async def batch_task():
+    """Publish a partial batch once its first payload is BATCH_MS old, even if
+    sampling has slowed or stopped."""
+    while True:
+        await asyncio.sleep_ms(max(BATCH_MS // 4, 10) if BATCH_MS else 100)
+        frame = BATCH.flush_if_due() if BATCH else None
+        if frame:
+            publish_batch(frame)
+
+
+async def control_task(mqtt_client):
+    """Receive control messages. See on_mqtt_message."""
+    while True:
+        mqtt_client.check_msg()
+        await asyncio.sleep_ms(CONTROL_POLL_MS)
+
+
+async def main(options):
+    global MQTT_CLIENT
+    station = network.WLAN(network.STA_IF)
+    if station.isconnected():
+        if options.SEND_MQTT_SENSOR_DATA:
+            MQTT_CLIENT = mqtt_connect(options.MQTT_CONFIG)
         if options.RUN_HTTP_SERVER:
-            webserver.service_http_request(
-                mqtt_client=mqtt_client, sensor_data=sensor_data
-            )
+            await webserver.start_http_server(station, MQTT_CLIENT)
+    if MQTT_CLIENT:
+        asyncio.create_task(control_task(MQTT_CLIENT))
+        asyncio.create_task(batch_task())
+    asyncio.create_task(publish_task(options))
+    await sample_task()
 
 
-connect_to_wifi(config)
-loop_forever(config, mqtt_client=MQTT_CLIENT)
+asyncio.run(main(config))
@@ -0,0 +1,68 @@
+import struct
+
+import bno055
+
+# A frame is TAG, a flags byte, a uint32 millisecond timestamp, the divisor of
+# each present int16 field, and the raw register values of the present fields,
+# in the order of FIELDS. See imu_tools/quantized.py.
+TAG = 0x51  # "Q"
+
+# (flag, field name, struct format) in frame order
+FIELDS = (
+    (0x20, "quaternion", "hhhh"),
+    (0x01, "accelerometer", "hhh"),
+    (0x04, "gyroscope", "hhh"),
+    (0x02, "magnetometer", "hhh"),
+    (0x40, "linear_acceleration", "hhh"),
+    (0x10, "euler", "hhh"),
+    (0x08, "calibration", "B"),
+    (0x80, "temperature", "b"),
+)
+
+
+class Encoder:
+    """Packs raw sensor data dicts that have the fields selected by flags.
+    Each frame is packed into the same buffer."""
+
+    def __init__(self, flags):
+        self.flags = flags
+        self.names = [name for flag, name, _fmt in FIELDS if flags & flag]
+        divisors = [
+            bno055.RAW_DIVISORS[n] for n in self.names if n in bno055.RAW_DIVISORS
+        ]
+        self.fmt = "<BBI" + "H" * len(divisors)
+        self.fmt += "".join(fmt for flag, _name, fmt in FIELDS if flags & flag)
+        self.buffer = bytearray(struct.calcsize(self.fmt))
+        self._values = [TAG, flags, 0] + divisors
+
+    def dumps(self, data):
+        """Pack data into the encoder's buffer, and return the buffer.
+
+        The buffer is overwritten by the next call."""
+        values = self._values[:]
+        values[2] = data["timestamp"] & 0xFFFFFFFF
+        for name in self.names:
+            value = data[name]
+            if isinstance(value, tuple):
+                values.extend(value)
+            else:
+                values.append(value)
+        struct.pack_into(self.fmt, self.buffer, 0, *values)
+        return self.buffer
+
+
+# flags -> Encoder
+_encoders = {}
+
+
+def dumps(data):
+    """Pack a dict of raw register values, as returned by
+    sensors.get_sensor_data(imu, raw=True)."""
+    flags = 0
+    for flag, name, _fmt in FIELDS:
+        if name in data:
+            flags |= flag
+    encoder = _encoders.get(flags)
+    if encoder is None:
+        encoder = _encoders[flags] = Encoder(flags)
+    return encoder.dumps(data)
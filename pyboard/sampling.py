@@ -0,0 +1,52 @@
+import utime as time
+
+# The default config.FIELD_RATES: every field, in every sample, except for the
+# slowly-changing calibration and temperature
+DEFAULT_FIELD_RATES = {
+    "accelerometer": 0,
+    "calibration": 1,
+    "euler": 0,
+    "gyroscope": 0,
+    "linear_acceleration": 0,
+    "magnetometer": 0,
+    "quaternion": 0,
+    "temperature": 1,
+}
+
+
+class FieldSchedule:
+    """Decides which fields to read in each sample.
+
+    rates is a dict of field name -> samples per second. A rate of 0 reads the
+    field in every sample. Fields that aren't in rates aren't read.
+    """
+
+    def __init__(self, rates=None):
+        self.set_rates(DEFAULT_FIELD_RATES if rates is None else rates)
+
+    def set_rates(self, rates):
+        self.rates = dict(rates)
+        self.due_ms = {}
+
+    def set_rate(self, name, rate):
+        """Set the rate of one field. A rate of None stops reading it."""
+        if rate is None:
+            self.rates.pop(name, None)
+        else:
+            self.rates[name] = rate
+        self.due_ms.pop(name, None)
+
+    def due_fields(self, now_ms=None):
+        """Return the list of the fields that are due at now_ms, and schedule
+        their next samples."""
+        if now_ms is None:
+            now_ms = time.ticks_ms()
+        fields = []
+        for name, rate in self.rates.items():
+            if rate:
+                due_ms = self.due_ms.get(name)
+                if due_ms is not None and time.ticks_diff(now_ms, due_ms) < 0:
+                    continue
+                self.due_ms[name] = time.ticks_add(now_ms, int(1000 / rate))
+            fields.append(name)
+        return fields
@@ -9,13 +9,17 @@ import config
 
 I2C_PINS = (22, 23) if sys.platform == "esp32" else (5, 4)
 
+# The BNO055 supports I2C fast mode
+MAX_I2C_FREQ = 400000
+
 # The latest caught error, exposed for CLI debugging
 LATEST_ERROR = None
 
 
 def get_imu(use_dummy=False):
     scl, sda = I2C_PINS
-    i2c = I2C(scl=Pin(scl), sda=Pin(sda), freq=100000, timeout=1000)
+    freq = min(getattr(config, "I2C_FREQ", 100000), MAX_I2C_FREQ)
+    i2c = I2C(scl=Pin(scl), sda=Pin(sda), freq=freq, timeout=1000)
     devices = i2c.scan()
     print("I2C scan ->", devices)
     if 40 not in devices:
@@ -29,7 +33,7 @@ def get_imu(use_dummy=False):
     for i in range(10, 0, -1):
         try:
             bno = bno055.BNO055(i2c, verbose=config.TRACE_SPI)
-            print("Using BNO055 @ I2C(scl={}, sda={})".format(scl, sda))
+            print("Using BNO055 @ I2C(scl={}, sda={}, freq={})".format(scl, sda, freq))
             bno.operation_mode(bno055.NDOF_MODE)
             return bno
         except OSError as err:
@@ -49,20 +53,14 @@ def is_retriable_error(err):
     return err.args[0] in (ENODEV, ETIMEDOUT)
 
 
-def get_sensor_data(imu):
+def get_sensor_data(imu, raw=False, fields=None):
+    """Read the IMU's sensors. If raw is true, the vectors are the unscaled
+    register values, for quantized.dumps. If fields is a list of field names,
+    only those fields are read."""
     try:
-        data = {
-            "timestamp": time.ticks_ms(),
-            "accelerometer": imu.accelerometer(),
-            "calibration": imu.calibration(),
-            "euler": imu.euler(),
-            "gyroscope": imu.gyroscope(),
-            "linear_acceleration": imu.linear_acceleration(),
-            "magnetometer": imu.magnetometer(),
-            "quaternion": imu.quaternion(),
-            "temperature": imu.temperature(),
-        }
-        if data["temperature"] == 0.0:
+        data = imu.read_fields(fields, raw=raw)
+        data["timestamp"] = time.ticks_ms()
+        if data.get("temperature") == 0:
             imu.operation_mode(bno055.NDOF_MODE)
     except OSError as err:
         if is_retriable_error(err):
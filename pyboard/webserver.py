@@ -1,58 +1,182 @@
-import socket
+import json
+
+import uasyncio as asyncio
+
+import bno055
+import config
+
+HTTP_PORT = 80
+
+# The default rate of an /events stream, in samples per second. A stream's
+# ?rate= overrides this; 0 sends every sample.
+SSE_RATE = getattr(config, "SSE_RATE", 10)
+
+# The most /events streams that are served at once
+MAX_STREAMS = 4
+
+SERVER = None
+INDEX_PAGE = None
+
+# The latest value of each field, scaled to floats, and its JSON, which is
+# computed when a client asks for it
+LATEST_SAMPLE = {}
+LATEST_JSON = None
+
+# An asyncio.Event for each /events stream, which is set by each sample
+STREAM_EVENTS = []
 
-HTTP_SOCKET = None
 
 # pylint: disable=line-too-long
-def create_web_page_content(mqtt_client, sensor_data):
+def create_web_page_content(mqtt_client):
     html = """
 <html><head> <title>ESP BO055 IMU</title> <meta name="viewport" content="width=device-width, initial-scale=1">
-<meta http-equiv="refresh" content="1">
 <link rel="icon" href="data:,"> <style>html{font-family: Helvetica; display:inline-block; margin: 0px auto; text-align: center;}
 h1{color: #0F3376; padding: 2vh;}p{font-size: 1.5rem;}.button{display: inline-block; background-color: #e7bd3b; border: none;
 border-radius: 4px; color: white; padding: 16px 40px; text-decoration: none; font-size: 30px; margin: 2px; cursor: pointer;}
 .button2{background-color: #4286f4;}</style></head><body> <h1>ESP BO055 IMU</h1>"""
     if mqtt_client:
         html += "<p>Connected to mqtt://" + mqtt_client.server + "</p>"
-    if sensor_data:
-        for k, value in sensor_data.items():
-            html += "<p>" + k + ": <strong>" + str(value) + "</strong></p>"
     html += """
+<div id="data"></div>
+<script>new EventSource("/events?rate=2").onmessage = function (e) {
+var data = JSON.parse(e.data), html = "";
+for (var k in data) html += "<p>" + k + ": <strong>" + data[k] + "</strong></p>";
+document.getElementById("data").innerHTML = html; };</script>
 <p><a href="/?led=on"><button class="button">ON</button></a></p>
 <p><a href="/?led=off"><button class="button button2">OFF</button></a></p></body></html>"""
     return html
 
 
-def start_http_server(wifi_station):
-    global HTTP_SOCKET
+def set_sample(data, raw=False):
+    """Record a sample for the HTTP clients. If raw is true, its vectors are raw
+    register values, which are scaled here.
+
+    This does nothing unless the server is running.
+    """
+    global LATEST_JSON
+    if SERVER is None:
+        return
+    if raw:
+        data = dict(data)
+        for name, divisor in bno055.RAW_DIVISORS.items():
+            if name in data:
+                data[name] = tuple(v / divisor for v in data[name])
+    # Samples can hold a subset of the fields (see sampling.py)
+    LATEST_SAMPLE.update(data)
+    LATEST_JSON = None
+    for event in STREAM_EVENTS:
+        event.set()
+
+
+def latest_json():
+    global LATEST_JSON
+    if LATEST_JSON is None:
+        LATEST_JSON = json.dumps(LATEST_SAMPLE)
+    return LATEST_JSON
+
 
-    HTTP_SOCKET = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+async def start_http_server(wifi_station, mqtt_client):
+    """Serve HTTP requests, in a uasyncio task.
+
+    / is a page that displays the samples. /data.json is the latest sample.
+    /events is a Server-Sent Events stream of the samples, at ?rate= samples
+    per second.
+    """
+    global INDEX_PAGE, SERVER
+
+    async def handle_connection(reader, writer):
+        try:
+            await serve_http_request(reader, writer)
+        except OSError as err:
+            print("HTTP error:", err)
+        finally:
+            writer.close()
+            await writer.wait_closed()
+
+    # The page is the same for every request; the data comes from /events
+    INDEX_PAGE = create_web_page_content(mqtt_client).encode()
     try:
-        HTTP_SOCKET.bind(("", 80))
+        SERVER = await asyncio.start_server(handle_connection, "0.0.0.0", HTTP_PORT)
     except OSError as err:
         if err.args[0] == 112:
             print(err)
-            return
+            return None
         raise err
-    HTTP_SOCKET.listen(5)
     ip_address, _subnet_mask, _gateway, _dns_server = wifi_station.ifconfig()
     print("Listening on http://" + ip_address)
+    return SERVER
+
+
+def parse_query(query):
+    params = {}
+    for item in query.split("&"):
+        if item:
+            key_value = item.split("=", 1)
+            params[key_value[0]] = key_value[-1]
+    return params
 
 
-def service_http_request(mqtt_client, sensor_data):
-    global HTTP_SOCKET
+async def serve_http_request(reader, writer):
+    request_line = await reader.readline()
+    # Skip the headers
+    while True:
+        line = await reader.readline()
+        if line in (b"", b"\r\n", b"\n"):
+            break
+    print("Received HTTP request", request_line)
     try:
+        _method, target, _version = request_line.decode().split()
+    except ValueError:
+        await send_response(writer, "400 Bad Request", "text/plain", b"")
+        return
+    path, query = (target.split("?", 1) + [""])[:2]
+    if path == "/":
+        await send_response(writer, "200 OK", "text/html", INDEX_PAGE)
+    elif path == "/data.json":
+        body = latest_json().encode()
+        await send_response(writer, "200 OK", "application/json", body)
+    elif path == "/events":
+        try:
+            rate = float(parse_query(query).get("rate", SSE_RATE))
+        except ValueError:
+            await send_response(writer, "400 Bad Request", "text/plain", b"")
+            return
+        await stream_events(writer, rate)
+    else:
+        await send_response(writer, "404 Not Found", "text/plain", b"")
+
+
+async def send_response(writer, status, content_type, body):
+    writer.write(b"HTTP/1.1 " + status.encode() + b"\r\n")
+    writer.write(b"Content-Type: " + content_type.encode() + b"\r\n")
+    writer.write(b"Access-Control-Allow-Origin: *\r\n")
+    writer.write(b"Content-Length: " + str(len(body)).encode() + b"\r\n")
+    writer.write(b"Connection: close\r\n\r\n")
+    writer.write(body)
+    await writer.drain()
 
-        conn, addr = HTTP_SOCKET.accept()
-        connected = True
-    except OSError:  # EAGAIN
-        connected = False
-    if connected:
-        print("Received HTTP request from", addr[0])
-        # request = conn.recv(1024)
-        # print("Content =", request)
-        response = create_web_page_content(mqtt_client, sensor_data)
-        conn.send(b"HTTP/1.1 200 OK\n")
-        conn.send(b"Content-Type: text/html\n")
-        conn.send(b"Connection: close\n\n")
-        conn.sendall(response)
-        conn.close()
+
+async def stream_events(writer, rate):
+    """Send each sample, or at most rate samples per second, as a Server-Sent
+    Event, until the client disconnects."""
+    if len(STREAM_EVENTS) >= MAX_STREAMS:
+        await send_response(writer, "503 Service Unavailable", "text/plain", b"")
+        return
+    period_ms = int(1000 / rate) if rate > 0 else 0
+    event = asyncio.Event()
+    STREAM_EVENTS.append(event)
+    try:
+        writer.write(b"HTTP/1.1 200 OK\r\n")
+        writer.write(b"Content-Type: text/event-stream\r\n")
+        writer.write(b"Cache-Control: no-cache\r\n")
+        writer.write(b"Access-Control-Allow-Origin: *\r\n\r\n")
+        await writer.drain()
+        while True:
+            await event.wait()
+            event.clear()
+            writer.write(b"data: " + latest_json().encode() + b"\n\n")
+            await writer.drain()
+            if period_ms:
+                await asyncio.sleep_ms(period_ms)
+    finally:
+        STREAM_EVENTS.remove(event)
@@ -0,0 +1,96 @@
+import importlib
+import json
+
+import numpy as np
+import pytest
+
+from imu_tools.aggregate import (
+    WindowAggregator,
+    aggregate_samples,
+    average_quaternion,
+    window_label,
+)
+
+# imu_tools.aggregate is also the name of the command, in imu_tools/__init__.py
+aggregate_module = importlib.import_module("imu_tools.aggregate")
+
+
+def axis_angle(axis, angle):
+    axis = np.asarray(axis, dtype=float) / np.linalg.norm(axis)
+    return np.concatenate([[np.cos(angle / 2)], np.sin(angle / 2) * axis])
+
+
+def test_average_quaternion_of_one():
+    q = axis_angle((1, 2, 3), 0.5)
+    assert average_quaternion([q]) == pytest.approx(q)
+
+
+def test_average_quaternion_ignores_signs():
+    a, b = axis_angle((0, 0, 1), 0.2), axis_angle((0, 0, 1), 0.4)
+    expected = axis_angle((0, 0, 1), 0.3)
+    assert average_quaternion([a, b]) == pytest.approx(expected)
+    # -b is the same orientation as b
+    assert average_quaternion([a, -b]) == pytest.approx(-expected)
+
+
+def test_average_quaternion_sign_follows_last_sample():
+    q = axis_angle((1, 0, 0), 1.0)
+    assert average_quaternion([q, -q]) == pytest.approx(-q)
+
+
+def test_window_label():
+    assert window_label(0.1) == "100ms"
+    assert window_label(0.25) == "250ms"
+    assert window_label(1) == "1s"
+    assert window_label(2.5) == "2.5s"
+
+
+def test_aggregate_samples():
+    samples = [
+        {"timestamp": 10, "accelerometer": [0, 1, 2], "temperature": 20},
+        {"timestamp": 20, "accelerometer": [2, 3, 4], "calibration": 255},
+        {"accelerometer": [4, 5, 0], "temperature": 22, "quaternion": None},
+    ]
+    result = aggregate_samples(samples)
+    assert result["count"] == 3
+    assert result["timestamp"] == 20
+    assert result["accelerometer"] == [2, 3, 2]
+    assert result["temperature"] == 21
+    assert result["calibration"] == 255
+    assert result["min"]["accelerometer"] == [0, 1, 0]
+    assert result["max"]["accelerometer"] == [4, 5, 4]
+    assert result["last"]["accelerometer"] == [4, 5, 0]
+    assert "quaternion" not in result
+    assert "euler" not in result
+    # The aggregate is published as JSON
+    assert json.loads(json.dumps(result)) == result
+
+
+def test_aggregate_quaternions():
+    a, b = axis_angle((0, 1, 0), 0.2), axis_angle((0, 1, 0), 0.4)
+    result = aggregate_samples([{"quaternion": a.tolist()}, {"quaternion": b.tolist()}])
+    assert result["quaternion"] == pytest.approx(axis_angle((0, 1, 0), 0.3))
+    assert result["last"]["quaternion"] == pytest.approx(b)
+    assert "timestamp" not in result
+
+
+def test_window_aggregator(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(aggregate_module.time, "monotonic", lambda: now[0])
+    aggregator = WindowAggregator(0.5)
+    assert aggregator.next_flush == 100.5
+    aggregator.append("a", {"temperature": 20})
+    aggregator.append("b", {"temperature": 30})
+    aggregator.append("a", {"temperature": 22})
+    now[0] = 100.6
+    results = dict(aggregator.flush())
+    assert list(results) == ["imu-agg/500ms/a", "imu-agg/500ms/b"]
+    assert results["imu-agg/500ms/a"]["temperature"] == 21
+    assert results["imu-agg/500ms/a"]["count"] == 2
+    # The windows stay on schedule
+    assert aggregator.next_flush == 101.0
+    assert aggregator.flush() == []
+    # After a stall, the next window starts now
+    now[0] = 105.0
+    aggregator.flush()
+    assert aggregator.next_flush == 105.0
@@ -0,0 +1,154 @@
+import importlib.util
+import sys
+import types
+from pathlib import Path
+
+import pytest
+
+from imu_tools.batch import (
+    MAX_BATCH_SIZE,
+    BatchItem,
+    encode_batch,
+    is_batch_payload,
+    iter_batches,
+    split_batch,
+    split_message,
+)
+
+PAYLOADS = [b'{"timestamp": 1}', b"", bytes(range(256)) * 4]
+
+
+def test_round_trip():
+    frame = encode_batch(PAYLOADS)
+    assert is_batch_payload(frame)
+    assert split_batch(frame) == PAYLOADS
+
+
+def test_str_payloads():
+    assert split_batch(encode_batch(["{}", "é"])) == [b"{}", "é".encode()]
+
+
+def test_empty_batch():
+    assert split_batch(encode_batch([])) == []
+
+
+def test_truncated_batch():
+    frame = encode_batch(PAYLOADS)
+    with pytest.raises(ValueError):
+        split_batch(frame[:-1])
+
+
+def test_not_a_batch():
+    assert not is_batch_payload(b"")
+    assert not is_batch_payload(b"{}")
+    with pytest.raises(ValueError):
+        split_batch(b"{}")
+
+
+def test_iter_batches():
+    payloads = [b"%d" % i for i in range(7)]
+    frames = list(iter_batches(payloads, 3))
+    assert [split_batch(frame) for frame in frames] == [
+        payloads[:3],
+        payloads[3:6],
+        payloads[6:],
+    ]
+    assert list(iter_batches([], 3)) == []
+
+
+def test_split_message():
+    msg = BatchItem("imu/a", encode_batch(PAYLOADS), 12.5)
+    assert split_message(msg) == [
+        BatchItem("imu/a", payload, 12.5) for payload in PAYLOADS
+    ]
+
+
+@pytest.mark.parametrize("payload", [b"{}", encode_batch(PAYLOADS)[:-1]])
+def test_split_message_passes_other_messages_through(payload):
+    msg = BatchItem("imu/a", payload, 12.5)
+    assert split_message(msg) == [msg]
+
+
+class FakeClock:
+    """A stand-in for MicroPython's utime module."""
+
+    def __init__(self):
+        self.now_ms = 1000
+
+    def ticks_ms(self):
+        return self.now_ms
+
+    @staticmethod
+    def ticks_diff(end, start):
+        return end - start
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    utime = types.ModuleType("utime")
+    utime.ticks_ms = clock.ticks_ms
+    utime.ticks_diff = clock.ticks_diff
+    monkeypatch.setitem(sys.modules, "utime", utime)
+    return clock
+
+
+@pytest.fixture
+def device_batch(clock):  # pylint: disable=unused-argument
+    """pyboard/batch.py"""
+    path = Path(__file__).parent.parent / "pyboard" / "batch.py"
+    spec = importlib.util.spec_from_file_location("device_batch", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def test_device_encoder_matches(device_batch):
+    assert bytes(device_batch.encode_batch(PAYLOADS)) == encode_batch(PAYLOADS)
+
+
+def test_device_batch_size(device_batch):
+    batch = device_batch.Batch(size=3)
+    assert batch.add(b"1") is None
+    assert batch.add("2") is None
+    assert split_batch(batch.add(bytearray(b"3"))) == [b"1", b"2", b"3"]
+    assert batch.flush() is None
+
+
+def test_device_batch_copies_payloads(device_batch):
+    batch = device_batch.Batch(size=2)
+    buffer = bytearray(b"a")
+    batch.add(buffer)
+    buffer[0] = ord("b")
+    assert split_batch(batch.add(buffer)) == [b"a", b"b"]
+
+
+def test_device_batch_period(device_batch, clock):
+    batch = device_batch.Batch(size=10, period_ms=100)
+    assert batch.add(b"1") is None
+    clock.now_ms += 99
+    assert batch.add(b"2") is None
+    assert batch.flush_if_due() is None
+    clock.now_ms += 1
+    assert split_batch(batch.add(b"3")) == [b"1", b"2", b"3"]
+
+
+def test_device_batch_flush_if_due(device_batch, clock):
+    batch = device_batch.Batch(size=10, period_ms=100)
+    assert batch.flush_if_due() is None
+    batch.add(b"1")
+    clock.now_ms += 150
+    assert split_batch(batch.flush_if_due()) == [b"1"]
+    assert batch.flush_if_due() is None
+    # Without a period, only the size completes a batch
+    batch = device_batch.Batch(size=10)
+    batch.add(b"1")
+    clock.now_ms += 10_000
+    assert batch.flush_if_due() is None
+
+
+def test_device_batch_max_size(device_batch):
+    batch = device_batch.Batch()
+    frames = [batch.add(b"x") for _ in range(MAX_BATCH_SIZE)]
+    assert frames[:-1] == [None] * (MAX_BATCH_SIZE - 1)
+    assert len(split_batch(frames[-1])) == MAX_BATCH_SIZE
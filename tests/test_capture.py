@@ -0,0 +1,100 @@
+import pytest
+
+from imu_tools import capture
+from imu_tools.capture import CaptureWriter, iter_capture, iter_replay
+
+RECORDS = [
+    ("imu/a", 100.0, b'{"timestamp": 1}'),
+    ("imu/b", 100.25, bytes(range(256))),
+    ("imu/a", 100.5, b""),
+]
+
+
+def write_capture(path, records=RECORDS):
+    with CaptureWriter(path) as writer:
+        for topic, received, payload in records:
+            writer.append(topic, payload, received)
+
+
+def test_round_trip(tmp_path):
+    path = tmp_path / "session.cap"
+    write_capture(path)
+    assert list(iter_capture(path)) == RECORDS
+
+
+def test_append(tmp_path):
+    path = tmp_path / "session.cap"
+    write_capture(path, RECORDS[:1])
+    write_capture(path, RECORDS[1:])
+    assert list(iter_capture(path)) == RECORDS
+
+
+def test_default_receive_time(tmp_path):
+    path = tmp_path / "session.cap"
+    with CaptureWriter(path) as writer:
+        writer.append("imu/a", b"{}")
+    [(_topic, received, _payload)] = iter_capture(path)
+    assert received > 0
+
+
+def test_partially_written_record(tmp_path):
+    path = tmp_path / "session.cap"
+    write_capture(path, RECORDS[:2])
+    with open(path, "r+b") as fp:
+        fp.truncate(path.stat().st_size - 1)
+    assert list(iter_capture(path)) == RECORDS[:1]
+
+
+def test_not_a_capture_file(tmp_path):
+    path = tmp_path / "session.cap"
+    path.write_bytes(b"not a capture file")
+    with pytest.raises(ValueError):
+        list(iter_capture(path))
+
+
+class FakeClock:
+    def __init__(self, monkeypatch):
+        self.now = 50.0
+        monkeypatch.setattr(capture.time, "monotonic", lambda: self.now)
+        monkeypatch.setattr(capture.time, "sleep", self.sleep)
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+def replay_times(clock, speed, delays=None):
+    stats = {}
+    times = []
+    for i, record in enumerate(iter_replay(RECORDS, speed, stats)):
+        assert record == RECORDS[i]
+        times.append(clock.now)
+        clock.now += (delays or {}).get(i, 0)
+    return times, stats
+
+
+def test_replay_pace(monkeypatch):
+    clock = FakeClock(monkeypatch)
+    times, stats = replay_times(clock, speed=1)
+    assert times == [50.0, 50.25, 50.5]
+    assert stats["max_lag"] == 0
+
+
+def test_replay_speed(monkeypatch):
+    clock = FakeClock(monkeypatch)
+    times, _stats = replay_times(clock, speed=2)
+    assert times == [50.0, 50.125, 50.25]
+
+
+def test_replay_lag(monkeypatch):
+    clock = FakeClock(monkeypatch)
+    # A delay in the consumer doesn't push back the later records
+    times, stats = replay_times(clock, speed=1, delays={0: 0.375})
+    assert times == [50.0, 50.375, 50.5]
+    assert stats["max_lag"] == pytest.approx(0.125)
+
+
+def test_replay_unpaced(monkeypatch):
+    clock = FakeClock(monkeypatch)
+    times, stats = replay_times(clock, speed=0)
+    assert times == [50.0] * 3
+    assert stats == {}
@@ -0,0 +1,89 @@
+import queue
+import threading
+from collections import namedtuple
+
+import pytest
+
+from imu_tools.conflate import ConflatingQueue
+from imu_tools.jsonb import Encoder
+
+Message = namedtuple("Message", "topic payload")
+
+
+def drain(q):
+    messages = []
+    while q.qsize():
+        messages.append(q.get_nowait())
+    return messages
+
+
+def test_keeps_newest_depth_messages_per_key():
+    q = ConflatingQueue(depth=2)
+    for i in range(5):
+        q.put(Message("imu/a", b"%d" % i))
+    q.put(Message("imu/b", b"b"))
+    assert q.qsize() == 3
+    assert drain(q) == [
+        Message("imu/a", b"3"),
+        Message("imu/b", b"b"),
+        Message("imu/a", b"4"),
+    ]
+
+
+def test_round_robin():
+    q = ConflatingQueue(depth=3)
+    for i in range(3):
+        q.put(Message("imu/a", b"a%d" % i))
+    q.put(Message("imu/b", b"b0"))
+    assert [m.payload for m in drain(q)] == [b"a0", b"b0", b"a1", b"a2"]
+
+
+def test_drop_counts():
+    q = ConflatingQueue(depth=1)
+    for topic in ["imu/a"] * 3 + ["imu/b"] * 2 + ["imu/c"]:
+        q.put(Message(topic, b"{}"))
+    assert q.take_drop_counts() == {"imu/a": 2, "imu/b": 1}
+    assert q.take_drop_counts() == {}
+    assert q.total_dropped == 3
+
+
+def test_custom_key():
+    q = ConflatingQueue(depth=1, key=lambda msg: msg.payload[:1])
+    q.put(Message("imu/a", b"x1"))
+    q.put(Message("imu/b", b"x2"))
+    assert drain(q) == [Message("imu/b", b"x2")]
+
+
+def test_schema_frames_are_never_dropped():
+    encoder = Encoder({"t": 0})
+    q = ConflatingQueue(depth=1)
+    q.put(Message("imu/a", encoder.schema_frame()))
+    for i in range(3):
+        q.put(Message("imu/a", encoder.dumps({"t": i})))
+    q.put(Message("imu/a", encoder.schema_frame()))
+    # The schema frames come first, and then the newest data frame
+    assert [m.payload for m in drain(q)] == [
+        encoder.schema_frame(),
+        encoder.schema_frame(),
+        encoder.dumps({"t": 2}),
+    ]
+    assert q.total_dropped == 2
+
+
+def test_get_empty():
+    q = ConflatingQueue()
+    with pytest.raises(queue.Empty):
+        q.get_nowait()
+    with pytest.raises(queue.Empty):
+        q.get(timeout=0.01)
+
+
+def test_get_blocks_until_put():
+    q = ConflatingQueue()
+    msg = Message("imu/a", b"{}")
+    timer = threading.Timer(0.05, q.put, [msg])
+    timer.start()
+    try:
+        assert q.get(timeout=5) == msg
+    finally:
+        timer.cancel()
@@ -0,0 +1,130 @@
+import numpy as np
+import pytest
+
+from imu_tools.fusion import MAX_DT, Fusion, madgwick_update
+
+IDENTITY = [1.0, 0.0, 0.0, 0.0]
+
+
+def update(q, gyro, accel, mag=(0, 0, 0), dt=0.01, beta=0.1):
+    """madgwick_update for one device."""
+    return madgwick_update(
+        np.array([q], dtype=float),
+        np.array([gyro], dtype=float),
+        np.array([accel], dtype=float),
+        np.array([mag], dtype=float),
+        np.array([dt]),
+        beta,
+    )[0]
+
+
+def gravity(q):
+    """The direction of gravity in the sensor frame, for orientation q."""
+    q0, q1, q2, q3 = q
+    return np.array(
+        [2 * (q1 * q3 - q0 * q2), 2 * (q0 * q1 + q2 * q3), 1 - 2 * (q1 * q1 + q2 * q2)]
+    )
+
+
+@pytest.mark.parametrize("mag", [(0, 0, 0), (20, 0, -40), (np.nan,) * 3])
+def test_level_and_still_stays_put(mag):
+    q = IDENTITY
+    for _ in range(100):
+        q = update(q, (0, 0, 0), (0, 0, 9.8), mag)
+    assert q == pytest.approx(IDENTITY, abs=1e-9)
+
+
+def test_integrates_gyroscope():
+    q = IDENTITY
+    # A quarter turn around z, with no accelerometer correction
+    for _ in range(100):
+        q = update(q, (0, 0, np.pi / 2), (0, 0, 0))
+    assert q == pytest.approx([np.cos(np.pi / 4), 0, 0, np.sin(np.pi / 4)], abs=1e-3)
+
+
+def test_converges_to_gravity():
+    # The sensor is tilted 30° around x
+    angle = np.radians(30)
+    accel = np.array([0, np.sin(angle), np.cos(angle)])
+    q = IDENTITY
+    for _ in range(2000):
+        q = update(q, (0, 0, 0), accel * 9.8, beta=0.5)
+    assert np.linalg.norm(q) == pytest.approx(1)
+    # The fixed-size gradient step dithers around the solution
+    assert gravity(q) == pytest.approx(accel, abs=1e-2)
+
+
+def test_vectorized_matches_single_device():
+    rng = np.random.default_rng(0)
+    n = 5
+    q = rng.normal(size=(n, 4))
+    q /= np.linalg.norm(q, axis=1, keepdims=True)
+    gyro = rng.normal(size=(n, 3))
+    accel = rng.normal(size=(n, 3))
+    mag = rng.normal(size=(n, 3))
+    mag[1] = 0  # without a magnetometer
+    accel[2] = 0  # without an accelerometer
+    dt = rng.uniform(0.001, 0.02, size=n)
+    batch = madgwick_update(q, gyro, accel, mag, dt, 0.1)
+    for i in range(n):
+        assert batch[i] == pytest.approx(
+            update(q[i], gyro[i], accel[i], mag[i], dt[i]), abs=1e-12
+        )
+
+
+def z_step(angle):
+    """The result of one update from IDENTITY, with a rotation of angle radians
+    around z, and without a correction step."""
+    q = np.array([1, 0, 0, angle / 2])
+    return q / np.linalg.norm(q)
+
+
+def sample(timestamp, gyro=(0, 0, 0), accel=(0, 0, 1)):
+    return {"timestamp": timestamp, "gyroscope": gyro, "accelerometer": accel}
+
+
+def test_fusion_update_order_and_devices():
+    fusion = Fusion()
+    results = fusion.update(
+        [
+            ("a", sample(0), 0),
+            ("a", sample(10), 0),
+            ("b", sample(0), 0),
+            ("c", {"quaternion": IDENTITY}, 0),  # not a raw sample
+            ("a", sample(20), 0),
+        ]
+    )
+    # One round of a, b; then a; then a
+    assert [(device_id, t) for device_id, t, _q in results] == [
+        ("a", 0),
+        ("b", 0),
+        ("a", 10),
+        ("a", 20),
+    ]
+    assert fusion.device_indices == {"a": 0, "b": 1}
+
+
+def test_fusion_uses_device_timestamps():
+    fusion = Fusion(beta=0)
+    rate = (0, 0, np.pi / 2)
+    # The receive times don't matter when there is a timestamp, in milliseconds
+    fusion.update([("a", sample(0, rate), 50.0)])
+    [(_device_id, _t, q)] = fusion.update([("a", sample(50, rate), 50.0)])
+    assert q == pytest.approx(z_step(np.pi / 2 * 0.05))
+
+
+def test_fusion_uses_receive_times_without_timestamps():
+    fusion = Fusion(beta=0)
+    data = {"gyroscope": (0, 0, 1), "accelerometer": (0, 0, 1)}
+    fusion.update([("a", data, 100.0)])
+    [(_device_id, t, q)] = fusion.update([("a", data, 100.02)])
+    assert t is None
+    assert q == pytest.approx(z_step(0.02))
+
+
+def test_fusion_clamps_long_time_steps():
+    fusion = Fusion(beta=0, gyro_scale=np.pi / 180)
+    rate = (0, 0, 90)  # degrees/second
+    fusion.update([("a", sample(0, rate), 0)])
+    [(_device_id, _t, q)] = fusion.update([("a", sample(60_000, rate), 0)])
+    assert q == pytest.approx(z_step(np.pi / 2 * MAX_DT))
@@ -0,0 +1,109 @@
+import importlib.util
+from pathlib import Path
+
+import pytest
+
+from imu_tools.jsonb import (
+    Decoder,
+    Encoder,
+    is_jsonb_payload,
+    is_schema_payload,
+    iter_jsonb_payloads,
+)
+
+SAMPLE = {
+    "timestamp": 123456,
+    "quaternion": [1.0, 0.0, 0.5, -0.5],
+    "calibration": 255,
+    "temperature": 27.5,
+    "moving": True,
+    "device": "esp-1",
+    "uptime_ms": 1 << 40,
+}
+
+
+def round_trip(sample):
+    encoder = Encoder(sample)
+    decoder = Decoder()
+    assert decoder.decode(encoder.schema_frame()) is None
+    return decoder.decode(encoder.dumps(sample))
+
+
+def test_round_trip():
+    data = round_trip(SAMPLE)
+    assert data == {
+        **SAMPLE,
+        # sequences are decoded as tuples
+        "quaternion": tuple(SAMPLE["quaternion"]),
+    }
+    assert isinstance(data["moving"], bool)
+
+
+def test_floats_are_float32():
+    data = round_trip({"x": 0.1})
+    assert data["x"] != 0.1
+    assert data["x"] == pytest.approx(0.1)
+
+
+def test_encoder_reuse():
+    encoder = Encoder(SAMPLE)
+    decoder = Decoder()
+    decoder.decode(encoder.schema_frame())
+    first = encoder.dumps(SAMPLE)
+    second = encoder.dumps(dict(SAMPLE, timestamp=7))
+    # dumps returns a copy of its buffer
+    assert decoder.decode(first)["timestamp"] == 123456
+    assert decoder.decode(second)["timestamp"] == 7
+
+
+def test_schema_id_depends_on_shape():
+    assert Encoder(SAMPLE).schema_id == Encoder(dict(SAMPLE, timestamp=1)).schema_id
+    assert Encoder(SAMPLE).schema_id != Encoder({"timestamp": 1}).schema_id
+
+
+def test_unknown_schema():
+    payload = Encoder(SAMPLE).dumps(SAMPLE)
+    with pytest.raises(KeyError):
+        Decoder().decode(payload)
+
+
+def test_not_a_jsonb_frame():
+    with pytest.raises(ValueError):
+        Decoder().decode(b"Q\x00\x00")
+
+
+def test_payload_predicates():
+    encoder = Encoder(SAMPLE)
+    assert is_jsonb_payload(encoder.schema_frame())
+    assert is_schema_payload(encoder.schema_frame())
+    assert is_jsonb_payload(encoder.dumps(SAMPLE))
+    assert not is_schema_payload(encoder.dumps(SAMPLE))
+    assert not is_jsonb_payload(b"")
+    assert not is_schema_payload(b"")
+    assert not is_jsonb_payload(b"{}")
+
+
+def test_iter_jsonb_payloads():
+    samples = [{"t": i} for i in range(5)] + [{"t": 5, "x": 1.0}]
+    payloads = list(iter_jsonb_payloads(samples, schema_interval=3))
+    # A schema before the first frame, every third frame, and when the shape
+    # changes
+    assert [i for i, p in enumerate(payloads) if is_schema_payload(p)] == [0, 4, 7]
+    decoder = Decoder()
+    decoded = [decoder.decode(p) for p in payloads]
+    assert [d for d in decoded if d is not None] == samples
+
+
+def load_device_jsonb():
+    path = Path(__file__).parent.parent / "pyboard" / "jsonb.py"
+    spec = importlib.util.spec_from_file_location("device_jsonb", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def test_matches_device_encoder():
+    device_encoder = load_device_jsonb().Encoder(SAMPLE)
+    encoder = Encoder(SAMPLE)
+    assert device_encoder.schema_frame() == encoder.schema_frame()
+    assert bytes(device_encoder.dumps(SAMPLE)) == encoder.dumps(SAMPLE)
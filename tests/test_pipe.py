@@ -0,0 +1,91 @@
+import io
+import struct
+
+import pytest
+
+from imu_tools.pipe import ANNOUNCE_FLAG, RECORD, BinaryPipeWriter, TextPipeWriter
+
+QUATERNION = (1.0, 0.0, 0.5, -0.5)
+
+
+def read_records(data):
+    """Decode a binary pipe stream, as blender/rig.py does, into a list of
+    (device_id, timestamp, quaternion) tuples."""
+    device_ids = {}
+    records = []
+    for offset in range(0, len(data), RECORD.size):
+        record = data[offset : offset + RECORD.size]
+        (index,) = struct.unpack_from("<H", record)
+        if index & ANNOUNCE_FLAG:
+            device_ids[index & ~ANNOUNCE_FLAG] = record[2:].rstrip(b"\0").decode()
+            continue
+        _index, timestamp, *quaternion = RECORD.unpack(record)
+        records.append((device_ids[index], timestamp, tuple(quaternion)))
+    return records
+
+
+def test_text_format():
+    fp = io.StringIO()
+    TextPipeWriter(fp).write_samples(
+        [("a", {"quaternion": QUATERNION}), ("a", {"euler": (0, 0, 0)})]
+    )
+    assert fp.getvalue() == "quaternion: 1.0, 0.0, 0.5, -0.5\n"
+
+
+def test_binary_format():
+    fp = io.BytesIO()
+    writer = BinaryPipeWriter(fp)
+    writer.write_samples(
+        [
+            ("a", {"timestamp": 1, "quaternion": QUATERNION}),
+            ("b", {"timestamp": 2, "quaternion": QUATERNION}),
+        ]
+    )
+    writer.write_samples([("a", {"timestamp": 3, "quaternion": QUATERNION})])
+    data = fp.getvalue()
+    # Two announcements, and three samples
+    assert len(data) == 5 * RECORD.size
+    assert read_records(data) == [
+        ("a", 1, QUATERNION),
+        ("b", 2, QUATERNION),
+        ("a", 3, QUATERNION),
+    ]
+
+
+def test_binary_skips_samples_without_quaternions():
+    fp = io.BytesIO()
+    writer = BinaryPipeWriter(fp)
+    writer.write_samples([("a", {"euler": (0, 0, 0)})])
+    assert fp.getvalue() == b""
+    assert not writer.device_indices
+
+
+def test_binary_timestamp_and_device_id_limits():
+    fp = io.BytesIO()
+    device_id = "d" * 40
+    BinaryPipeWriter(fp).write_samples(
+        [(device_id, {"timestamp": (1 << 32) + 5, "quaternion": QUATERNION})]
+    )
+    [(announced_id, timestamp, _quaternion)] = read_records(fp.getvalue())
+    assert announced_id == device_id[: RECORD.size - 2]
+    assert timestamp == 5
+
+
+def test_binary_quaternion_is_float32():
+    fp = io.BytesIO()
+    BinaryPipeWriter(fp).write_samples([("a", {"quaternion": (0.1, 0, 0, 0)})])
+    [(_device_id, _timestamp, quaternion)] = read_records(fp.getvalue())
+    assert quaternion[0] == pytest.approx(0.1)
+
+
+@pytest.mark.parametrize(
+    "quaternion", [None, (1.0, 0.0, 0.0), (1, 0, 0, 0, 0), "abcd", (1, 0, None, 0)]
+)
+def test_invalid_quaternions_are_skipped(quaternion):
+    samples = [("a", {"quaternion": quaternion}), ("b", {"quaternion": QUATERNION})]
+    fp = io.BytesIO()
+    BinaryPipeWriter(fp).write_samples(samples)
+    assert [record[0] for record in read_records(fp.getvalue())] == ["b"]
+    fp = io.StringIO()
+    TextPipeWriter(fp).write_samples(samples)
+    assert fp.getvalue() == "quaternion: 1.0, 0.0, 0.5, -0.5\n"
@@ -0,0 +1,31 @@
+import importlib
+import itertools
+
+import numpy as np
+import pytest
+
+from imu_tools.pub import euler2quat, euler2quat_array, gen_sample_blocks, gen_samples
+
+# imu_tools.pub is also the name of the command, in imu_tools/__init__.py
+pub_module = importlib.import_module("imu_tools.pub")
+
+
+def test_euler2quat_array_matches_euler2quat():
+    rng = np.random.default_rng(0)
+    euler = rng.uniform(-np.pi, np.pi, size=(50, 3))
+    expected = [euler2quat(*row) for row in euler]
+    assert euler2quat_array(euler) == pytest.approx(np.array(expected))
+
+
+@pytest.mark.parametrize("axes", [range(3), (0, 2)])
+def test_sample_blocks_match_samples(monkeypatch, axes):
+    # Both generators start at a random time
+    monkeypatch.setattr(pub_module.random, "random", lambda: 0.25)
+    samples = list(itertools.islice(gen_samples(axes), 40))
+    blocks = list(itertools.islice(gen_sample_blocks(axes, block_size=16), 3))
+    for name in blocks[0]:
+        values = np.concatenate([block[name] for block in blocks])[: len(samples)]
+        assert values == pytest.approx(np.array([s[name] for s in samples])), name
+    # Only the samples have a timestamp; iter_json_payloads adds the blocks'
+    assert "timestamp" not in blocks[0]
+    assert all("timestamp" in sample for sample in samples)
@@ -0,0 +1,125 @@
+import itertools
+
+import pytest
+
+from imu_tools.pub import gen_register_samples
+from imu_tools.quantized import (
+    FIELDS,
+    decode_quantized_frame,
+    decode_quantized_frame_dicts,
+    decode_quantized_frames,
+    encode_quantized,
+    is_quantized_payload,
+)
+from imu_tools.sensor_encoding import (
+    MIN_QUANTIZED_RUN,
+    decode_payload,
+    decode_payloads,
+    encode_sensor_data,
+)
+
+SAMPLE = {
+    "timestamp": 123456,
+    "quaternion": [1.0, 0.0, 0.5, -0.5],
+    "accelerometer": [0.25, -9.75, 1.5],
+    "gyroscope": [0.0, 1.0, -2.0],
+    "magnetometer": [30.0, -31.0, 32.0],
+    "linear_acceleration": [0.0, 0.12, 0.0],
+    "euler": [10.0, 20.0, 359.9375],
+    "calibration": 255,
+    "temperature": -5,
+}
+
+DIVISORS = {name: divisor for _flag, name, _count, divisor in FIELDS if divisor}
+
+
+def assert_within_quantization(decoded, data):
+    for name, value in data.items():
+        divisor = DIVISORS.get(name)
+        if divisor:
+            assert decoded[name] == pytest.approx(value, abs=0.5 / divisor)
+        else:
+            assert decoded[name] == value
+
+
+def test_round_trip():
+    payload = encode_quantized(SAMPLE)
+    assert is_quantized_payload(payload)
+    assert_within_quantization(decode_quantized_frame(payload), SAMPLE)
+
+
+def test_frame_sizes():
+    # See the README
+    assert len(encode_quantized(SAMPLE)) == 58
+    data = dict(SAMPLE)
+    del data["linear_acceleration"]
+    assert len(encode_quantized(data)) == 50
+
+
+@pytest.mark.parametrize("names", [(), ("quaternion",), ("calibration", "euler")])
+def test_subset_of_fields(names):
+    data = {name: SAMPLE[name] for name in names}
+    decoded = decode_quantized_frame(encode_quantized(data))
+    assert decoded.pop("timestamp") == 0
+    assert list(decoded) == [name for _f, name, _c, _d in FIELDS if name in data]
+    assert_within_quantization(decoded, data)
+
+
+def test_out_of_range():
+    data = {"accelerometer": [0, 0, 400.0]}
+    with pytest.raises(ValueError, match="accelerometer"):
+        encode_quantized(data)
+    decoded = decode_quantized_frame(encode_quantized(data, clip=True))
+    assert decoded["accelerometer"][2] == pytest.approx(327.67)
+    data = {"accelerometer": [0, 0, -400.0]}
+    decoded = decode_quantized_frame(encode_quantized(data, clip=True))
+    assert decoded["accelerometer"][2] == pytest.approx(-327.68)
+
+
+def test_register_samples_are_in_range():
+    for sample in itertools.islice(gen_register_samples(), 2000):
+        encode_quantized(sample)
+
+
+def test_truncated_frame():
+    payload = encode_quantized(SAMPLE)
+    for size in (1, 5, len(payload) - 1):
+        with pytest.raises(ValueError):
+            decode_quantized_frame(payload[:size])
+
+
+def test_decode_frames_matches_decode_frame():
+    samples = list(itertools.islice(gen_register_samples(), 20))
+    payloads = [encode_quantized(sample) for sample in samples]
+    columns = decode_quantized_frames(payloads)
+    assert columns["quaternion"].shape == (20, 4)
+    timestamps = [s["timestamp"] & 0xFFFFFFFF for s in samples]
+    assert columns["timestamp"].tolist() == timestamps
+    assert decode_quantized_frame_dicts(payloads) == [
+        decode_quantized_frame(payload) for payload in payloads
+    ]
+
+
+def test_decode_frames_with_different_fields():
+    payloads = [encode_quantized(SAMPLE), encode_quantized({"euler": [0, 0, 0]})]
+    with pytest.raises(ValueError):
+        decode_quantized_frames(payloads)
+    payloads = [encode_quantized(SAMPLE), encode_quantized(SAMPLE)[:-1]]
+    with pytest.raises(ValueError):
+        decode_quantized_frames(payloads)
+
+
+def test_decode_payloads_matches_decode_payload():
+    frames = [encode_quantized(s) for s in itertools.islice(gen_register_samples(), 30)]
+    other = encode_quantized({"euler": [1, 2, 3]})
+    payloads = (
+        frames[:MIN_QUANTIZED_RUN]  # decoded together
+        + [b'{"timestamp": 1}', other]
+        + frames[:3]  # too short a run to decode together
+        + [encode_sensor_data({"euler": (1, 2, 3)})]
+        + frames[:5]
+        + [frames[0][:-1]]  # malformed, within a run
+        + frames[:5]
+        + [b"", b"Q"]
+    )
+    assert decode_payloads(payloads) == list(map(decode_payload, payloads))
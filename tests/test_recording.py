@@ -0,0 +1,146 @@
+import math
+
+import numpy as np
+import pytest
+
+from imu_tools import recording
+from imu_tools.recording import (
+    Recording,
+    RecordingWriter,
+    device_id_from_topic,
+    is_sample_topic,
+)
+
+SAMPLE = {
+    "timestamp": 1234,
+    "quaternion": [1.0, 0.0, 0.5, -0.5],
+    "euler": [10.0, 20.0, 30.0],
+    "accelerometer": [0.25, -9.75, 1.5],
+    "gyroscope": [0.0, 1.0, -2.0],
+    "magnetometer": [30.0, 31.0, 32.0],
+    "linear_acceleration": [0.0, 0.125, 0.0],
+    "calibration": 255,
+    "temperature": 27.5,
+}
+
+
+def test_round_trip(tmp_path):
+    path = tmp_path / "session.rec"
+    with RecordingWriter(path) as writer:
+        writer.append("a", SAMPLE, received=100.5)
+        writer.append("b", dict(SAMPLE, timestamp=5), received=101.0)
+    recording = Recording(path)
+    assert recording.device_ids == ["a", "b"]
+    assert len(recording) == 2
+    record = recording.records()[0]
+    assert record["device"] == 0
+    assert record["received"] == 100.5
+    for name, value in SAMPLE.items():
+        assert record[name].tolist() == value
+    assert recording.device_records("b")["timestamp"].tolist() == [5]
+
+
+def test_missing_fields(tmp_path):
+    path = tmp_path / "session.rec"
+    with RecordingWriter(path) as writer:
+        writer.append("a", {"quaternion": [1, 0, 0, 0]})
+    record = Recording(path).records()[0]
+    assert record["timestamp"] == 0
+    assert record["calibration"] == 0
+    assert np.isnan(record["euler"]).all()
+    assert math.isnan(record["temperature"])
+    assert record["received"] > 0
+
+
+def test_chunks(tmp_path):
+    path = tmp_path / "session.rec"
+    with RecordingWriter(path, chunk_size=4) as writer:
+        for i in range(10):
+            writer.append("a" if i % 2 else "b", dict(SAMPLE, timestamp=i))
+    recording = Recording(path)
+    assert [len(chunk) for chunk in recording.chunks] == [4, 4, 2]
+    assert recording.records()["timestamp"].tolist() == list(range(10))
+    assert recording.device_records("a")["timestamp"].tolist() == [1, 3, 5, 7, 9]
+
+
+def test_append_to_existing_recording(tmp_path):
+    path = tmp_path / "session.rec"
+    with RecordingWriter(path) as writer:
+        writer.append("a", dict(SAMPLE, timestamp=1))
+    with RecordingWriter(path) as writer:
+        writer.append("b", dict(SAMPLE, timestamp=2))
+        writer.append("a", dict(SAMPLE, timestamp=3))
+    recording = Recording(path)
+    assert recording.device_ids == ["a", "b"]
+    assert recording.records()["device"].tolist() == [0, 1, 0]
+
+
+def test_partially_written_chunk(tmp_path):
+    path = tmp_path / "session.rec"
+    with RecordingWriter(path, chunk_size=2) as writer:
+        for i in range(4):
+            writer.append("a", dict(SAMPLE, timestamp=i))
+    with open(path, "r+b") as fp:
+        fp.truncate(path.stat().st_size - 1)
+    assert Recording(path).records()["timestamp"].tolist() == [0, 1]
+
+
+def test_empty_recording(tmp_path):
+    path = tmp_path / "session.rec"
+    RecordingWriter(path).close()
+    recording = Recording(path)
+    assert len(recording) == 0
+    assert len(recording.records()) == 0
+
+
+def test_not_a_recording(tmp_path):
+    path = tmp_path / "session.rec"
+    path.write_bytes(b"not a recording")
+    with pytest.raises(ValueError):
+        Recording(path)
+
+
+def test_topics():
+    assert device_id_from_topic("imu/esp-1") == "esp-1"
+    assert device_id_from_topic("other") == "other"
+    assert is_sample_topic("imu/esp-1")
+    assert not is_sample_topic("imu/control/esp-1")
+    assert not is_sample_topic("imu/control-reply/esp-1")
+
+
+def test_invalid_fields(tmp_path):
+    path = tmp_path / "session.rec"
+    with RecordingWriter(path) as writer:
+        # pyboard/bno055_fake.py's quaternion has three elements
+        writer.append("a", dict(SAMPLE, quaternion=[1.0, 0.0, 0.0]))
+        writer.append("a", dict(SAMPLE, euler=5.0, calibration=[1, 2], gyroscope="x"))
+        writer.append("a", dict(SAMPLE, accelerometer=[[1, 2], [3]]))
+    records = Recording(path).records()
+    assert np.isnan(records[0]["quaternion"]).all()
+    assert records[0]["euler"].tolist() == SAMPLE["euler"]
+    assert np.isnan(records[1]["euler"]).all()
+    assert records[1]["calibration"] == 0
+    assert np.isnan(records[1]["gyroscope"]).all()
+    assert records[1]["quaternion"].tolist() == SAMPLE["quaternion"]
+    assert np.isnan(records[2]["accelerometer"]).all()
+    assert writer.warned == {
+        ("a", name)
+        for name in ("quaternion", "euler", "calibration", "gyroscope", "accelerometer")
+    }
+
+
+def test_flush_interval(tmp_path, monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(recording.time, "monotonic", lambda: now[0])
+    path = tmp_path / "session.rec"
+    writer = RecordingWriter(path, flush_interval=1.0)
+    # The header is written immediately
+    assert len(Recording(path)) == 0
+    writer.append("a", SAMPLE)
+    now[0] += 0.5
+    writer.append("a", SAMPLE)
+    assert len(Recording(path)) == 0
+    now[0] += 0.5
+    writer.append("a", SAMPLE)
+    assert len(Recording(path)) == 3
+    writer.close()
@@ -0,0 +1,85 @@
+import pytest
+
+from imu_tools import schedule
+from imu_tools.schedule import JitterHistogram, iter_deadlines
+
+
+class FakeClock:
+    """Replaces time.monotonic and time.sleep in the schedule module."""
+
+    def __init__(self, monkeypatch):
+        self.now = 100.0
+        monkeypatch.setattr(schedule.time, "monotonic", lambda: self.now)
+        monkeypatch.setattr(schedule.time, "sleep", self.sleep)
+
+    def sleep(self, seconds):
+        assert seconds > 0
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    return FakeClock(monkeypatch)
+
+
+def send_times(clock, items, freq, *, policy="burst", delays=None, histogram=None):
+    """Return the times at which iter_deadlines yields each item. delays maps an
+    item to the time that the consumer spends on it."""
+    times = []
+    for item in iter_deadlines(items, freq, policy=policy, histogram=histogram):
+        times.append(round(clock.now, 6))
+        clock.now += (delays or {}).get(item, 0)
+    return times
+
+
+def test_on_schedule(clock):
+    assert send_times(clock, range(4), 10) == [100.0, 100.1, 100.2, 100.3]
+
+
+def test_slow_consumer_does_not_push_back_the_schedule(clock):
+    # Each item takes 0.05s of the 0.1s period
+    times = send_times(clock, range(4), 10, delays=dict.fromkeys(range(4), 0.05))
+    assert times == [100.0, 100.1, 100.2, 100.3]
+
+
+def test_burst_sends_missed_items_immediately(clock):
+    times = send_times(clock, range(5), 10, delays={0: 0.25})
+    assert times == [100.0, 100.25, 100.25, 100.3, 100.4]
+
+
+def test_skip_abandons_missed_deadlines(clock):
+    times = send_times(clock, range(4), 10, policy="skip", delays={0: 0.25})
+    assert times == [100.0, 100.25, 100.3, 100.4]
+
+
+def test_smear_catches_up_at_smear_rate(clock):
+    times = send_times(clock, range(8), 10, policy="smear", delays={0: 0.35})
+    # Behind schedule, items are sent every period / SMEAR_RATE, until they are
+    # back on the schedule at 100.6
+    assert times == [100.0, 100.35, 100.4, 100.45, 100.5, 100.55, 100.6, 100.7]
+
+
+def test_unknown_policy(clock):
+    with pytest.raises(ValueError):
+        list(iter_deadlines(range(2), 10, policy="drop"))
+
+
+def test_histogram_records_intervals(clock):
+    histogram = JitterHistogram()
+    send_times(clock, range(5), 10, delays={2: 0.15}, histogram=histogram)
+    assert histogram.count == 4
+    assert histogram.max == pytest.approx(0.05)
+    assert sum(histogram.counts) == 4
+    assert len(histogram.format()) == len(histogram.counts) + 1
+
+
+def test_histogram_merge():
+    a, b = JitterHistogram(), JitterHistogram()
+    a.record(0.002)
+    b.record(-0.002)
+    b.record(0.0)
+    a.merge(b)
+    assert a.count == 3
+    assert a.total == pytest.approx(0.004)
+    assert a.max == pytest.approx(0.002)
+    assert JitterHistogram().format() == ["no intervals"]
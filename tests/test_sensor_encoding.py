@@ -0,0 +1,114 @@
+import json
+import struct
+
+import pytest
+
+from imu_tools.pub import gen_sample_blocks
+from imu_tools.sensor_encoding import (
+    decode_payload,
+    decode_payloads,
+    decode_sensor_data,
+    encode_sample_block,
+    encode_sensor_data,
+    is_binary_payload,
+    iter_binary_payloads,
+)
+
+SAMPLE = {
+    "timestamp": 0x12345,
+    "quaternion": (1.0, 0.0, 0.5, -0.5),
+    "accelerometer": (0.25, -9.75, 1.5),
+    "gyroscope": (0.0, 1.0, -2.0),
+    "magnetometer": (30.0, 31.0, 32.0),
+    "linear_acceleration": (0.0, 0.125, 0.0),
+    "euler": (10.0, 20.0, 30.0),
+    "calibration": 0xFF,
+}
+
+
+def test_round_trip():
+    payload = encode_sensor_data(SAMPLE)
+    assert is_binary_payload(payload)
+    # The timestamp is truncated to 16 bits
+    assert decode_sensor_data(payload) == dict(SAMPLE, timestamp=0x2345)
+
+
+def test_frame_size():
+    # A header, and 4 + 3 * 5 float32s and a byte
+    assert len(encode_sensor_data(SAMPLE)) == 4 + 19 * 4 + 1
+
+
+@pytest.mark.parametrize("names", [(), ("quaternion",), ("euler", "calibration")])
+def test_subset_of_fields(names):
+    data = {name: SAMPLE[name] for name in names}
+    decoded = decode_sensor_data(encode_sensor_data(data))
+    assert decoded == dict(data, timestamp=0)
+
+
+def test_unencoded_fields_are_omitted():
+    decoded = decode_sensor_data(encode_sensor_data({"temperature": 27.0}))
+    assert decoded == {"timestamp": 0}
+
+
+def test_unsupported_version():
+    payload = bytearray(encode_sensor_data(SAMPLE))
+    payload[0] = 2
+    with pytest.raises(ValueError):
+        decode_sensor_data(bytes(payload))
+
+
+def test_sample_block_matches_encode_sensor_data():
+    block = next(gen_sample_blocks(block_size=4))
+    frames = encode_sample_block(block)
+    for i, frame in enumerate(frames):
+        sample = {name: block[name][i] for name in frames.dtype.names[3:]}
+        sample = {
+            name: tuple(value) if name != "calibration" else value
+            for name, value in sample.items()
+        }
+        assert frame.tobytes() == encode_sensor_data(sample)
+
+
+def test_iter_binary_payloads():
+    block = next(gen_sample_blocks(block_size=3))
+    payloads = list(iter_binary_payloads([block]))
+    assert len(payloads) == 3
+    for i, payload in enumerate(payloads):
+        data = decode_sensor_data(payload)
+        assert data["quaternion"] == pytest.approx(block["quaternion"][i], rel=1e-6)
+        assert data["calibration"] == 100
+
+
+def test_decode_payload_json():
+    assert decode_payload(b'{"a": [1, 2]}') == {"a": [1, 2]}
+
+
+def test_decode_payload_binary():
+    payload = encode_sensor_data(SAMPLE)
+    assert decode_payload(payload) == decode_sensor_data(payload)
+
+
+@pytest.mark.parametrize(
+    "payload",
+    [
+        b"",
+        b"hello",
+        b"{not json",
+        b"{\xff}",
+        encode_sensor_data(SAMPLE)[:10],  # truncated
+        bytes([0x4A, 0, 1, 2]),  # jsonb data frame, with no schema
+    ],
+)
+def test_decode_payload_unrecognized(payload):
+    assert decode_payload(payload) == payload
+
+
+def test_decode_payloads_matches_decode_payload():
+    payloads = [
+        encode_sensor_data(SAMPLE),
+        json.dumps({"timestamp": 1}).encode(),
+        b"junk",
+        struct.pack(">BBH", 1, 0, 7),
+    ]
+    assert decode_payloads(payloads) == list(map(decode_payload, payloads))
+    assert decode_payloads([]) == []
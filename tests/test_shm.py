@@ -0,0 +1,143 @@
+import math
+import os
+import threading
+from itertools import count
+from multiprocessing import resource_tracker, shared_memory
+
+import pytest
+
+from imu_tools.shm import StateTable, StateTableWriter
+
+SAMPLE = {
+    "timestamp": 1234,
+    "quaternion": [1.0, 0.0, 0.5, -0.5],
+    "euler": [10.0, 20.0, 30.0],
+    "calibration": 255,
+    "temperature": 27.5,
+}
+
+_names = count()
+
+
+@pytest.fixture
+def name():
+    return "imu-test-{}-{}".format(os.getpid(), next(_names))
+
+
+@pytest.fixture
+def writer(name):
+    writer = StateTableWriter(name, slot_count=4)
+    yield writer
+    writer.close()
+
+
+def open_table(name):
+    table = StateTable(name)
+    # The reader stopped this process's resource tracker from unlinking the
+    # segment, but here the tracker is the writer's too
+    resource_tracker.register("/" + table.shm.name, "shared_memory")
+    return table
+
+
+@pytest.fixture
+def table(name, writer):  # pylint: disable=unused-argument
+    table = open_table(name)
+    yield table
+    table.close()
+
+
+def test_round_trip(writer, table):
+    writer.append("a", SAMPLE, received=100.5)
+    sample = table.latest("a")
+    assert sample["received"] == 100.5
+    for key, value in SAMPLE.items():
+        assert sample[key] == value
+    assert math.isnan(sample["gyroscope"][0])
+    assert table.latest("b") is None
+
+
+def test_invalid_fields(writer, table):
+    writer.append("a", dict(SAMPLE, quaternion=[1.0, 0.0, 0.0], calibration="x"))
+    sample = table.latest("a")
+    assert all(math.isnan(value) for value in sample["quaternion"])
+    assert sample["calibration"] == 0
+    assert sample["euler"] == SAMPLE["euler"]
+    assert writer.warned == {("a", "quaternion"), ("a", "calibration")}
+
+
+def test_latest_sample_replaces_the_previous_one(writer, table):
+    writer.append("a", SAMPLE)
+    writer.append("b", dict(SAMPLE, timestamp=1))
+    writer.append("a", dict(SAMPLE, timestamp=2))
+    snapshot = table.snapshot()
+    assert list(snapshot) == ["a", "b"]
+    assert snapshot["a"]["timestamp"] == 2
+    assert table.quaternions() == {"a": SAMPLE["quaternion"], "b": SAMPLE["quaternion"]}
+
+
+def test_devices_beyond_the_table_size_are_ignored(writer, table):
+    for i in range(6):
+        writer.append(str(i), SAMPLE)
+    assert list(table.snapshot()) == ["0", "1", "2", "3"]
+
+
+def test_empty_table(table):
+    assert table.snapshot() == {}
+
+
+def test_not_a_state_table(name):
+    shm = shared_memory.SharedMemory(name=name, create=True, size=64)
+    try:
+        with pytest.raises(ValueError):
+            StateTable(name)
+    finally:
+        shm.close()
+        shm.unlink()
+
+
+def test_leftover_segment(name):
+    # A segment that a writer didn't unlink
+    StateTableWriter(name, slot_count=2).shm.close()
+    writer = StateTableWriter(name, slot_count=2)
+    try:
+        writer.append("a", SAMPLE)
+        table = open_table(name)
+        assert list(table.snapshot()) == ["a"]
+        table.close()
+    finally:
+        writer.close()
+
+
+def test_leftover_segment_too_small(name):
+    shm = shared_memory.SharedMemory(name=name, create=True, size=16)
+    shm.close()
+    writer = StateTableWriter(name, slot_count=2)
+    try:
+        writer.append("a", SAMPLE)
+        assert writer.shm.size >= len(writer.slots) * writer.slots.itemsize
+    finally:
+        writer.close()
+
+
+def test_reads_are_consistent_during_writes(writer, table):
+    # Each sample's fields all have the same value, so a torn read would mix them
+    stop = threading.Event()
+
+    def write():
+        for i in count():
+            if stop.is_set():
+                return
+            value = float(i % 1000)
+            writer.append("a", {"timestamp": i, "quaternion": [value] * 4})
+
+    thread = threading.Thread(target=write)
+    thread.start()
+    try:
+        for _ in range(2000):
+            sample = table.latest("a")
+            if sample:
+                assert len(set(sample["quaternion"])) == 1
+                assert sample["quaternion"][0] == sample["timestamp"] % 1000
+    finally:
+        stop.set()
+        thread.join()
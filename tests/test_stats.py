@@ -0,0 +1,41 @@
+import math
+
+import pytest
+
+from imu_tools.stats import DeviceStats
+
+
+def test_intervals():
+    stats = DeviceStats()
+    for arrival in (10.0, 10.01, 10.03):
+        stats.record(arrival, 1000.0)
+    summary = stats.summary(elapsed=1.0)
+    assert summary["rate"] == 3
+    assert summary["max_gap"] == pytest.approx(20)
+    assert math.isnan(summary["delay"])
+
+
+def test_batch_frames():
+    # The samples of a batch frame share an arrival time
+    stats = DeviceStats()
+    for arrival in (10.0, 10.0, 10.0, 10.1, 10.1, 10.1):
+        stats.record(arrival, 1000.0)
+    summary = stats.summary(elapsed=1.0)
+    assert summary["rate"] == 6
+    assert summary["p50"] == pytest.approx(100)
+    assert summary["max_gap"] == pytest.approx(100)
+
+
+def test_epoch_delay():
+    stats = DeviceStats()
+    stats.record(10.0, 1_600_000_000.25, timestamp=1_600_000_000_000)
+    assert stats.summary(elapsed=1.0)["delay"] == pytest.approx(250)
+
+
+def test_relative_delay():
+    stats = DeviceStats()
+    # The delay is measured from the receive time, not the time of the call
+    stats.record(10.0, 1000.0, timestamp=5000)
+    stats.record(10.1, 1000.15, timestamp=5100)
+    stats.record(10.2, 1000.2, timestamp=5200)
+    assert stats.delays == pytest.approx([0, 50, 0])
@@ -0,0 +1,31 @@
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from imu_tools.batch import encode_batch
+from imu_tools.capture import CaptureWriter, iter_capture
+from imu_tools.sub import capture_message, received_time
+
+
+def message(topic, payload, timestamp=None):
+    return SimpleNamespace(topic=topic, payload=payload, timestamp=timestamp)
+
+
+def test_received_time():
+    msg = message("imu/a", b"{}", time.monotonic() - 2)
+    assert received_time(msg) == pytest.approx(time.time() - 2, abs=0.1)
+    assert received_time(message("imu/a", b"{}")) == pytest.approx(time.time())
+
+
+def test_capture_message(tmp_path):
+    path = tmp_path / "session.cap"
+    frame = encode_batch([b'{"timestamp": 1}', b'{"timestamp": 2}'])
+    with CaptureWriter(path) as capture:
+        capture_message(capture, message("imu/a", frame))
+        capture_message(capture, message("imu/control/a", b'{"command": "ping"}'))
+        capture_message(capture, message("imu/control-reply/a", b'{"ok": true}'))
+    # Batch frames are captured as they were received
+    assert [(topic, payload) for topic, _t, payload in iter_capture(path)] == [
+        ("imu/a", frame)
+    ]
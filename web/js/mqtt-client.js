@@ -10,6 +10,9 @@ const connectionSettings = {
     username: '',
     password: '',
     deviceId: '',
+    // 'imu' for the raw samples, or e.g. 'imu-agg/100ms' for the aggregates
+    // that `aggregate` publishes
+    topicPrefix: 'imu',
 };
 
 let client = null;
@@ -122,7 +125,8 @@ function startSubscription() {
         useSSL,
         onSuccess: () => {
             const deviceId = connectionSettings.deviceId.trim();
-            let topicString = 'imu/' + (deviceId || '#');
+            const topicPrefix = connectionSettings.topicPrefix.trim() || 'imu';
+            let topicString = topicPrefix + '/' + (deviceId || '#');
             setMqttConnectionStatus(
                 'Connected to mqtt://' + hostname + ':' + port
             );